@@ -0,0 +1,269 @@
+#
+# File: aggregates.py
+#
+# Maintains materialized rating aggregates for the object tier.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# Rather than scanning the whole Ratings table every time the number of
+# reviews or the average rating of a movie is needed, the per-movie count,
+# sum and 0..10 histogram of ratings are kept in the Movie_Rating_Summary
+# table. The summary is built once from Ratings and then kept current by
+# triggers, so every insert, update or delete on Ratings (whether it comes
+# from add_review or any other loader) is reflected immediately. A verify
+# and a rebuild operation are provided for when the summary drifts from the
+# raw table.
+#
+# The number of rows of Movies and Ratings is kept the same way, in the
+# Table_Counts table, so counting them does not need a scan of either table.
+# Both can be verified and rebuilt from the command line:
+#
+#   python3 aggregates.py verify [MovieLens.db]
+#   python3 aggregates.py rebuild [MovieLens.db]
+#
+import sys
+import sqlite3
+import datatier
+import analytics
+import leaderboard
+import detailcache
+
+
+# Ratings are whole numbers 0..10, one histogram bucket per value
+HISTOGRAM = ["Rating_" + str(r) for r in range(11)]
+
+# Tables whose # of rows is kept in Table_Counts
+COUNTED = ["Movies", "Ratings"]
+
+
+# SQL text shared by the functions below
+def _create_table_sql():
+    buckets = "".join(", " + h + " Integer Not Null Default 0" for h in HISTOGRAM)
+    return """Create Table If Not Exists Movie_Rating_Summary(
+    Movie_ID Integer Primary Key, Num_Reviews Integer Not Null Default 0,
+    Sum_Ratings Integer Not Null Default 0""" + buckets + ")"
+
+
+def _apply_sql(row, sign):
+    buckets = "".join(", {0} = {0} {1} ({2}.Rating Is {3})".format(h, sign, row, r)
+                      for r, h in enumerate(HISTOGRAM))
+    return """Insert Or Ignore Into Movie_Rating_Summary(Movie_ID) Values ({0}.Movie_ID);
+    Update Movie_Rating_Summary Set
+    Num_Reviews = Num_Reviews {1} ({0}.Rating Is Not Null),
+    Sum_Ratings = Sum_Ratings {1} coalesce({0}.Rating, 0){2}
+    Where Movie_ID = {0}.Movie_ID;""".format(row, sign, buckets)
+
+
+def _trigger_sql():
+    return [
+        """Create Trigger If Not Exists Ratings_Summary_Insert After Insert
+        On Ratings Begin """ + _apply_sql("new", "+") + " End",
+        """Create Trigger If Not Exists Ratings_Summary_Delete After Delete
+        On Ratings Begin """ + _apply_sql("old", "-") + " End",
+        """Create Trigger If Not Exists Ratings_Summary_Update After Update
+        Of Movie_ID, Rating On Ratings Begin """ + _apply_sql("old", "-")
+        + _apply_sql("new", "+") + " End",
+    ]
+
+
+def _create_counts_sql():
+    return """Create Table If Not Exists Table_Counts(
+    Table_Name Text Primary Key, Num_Rows Integer Not Null) Without Rowid"""
+
+
+def _count_trigger_sql():
+    triggers = []
+    for table in COUNTED:
+        for event, sign in (("Insert", "+"), ("Delete", "-")):
+            triggers.append("""Create Trigger If Not Exists {0}_Count_{1} After {1}
+            On {0} Begin Update Table_Counts Set Num_Rows = Num_Rows {2} 1
+            Where Table_Name = '{0}'; End""".format(table, event, sign))
+    return triggers
+
+
+def _raw_summary_sql():
+    buckets = "".join(", total(Rating Is {0}) As {1}".format(r, h)
+                      for r, h in enumerate(HISTOGRAM))
+    return """Select Movie_ID, count(Rating) As Num_Reviews,
+    total(Rating) As Sum_Ratings""" + buckets + """ From Ratings
+    Group By Movie_ID"""
+
+
+# install_summary:
+#
+# Creates the Movie_Rating_Summary and Table_Counts tables and
+# the triggers that keep them current. A table that did not
+# exist yet is built from the Ratings and Movies tables. Calling
+# this on a database that already has both installed does
+# nothing.
+#
+# Returns: 1 if the summary is installed, 0 if an internal
+#          error occurred (in which case an error msg is
+#          already output).
+def install_summary(dbConn):
+    sql = """Select name From sqlite_master Where type = 'table'
+    And name In ('Movie_Rating_Summary', 'Table_Counts')"""
+    rows = datatier.select_n_rows(dbConn, sql)
+
+    if rows is None:
+        return 0
+    installed = {row[0] for row in rows}
+
+    actions = [(_create_table_sql(), []), (_create_counts_sql(), [])]
+    actions += [(sql, []) for sql in _trigger_sql() + _count_trigger_sql()]
+
+    # Build the summary and counts from scratch only the first time around
+    if "Movie_Rating_Summary" not in installed:
+        actions += _rebuild_actions()
+    if "Table_Counts" not in installed:
+        actions += _recount_actions()
+
+    if datatier.perform_transaction(dbConn, actions) == -1:
+        return 0
+
+    return 1
+
+
+def _rebuild_actions():
+    columns = ", ".join(["Movie_ID", "Num_Reviews", "Sum_Ratings"] + HISTOGRAM)
+    return [
+        ("Delete From Movie_Rating_Summary", []),
+        ("Insert Into Movie_Rating_Summary(" + columns + ") " + _raw_summary_sql(), []),
+    ]
+
+
+# rebuild_summary:
+#
+# Discards the contents of Movie_Rating_Summary and recomputes
+# it from the Ratings table in a single transaction. The cached
+# movie details of the connection are cleared as well.
+#
+# Returns: # of movies in the rebuilt summary; if an error
+#          occurs -1 is returned (and an error msg is output).
+def rebuild_summary(dbConn):
+    with leaderboard.writing(dbConn):
+        if datatier.perform_transaction(dbConn, _rebuild_actions()) == -1:
+            return -1
+
+        leaderboard.invalidate(dbConn)
+        analytics.invalidate(dbConn)
+
+        # Cached details hold the ratings from before the rebuild
+        cache = detailcache.get_cache(dbConn)
+        if cache is not None:
+            cache.clear()
+
+    row = datatier.select_one_row(dbConn, "Select count(*) From Movie_Rating_Summary")
+    if row is None:
+        return -1
+
+    return row[0]
+
+
+# verify_summary:
+#
+# Compares Movie_Rating_Summary against a fresh aggregate of
+# the Ratings table.
+#
+# Returns: list of the ids of movies whose summary row is
+#          missing, stale or left over, in ascending order;
+#          an empty list means the summary is consistent.
+#          None is returned if an internal error occurred.
+def verify_summary(dbConn):
+    differs = " Or ".join("S.{0} != R.{0}".format(c)
+                          for c in ["Num_Reviews", "Sum_Ratings"] + HISTOGRAM)
+    sql = """Select R.Movie_ID From (""" + _raw_summary_sql() + """) R
+    Left Join Movie_Rating_Summary S On S.Movie_ID = R.Movie_ID
+    Where S.Movie_ID Is Null Or """ + differs + """
+    Union
+    Select S.Movie_ID From Movie_Rating_Summary S Where S.Num_Reviews != 0
+    And Not Exists (Select 1 From Ratings Where Ratings.Movie_ID = S.Movie_ID)
+    Order By 1"""
+    rows = datatier.select_n_rows(dbConn, sql)
+
+    if rows is None:
+        return None
+
+    return [row[0] for row in rows]
+
+
+def _recount_actions():
+    actions = [("Delete From Table_Counts", [])]
+    for table in COUNTED:
+        actions.append(("Insert Into Table_Counts(Table_Name, Num_Rows) Select '"
+                        + table + "', count(*) From " + table, []))
+    return actions
+
+
+# rebuild_counts:
+#
+# Recounts the rows of every table in Table_Counts, in a single
+# transaction.
+#
+# Returns: 1 if successful; if an error occurs 0 is returned
+#          (and an error msg is output).
+def rebuild_counts(dbConn):
+    if datatier.perform_transaction(dbConn, _recount_actions()) == -1:
+        return 0
+    return 1
+
+
+# verify_counts:
+#
+# Compares Table_Counts against a real count of each table.
+#
+# Returns: list of (table, # of rows stored, actual # of rows)
+#          for every table whose count is wrong or missing (with
+#          None stored); an empty list means the counts are
+#          consistent. None is returned if an internal error
+#          occurred.
+def verify_counts(dbConn):
+    wrong = []
+    for table in COUNTED:
+        stored = datatier.select_one_row(
+            dbConn, "Select Num_Rows From Table_Counts Where Table_Name = ?", [table])
+        actual = datatier.select_one_row(dbConn, "Select count(*) From " + table)
+        if stored is None or actual is None:
+            return None
+
+        stored = stored[0] if stored != () else None
+        if stored != actual[0]:
+            wrong.append((table, stored, actual[0]))
+
+    return wrong
+
+
+##################################################################
+#
+# main:
+#
+# Usage: python3 aggregates.py (verify | rebuild) [database]
+#
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("verify", "rebuild"):
+        print("usage: python3 aggregates.py (verify | rebuild) [database]")
+        sys.exit(2)
+
+    path = sys.argv[2] if len(sys.argv) > 2 else "MovieLens.db"
+    dbConn = sqlite3.connect(path)
+
+    if install_summary(dbConn) == 0:
+        sys.exit(1)
+
+    if sys.argv[1] == "verify":
+        stale = verify_summary(dbConn)
+        wrong = verify_counts(dbConn)
+        if stale is None or wrong is None:
+            sys.exit(1)
+        print("# of movies out of date:", len(stale))
+        for table, stored, actual in wrong:
+            print("# of rows of", table + ":", stored, "stored,", actual, "actual")
+        if len(stale) > 0 or len(wrong) > 0:
+            print("Run 'python3 aggregates.py rebuild' to repair the summary...")
+            sys.exit(1)
+    else:
+        movies = rebuild_summary(dbConn)
+        if movies == -1 or rebuild_counts(dbConn) == 0:
+            sys.exit(1)
+        print("Summary rebuilt for", f"{movies:,}", "movies")
@@ -0,0 +1,259 @@
+#
+# File: analytics.py
+#
+# Per-movie rating distributions and statistics, computed with NumPy.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# The 0..10 histogram of every movie's ratings is already kept current in
+# Movie_Rating_Summary (see aggregates.py), and since ratings are whole
+# numbers it holds everything needed for any statistic of the ratings. A
+# RatingAnalytics loads the histograms of all movies once into a matrix,
+# one row per movie in order by id, and computes the count, mean, standard
+# deviation, quartiles and median of every movie in one vectorized pass,
+# without reading Ratings again. Bayesian averages, which pull the mean of
+# a movie with few reviews towards the mean of all ratings, are computed on
+# request from the counts and means, as they change with every review.
+#
+# The analytics are loaded the first time they are needed for a connection
+# and then patched in place by record_review as reviews are added; call
+# invalidate if the database is modified behind the object tier's back. As
+# for the leaderboard, analytics loaded while reviews are being added are not
+# kept (see leaderboard.writing).
+# NumPy is only needed once analytics are asked for.
+#
+import threading
+import datatier
+import aggregates
+import leaderboard
+import stmtcache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Weight of the mean of all ratings in a Bayesian average, counted
+# as that many reviews; the same as for the weighted leaderboard
+PRIOR_WEIGHT = leaderboard.PRIOR_WEIGHT
+
+# The statistics kept per movie, in the order of the columns of
+# RatingAnalytics.Stats
+STATS = ["Num_Reviews", "Avg_Rating", "Std_Dev", "P25", "Median", "P75"]
+
+
+# _quantiles:
+#
+# Returns: for each row of cumulative histogram counts, the given
+#          quantile (0..1) of the ratings, interpolated between the
+#          two nearest ratings like numpy.quantile; nan for a row
+#          with no ratings.
+def _quantiles(cumulative, counts, q):
+    rank = q * (counts - 1)
+    low = numpy.floor(rank)
+    frac = rank - low
+
+    # The rating at 0-based rank r is the # of buckets holding <= r ratings
+    below = (cumulative <= low[:, None]).sum(axis=1)
+    above = (cumulative <= numpy.ceil(rank)[:, None]).sum(axis=1)
+
+    result = below + (above - below) * frac
+    return numpy.where(counts > 0, result, numpy.nan)
+
+
+# _compute:
+#
+# Returns: a matrix with one row per histogram and one column per
+#          entry of STATS.
+def _compute(histograms):
+    values = numpy.arange(histograms.shape[1])
+    counts = histograms.sum(axis=1)
+    n = numpy.maximum(counts, 1)
+
+    means = (histograms @ values) / n
+    squares = (histograms @ (values * values)) / n
+    std_devs = numpy.sqrt(numpy.maximum(squares - means * means, 0.0))
+
+    cumulative = histograms.cumsum(axis=1)
+    stats = numpy.column_stack([
+        counts, means, std_devs,
+        _quantiles(cumulative, counts, 0.25),
+        _quantiles(cumulative, counts, 0.5),
+        _quantiles(cumulative, counts, 0.75),
+    ])
+    stats[counts == 0, 1:3] = numpy.nan
+    return stats
+
+
+class RatingAnalytics:
+    def __init__(self, rows):
+        # rows: (Movie_ID, Rating_0, ..., Rating_10), in order by id
+        table = numpy.array(rows, dtype=numpy.int64).reshape(-1, 1 + len(aggregates.HISTOGRAM))
+        self._Movie_IDs = table[:, 0].copy()
+        self._Histograms = table[:, 1:].copy()
+        self._Stats = _compute(self._Histograms)
+        self._Lock = threading.Lock()
+
+        self._Num_Ratings = int(self._Histograms.sum())
+        self._Sum_Ratings = int((self._Histograms @ numpy.arange(len(aggregates.HISTOGRAM))).sum())
+
+    @property
+    def Movie_IDs(self):
+        return self._Movie_IDs
+
+    @property
+    def Histograms(self):
+        return self._Histograms
+
+    # One row per movie, one column per entry of STATS
+    @property
+    def Stats(self):
+        return self._Stats
+
+    # Mean of all the ratings of all movies
+    @property
+    def Global_Mean(self):
+        if self._Num_Ratings == 0:
+            return 0.0
+        return self._Sum_Ratings / self._Num_Ratings
+
+    # _find:
+    #
+    # Returns: the row of the given movie, or -1 if it has none.
+    def _find(self, movie_id):
+        i = int(numpy.searchsorted(self._Movie_IDs, movie_id))
+        if i < len(self._Movie_IDs) and self._Movie_IDs[i] == movie_id:
+            return i
+        return -1
+
+    # add_rating:
+    #
+    # Counts one more rating (a whole number 0..10) for the given
+    # movie, recomputing its statistics.
+    def add_rating(self, movie_id, rating):
+        with self._Lock:
+            i = self._find(movie_id)
+            if i == -1:
+                i = int(numpy.searchsorted(self._Movie_IDs, movie_id))
+                self._Movie_IDs = numpy.insert(self._Movie_IDs, i, movie_id)
+                self._Histograms = numpy.insert(self._Histograms, i, 0, axis=0)
+                self._Stats = numpy.insert(self._Stats, i, 0.0, axis=0)
+
+            self._Histograms[i, rating] += 1
+            self._Stats[i] = _compute(self._Histograms[i:i + 1])[0]
+            self._Num_Ratings += 1
+            self._Sum_Ratings += rating
+
+    # histogram:
+    #
+    # Returns: the # of ratings 0..10 of the given movie, as a list,
+    #          or None if the movie has no ratings.
+    def histogram(self, movie_id):
+        with self._Lock:
+            i = self._find(movie_id)
+            if i == -1:
+                return None
+            return self._Histograms[i].tolist()
+
+    # stats:
+    #
+    # Returns: a dictionary with the statistics of STATS for the given
+    #          movie, plus its Bayesian average, or None if the movie
+    #          has no ratings.
+    def stats(self, movie_id, prior_weight=PRIOR_WEIGHT):
+        with self._Lock:
+            i = self._find(movie_id)
+            if i == -1:
+                return None
+            row = self._Stats[i].tolist()
+
+        stats = dict(zip(STATS, row))
+        stats["Num_Reviews"] = int(stats["Num_Reviews"])
+        stats["Bayesian_Avg"] = self._bayesian(stats["Num_Reviews"], stats["Avg_Rating"],
+                                               prior_weight)
+        return stats
+
+    def _bayesian(self, counts, means, prior_weight):
+        if prior_weight == 0:
+            return means
+        return (counts * means + prior_weight * self.Global_Mean) / (counts + prior_weight)
+
+    # bayesian_averages:
+    #
+    # Returns: an array with the Bayesian average of every movie, in
+    #          the order of Movie_IDs.
+    def bayesian_averages(self, prior_weight=PRIOR_WEIGHT):
+        with self._Lock:
+            counts = self._Stats[:, 0]
+            means = numpy.nan_to_num(self._Stats[:, 1])
+            return self._bayesian(counts, means, prior_weight)
+
+
+# Analytics loaded so far, one per database connection
+_analytics = {}
+_analytics_lock = threading.Lock()
+
+
+# get_analytics:
+#
+# Returns the analytics for the given connection, loading the
+# histograms from Movie_Rating_Summary on first use. If reviews
+# are added while they load, they are returned without being kept
+# (nor patched), and the next call loads them again.
+#
+# Returns: a RatingAnalytics object; if NumPy is not installed
+#          or an internal error occurs None is returned (and an
+#          error msg is output).
+def get_analytics(dbConn):
+    analytics = _analytics.get(dbConn)
+    if analytics is not None:
+        return analytics
+
+    if numpy is None:
+        print("get_analytics failed: NumPy is not installed")
+        return None
+
+    sql = ("Select Movie_ID, " + ", ".join(aggregates.HISTOGRAM)
+           + " From Movie_Rating_Summary Where Num_Reviews > 0 Order By Movie_ID")
+    settled_at = leaderboard.settled(dbConn)
+    rows = datatier.select_n_rows(dbConn, sql)
+
+    if rows is None:
+        return None
+
+    analytics = RatingAnalytics(rows)
+    kept = leaderboard.keep_built(dbConn, _analytics, analytics, settled_at)
+    if kept is None:
+        return analytics
+    return kept
+
+
+# record_review:
+#
+# Patches the analytics of the given connection, if they have
+# been loaded, after a rating was inserted for the given movie.
+# movie_id must be the id as stored in the Movies table.
+def record_review(dbConn, movie_id, rating):
+    analytics = _analytics.get(dbConn)
+    if analytics is None:
+        return
+
+    # Only whole ratings 0..10 have a histogram bucket
+    if isinstance(rating, int) and 0 <= rating < len(aggregates.HISTOGRAM):
+        analytics.add_rating(movie_id, rating)
+    else:
+        invalidate(dbConn)
+
+
+# invalidate:
+#
+# Discards the analytics of the given connection; they are loaded
+# again the next time they are needed.
+def invalidate(dbConn):
+    with _analytics_lock:
+        _analytics.pop(dbConn, None)
+
+
+stmtcache.on_close(invalidate)
@@ -0,0 +1,434 @@
+#
+# File: batchmode.py
+#
+# Runs the commands of the MovieLens app non-interactively.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# The same five commands as the interactive program (see main.py), read as
+# JSON objects, one per line, and answered the same way, one JSON object per
+# line. Each command names what to do and its arguments:
+#
+#   {"command": "movies", "pattern": "Star%"}                    (or "1")
+#   {"command": "details", "movie_id": 11}                       (or "2")
+#   {"command": "top", "n": 10, "min_reviews": 100}              (or "3")
+#        optionally with "ranking": "weighted"
+#   {"command": "review", "movie_id": 11, "rating": 8}           (or "4")
+#   {"command": "tagline", "movie_id": 11, "tagline": "..."}     (or "5")
+#   {"command": "stats"}
+#
+# Commands may carry an "id", which is copied into their answer. An answer
+# is {"id": ..., "ok": true, "result": ...}, or {"id": ..., "ok": false,
+# "error": "..."} for a command that could not be carried out.
+#
+# In batch mode the commands are read from a file (or standard input) and
+# run on one connection; in server mode an HTTP server answers the commands
+# POSTed to it, running them on a connection pool (which switches the
+# database to WAL mode, see connpool.py), with the reviews of
+# concurrent requests written in group commits (see writebehind.py). Either
+# way the database is opened, and its caches warmed up, only once:
+#
+#   python3 batchmode.py batch [commands.jsonl] [--db MovieLens.db]
+#   python3 batchmode.py serve [port] [--db MovieLens.db]
+#
+# With --snapshot ro, immutable or memory the database is opened read-only
+# in that mode (see snapshot.py), for serving lookups from a copy that never
+# changes; the review and tagline commands then fail.
+#
+import sys
+import json
+import sqlite3
+import argparse
+import http.server
+import datatier
+import objecttier
+import aggregates
+import connpool
+import detailcache
+import dimensions
+import instrument
+import snapshot
+import titlesearch
+import leaderboard
+import writebehind
+
+
+# Movies listed at most by the movies command, unless it gives a limit
+MAX_MOVIES = 100
+
+
+class CommandError(Exception):
+    pass
+
+
+# _argument:
+#
+# Returns: the named argument of the given command, checked to be
+#          of the given kind (str or int) if one is given; raises
+#          CommandError if it is missing or of another kind. Values
+#          are never converted, so null is not taken as "None" nor
+#          7.9 as 7; only a number such as 8.0 counts as an int, as
+#          JSON does not tell it apart from 8.
+def _argument(request, name, kind=None):
+    if name not in request:
+        raise CommandError("missing argument: " + name)
+    value = request[name]
+
+    if kind is int:
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise CommandError("invalid argument: " + name)
+    elif kind is not None and not isinstance(value, kind):
+        raise CommandError("invalid argument: " + name)
+
+    return value
+
+
+# _writable:
+#
+# Raises CommandError if the given connection or pool is read-only.
+def _writable(dbConn):
+    if snapshot.read_only(dbConn):
+        raise CommandError("database is read-only")
+
+
+# command_movies:
+#
+# Returns: the # of movies matching the pattern and up to limit
+#          (at most MAX_MOVIES) of them, in order by title.
+def command_movies(dbConn, request):
+    pattern = _argument(request, "pattern", str)
+    mode = request.get("mode", "like")
+    limit = _argument(request, "limit", int) if "limit" in request else MAX_MOVIES
+    if limit < 0 or limit > MAX_MOVIES:
+        raise CommandError("invalid argument: limit")
+
+    found = objecttier.count_movies(dbConn, pattern, mode)
+    if found == -1:
+        raise CommandError("movie search failed")
+
+    movies = objecttier.get_movies(dbConn, pattern, mode, limit=limit)
+    if movies is None:
+        raise CommandError("movie search failed")
+
+    return {
+        "found": found,
+        "movies": [{"movie_id": m.Movie_ID, "title": m.Title, "year": m.Release_Year}
+                   for m in movies],
+    }
+
+
+# command_details:
+#
+# Returns: every detail of the movie with the given id.
+def command_details(dbConn, request):
+    m = objecttier.get_movie_details(dbConn, _argument(request, "movie_id", int))
+    if m is None:
+        raise CommandError("no such movie")
+
+    return {
+        "movie_id": m.Movie_ID,
+        "title": m.Title,
+        "release_date": m.Release_Date,
+        "runtime": m.Runtime,
+        "original_language": m.Original_Language,
+        "budget": m.Budget,
+        "revenue": m.Revenue,
+        "num_reviews": m.Num_Reviews,
+        "avg_rating": m.Avg_Rating,
+        "genres": m.Genres,
+        "production_companies": m.Production_Companies,
+        "tagline": m.Tagline,
+    }
+
+
+# command_top:
+#
+# Returns: the top n movies by average rating (or weighted rating,
+#          see leaderboard.py) among those with at least min_reviews
+#          reviews.
+def command_top(dbConn, request):
+    n = _argument(request, "n", int)
+    min_reviews = _argument(request, "min_reviews", int)
+    if n < 1:
+        raise CommandError("n must be positive")
+    if min_reviews < 1:
+        raise CommandError("min_reviews must be positive")
+    ranking = request.get("ranking", "raw")
+    if ranking not in leaderboard.RANKINGS:
+        raise CommandError("ranking must be one of: " + ", ".join(leaderboard.RANKINGS))
+
+    movies = objecttier.get_top_N_movies(dbConn, n, min_reviews, ranking)
+    if movies is None:
+        raise CommandError("top movies failed")
+
+    return [{"movie_id": m.Movie_ID, "title": m.Title, "year": m.Release_Year,
+             "num_reviews": m.Num_Reviews, "avg_rating": m.Avg_Rating}
+            for m in movies]
+
+
+# command_review:
+#
+# Returns: True once the rating is added to the given movie.
+def command_review(dbConn, request):
+    _writable(dbConn)
+    rating = _argument(request, "rating", int)
+    if rating < 0 or rating > 10:
+        raise CommandError("invalid rating")
+
+    movie_id = _argument(request, "movie_id", int)
+
+    # Reviews from concurrent requests share commits if write-behind is enabled
+    reviews = writebehind.get_queue(dbConn)
+    if reviews is not None:
+        added = reviews.add_review(movie_id, rating)
+    else:
+        added = objecttier.add_review(dbConn, movie_id, rating)
+
+    if added == 0:
+        raise CommandError("no such movie")
+    return True
+
+
+# command_tagline:
+#
+# Returns: True once the tagline of the given movie is set.
+def command_tagline(dbConn, request):
+    _writable(dbConn)
+    tagline = _argument(request, "tagline", str)
+    if objecttier.set_tagline(dbConn, _argument(request, "movie_id", int), tagline) == 0:
+        raise CommandError("no such movie")
+    return True
+
+
+# command_stats:
+#
+# Returns: the query timings and the detail cache counters.
+def command_stats(dbConn, request):
+    cache = detailcache.get_cache(dbConn)
+    return {
+        "queries": instrument.stats(),
+        "detail_cache": cache.stats() if cache is not None else None,
+    }
+
+
+COMMANDS = {
+    "movies": command_movies,
+    "details": command_details,
+    "top": command_top,
+    "review": command_review,
+    "tagline": command_tagline,
+    "stats": command_stats,
+}
+
+# The numbers of the commands in the interactive program
+ALIASES = {"1": "movies", "2": "details", "3": "top", "4": "review", "5": "tagline"}
+
+
+# execute:
+#
+# Runs one command, given as a dictionary (see the top of the file).
+# A command that fails unexpectedly is answered as failed too, so
+# one bad command never stops the others.
+#
+# Returns: the answer, as a dictionary.
+def execute(dbConn, request):
+    if not isinstance(request, dict):
+        return {"id": None, "ok": False, "error": "command must be a JSON object"}
+
+    answer = {"id": request.get("id")}
+    name = str(request.get("command"))
+    command = COMMANDS.get(ALIASES.get(name, name))
+    if command is None:
+        answer["ok"] = False
+        answer["error"] = "unknown command: " + name
+        return answer
+
+    try:
+        result = command(dbConn, request)
+    except CommandError as err:
+        answer["ok"] = False
+        answer["error"] = str(err)
+        return answer
+    except Exception as err:
+        print(name, "command failed:", repr(err))
+        answer["ok"] = False
+        answer["error"] = "internal error: " + str(err)
+        return answer
+
+    answer["ok"] = True
+    answer["result"] = result
+    return answer
+
+
+# execute_line:
+#
+# Runs the command on the given line of JSON.
+#
+# Returns: the answer as a line of JSON, or None if the line is
+#          blank.
+def execute_line(dbConn, line):
+    line = line.strip()
+    if line == "":
+        return None
+
+    try:
+        request = json.loads(line)
+    except ValueError as err:
+        answer = {"id": None, "ok": False, "error": "invalid JSON: " + str(err)}
+    else:
+        answer = execute(dbConn, request)
+    return json.dumps(answer)
+
+
+# open_database:
+#
+# Gets the given connection or pool ready to serve commands: the
+# rating summary and the title index are installed (unless read_only,
+# in which case the summary must already be, and title searches fall
+# back to "like" without the index), the leaderboard and the genre
+# and company tables loaded and a detail cache of the given size
+# enabled.
+#
+# Returns: 1 if successful, 0 if not (an error msg is output).
+def open_database(dbConn, cache_size=4096, read_only=False):
+    if not read_only and aggregates.install_summary(dbConn) == 0:
+        return 0
+    if not read_only and titlesearch.install_index(dbConn) == 0:
+        return 0
+    if leaderboard.get_leaderboard(dbConn) is None:
+        return 0
+    if dimensions.load(dbConn) is None:
+        return 0
+    detailcache.enable(dbConn, cache_size)
+    return 1
+
+
+# run_batch:
+#
+# Runs every command read from infile, writing each answer to
+# outfile as soon as it is known.
+#
+# Returns: the # of commands run.
+def run_batch(dbConn, infile, outfile):
+    count = 0
+    for line in infile:
+        answer = execute_line(dbConn, line)
+        if answer is None:
+            continue
+        outfile.write(answer + "\n")
+        outfile.flush()
+        count += 1
+    return count
+
+
+# CommandHandler:
+#
+# Answers POST requests whose body is one or more commands, one per
+# line, with their answers, one per line. The server's dbConn is a
+# ConnectionPool, as each request is handled on its own thread.
+class CommandHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8", errors="replace")
+
+        answers = []
+        for line in body.splitlines():
+            answer = execute_line(self.server.dbConn, line)
+            if answer is not None:
+                answers.append(answer + "\n")
+        data = "".join(answers).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# make_server:
+#
+# Returns: an HTTP server answering commands on the given address,
+#          against a pool of connections to the given database (a
+#          SnapshotPool in the given snapshot mode, if any), or None
+#          if the database could not be opened (an error msg is
+#          already output). Call its serve_forever method.
+def make_server(path, host="127.0.0.1", port=8080, readers=4, snapshot_mode=None):
+    try:
+        if snapshot_mode is None:
+            pool = connpool.ConnectionPool(path, size=readers, wal=True)
+        else:
+            pool = snapshot.SnapshotPool(path, snapshot_mode, size=readers)
+    except sqlite3.Error as err:
+        print("make_server failed:", err)
+        return None
+
+    if open_database(pool, read_only=snapshot_mode is not None) == 0:
+        pool.close()
+        return None
+
+    if snapshot_mode is None:
+        writebehind.enable(pool)
+
+    server = http.server.ThreadingHTTPServer((host, port), CommandHandler)
+    server.dbConn = pool
+    return server
+
+
+##################################################################
+#
+# main:
+#
+# Usage: python3 batchmode.py batch [commands.jsonl] [--db database]
+#        python3 batchmode.py serve [port] [--db database]
+#        (either one with [--snapshot ro | immutable | memory])
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run MovieLens commands non-interactively.")
+    parser.add_argument("mode", choices=["batch", "serve"])
+    parser.add_argument("source", nargs="?",
+                        help="commands file for batch (default: stdin), port for serve (default: 8080)")
+    parser.add_argument("--db", default="MovieLens.db", help="database file (default: MovieLens.db)")
+    parser.add_argument("--host", default="127.0.0.1", help="address to serve on (default: 127.0.0.1)")
+    parser.add_argument("--snapshot", choices=snapshot.MODES,
+                        help="open the database read-only in this mode (see snapshot.py)")
+    args = parser.parse_args()
+
+    instrument.enable(slow_threshold=0.25, stream=sys.stderr)
+
+    # The tiers print their error msgs, keep them out of the answers
+    answers = sys.stdout
+    sys.stdout = sys.stderr
+
+    if args.mode == "batch":
+        if args.snapshot is None:
+            dbConn = datatier.connect(args.db)
+        else:
+            dbConn = snapshot.connect(args.db, args.snapshot)
+        if dbConn is None or open_database(dbConn, read_only=args.snapshot is not None) == 0:
+            sys.exit(1)
+        if args.source is None:
+            run_batch(dbConn, sys.stdin, answers)
+        else:
+            with open(args.source, encoding="utf-8") as infile:
+                run_batch(dbConn, infile, answers)
+        dbConn.close()
+    else:
+        server = make_server(args.db, args.host, int(args.source or 8080),
+                             snapshot_mode=args.snapshot)
+        if server is None:
+            sys.exit(1)
+        print("Serving MovieLens commands on http://{}:{}/".format(*server.server_address),
+              file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        writebehind.disable(server.dbConn)
+        server.dbConn.close()
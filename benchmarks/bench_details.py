@@ -0,0 +1,77 @@
+#
+# File: bench_details.py
+#
+# Compares the latency of the movie details engines.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# Builds a synthetic MovieLens database in memory and times
+# objecttier.get_movie_details for the same random movie ids with the
+# "batch" engine (one query per facet) and the "json" engine (a single
+# query), reporting the p50 and p99 latency of each. The "lazy" engine is
+# timed as a caller that only needs the title and release date uses it,
+# and again reading every facet. Run from the top-level directory of the
+# application:
+#
+#   python3 -m benchmarks.bench_details [num_movies] [num_lookups]
+#
+import sys
+import time
+import random
+
+import datatier
+import objecttier
+import aggregates
+from benchmarks import synthdb
+from benchmarks.timing import percentile
+
+
+def time_lookups(dbConn, ids, engine, every_facet=False):
+    times = []
+    for movie_id in ids:
+        start = time.perf_counter()
+        m = objecttier.get_movie_details(dbConn, movie_id, engine)
+        if m is not None:
+            m.Title, m.Release_Date
+            if every_facet:
+                m.Num_Reviews, m.Tagline, m.Genres, m.Production_Companies
+        times.append((time.perf_counter() - start) * 1e6)
+    times.sort()
+    return times
+
+
+def main(num_movies, num_lookups):
+    dbConn = datatier.connect(":memory:")
+    synthdb.create_schema(dbConn)
+    synthdb.add_movies(dbConn, num_movies)
+    synthdb.add_details(dbConn, num_movies)
+    synthdb.add_ratings(dbConn, num_movies, num_movies * 20)
+    aggregates.install_summary(dbConn)
+
+    # Without these both engines would scan the link tables on every lookup
+    dbConn.execute("Create Index Movie_Genres_Movie On Movie_Genres(Movie_ID)")
+    dbConn.execute("""Create Index Movie_Production_Companies_Movie On
+    Movie_Production_Companies(Movie_ID)""")
+
+    rng = random.Random(11)
+    ids = [rng.randint(1, num_movies) for _ in range(num_lookups)]
+
+    # Warm up the page and statement caches before timing
+    time_lookups(dbConn, ids[:1000], "batch")
+    time_lookups(dbConn, ids[:1000], "json")
+    time_lookups(dbConn, ids[:1000], "lazy", every_facet=True)
+
+    print(f"{num_movies:,}", "movies,", f"{num_lookups:,}", "lookups")
+    print()
+    print("{:<12} {:>10} {:>10}".format("engine", "p50 us", "p99 us"))
+    for name, engine, every_facet in [("batch", "batch", False), ("json", "json", False),
+                                      ("lazy", "lazy", False), ("lazy (all)", "lazy", True)]:
+        times = time_lookups(dbConn, ids, engine, every_facet)
+        print("{:<12} {:>10.1f} {:>10.1f}".format(
+            name, percentile(times, 50), percentile(times, 99)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
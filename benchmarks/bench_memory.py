@@ -0,0 +1,108 @@
+#
+# File: bench_memory.py
+#
+# Compares the memory taken by result objects in the old and new layouts.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# Builds a synthetic catalog in memory and measures, with tracemalloc, the
+# memory taken by the result of get_movies("%") when it is held as objects
+# with a per-instance __dict__ (the layout the result classes used to have),
+# as __slots__ objects, and in the columnar MovieColumns container. The
+# same comparison is made for MovieDetails objects. Run from the top-level
+# directory of the application:
+#
+#   python3 -m benchmarks.bench_memory [num_movies]
+#
+import sys
+import sqlite3
+import tracemalloc
+
+import objecttier
+from benchmarks import synthdb
+
+
+# The result classes as they were before they used __slots__
+class DictMovie:
+    def __init__(self, id, title, year):
+        self._Movie_ID = id
+        self._Title = title
+        self._Release_Year = year
+
+
+class DictMovieDetails:
+    def __init__(self, id, title, num_reviews, avg_rating,
+                 release_date, runtime, language, budget,
+                 revenue, tagline):
+        self._Movie_ID = id
+        self._Title = title
+        self._Num_Reviews = num_reviews
+        self._Avg_Rating = avg_rating
+        self._Release_Date = release_date
+        self._Runtime = runtime
+        self._Original_Language = language
+        self._Budget = budget
+        self._Revenue = revenue
+        self._Tagline = tagline
+        self._Genres = []
+        self._Production_Companies = []
+
+
+# measure:
+#
+# Returns: the # of bytes still allocated by build(rows) once it
+#          returns, i.e. the size of the structure it built (the
+#          rows themselves are allocated beforehand, so not counted).
+def measure(build, rows):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(rows)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return after - before
+
+
+def build_columns(rows):
+    movies = objecttier.MovieColumns()
+    years = {}
+    for row in rows:
+        movies._append(row, years)
+    return movies
+
+
+def main(num_movies):
+    dbConn = sqlite3.connect(":memory:")
+    synthdb.create_schema(dbConn)
+    synthdb.add_movies(dbConn, num_movies)
+
+    rows = dbConn.execute("""Select Movie_ID, Title, strftime('%Y', Release_Date)
+    From Movies Order By Title""").fetchall()
+
+    print("get_movies('%') over", f"{num_movies:,}", "movies:")
+    results = [
+        ("__dict__ objects", measure(lambda rs: [DictMovie(*r) for r in rs], rows)),
+        ("__slots__ objects", measure(lambda rs: [objecttier.Movie(*r) for r in rs], rows)),
+        ("columnar", measure(lambda rs: build_columns(rs), rows)),
+    ]
+    for name, size in results:
+        print(" {:<18} {:>8.1f} MB  {:>6.1f} bytes/movie".format(
+            name, size / 1e6, size / num_movies))
+
+    rows = dbConn.execute("""Select Movie_ID, Title, 0, 0.0, date(Release_Date),
+    Runtime, Original_Language, Budget, Revenue, '' From Movies""").fetchall()
+
+    print()
+    print("MovieDetails for", f"{num_movies:,}", "movies:")
+    results = [
+        ("__dict__ objects", measure(lambda rs: [DictMovieDetails(*r) for r in rs], rows)),
+        ("__slots__ objects", measure(lambda rs: [objecttier.MovieDetails(*r) for r in rs], rows)),
+    ]
+    for name, size in results:
+        print(" {:<18} {:>8.1f} MB  {:>6.1f} bytes/movie".format(
+            name, size / 1e6, size / num_movies))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,113 @@
+#
+# File: bench_shardagg.py
+#
+# Measures how the sharded rating aggregations scale with worker processes.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# Writes a synthetic MovieLens database to a temporary file, with the index
+# on Ratings the shards read through, and times the top N movies and the # of
+# ratings computed from the Ratings table by a single query, then by a
+# ShardedAggregator (see shardagg.py) with 1, 2, 4 and 8 workers, checking
+# each result against the single query. Speedups are relative to 1 worker;
+# they are bounded by the # of CPUs, which is printed. Run from the top-level
+# directory of the application:
+#
+#   python3 -m benchmarks.bench_shardagg [num_movies] [num_ratings]
+#
+import os
+import sys
+import time
+import tempfile
+
+import datatier
+import shardagg
+from benchmarks import synthdb
+
+
+WORKERS = [1, 2, 4, 8]
+
+# The aggregation timed: top N movies with at least MIN_REVIEWS reviews
+N = 10
+MIN_REVIEWS = 20
+
+# Each measurement is the best of this many runs
+RUNS = 3
+
+
+# best_of:
+#
+# Returns: the result of call() and the shortest time it took, in
+#          milliseconds, over RUNS runs.
+def best_of(call):
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = call()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+# single_query_top:
+#
+# Returns: the top N movies computed by one query over Ratings, as
+#          (movie id, # of reviews, avg rating) tuples.
+def single_query_top(dbConn):
+    sql = """Select Movies.Movie_ID, count(Rating), avg(Rating) From Movies
+    Inner Join Ratings On Movies.Movie_ID = Ratings.Movie_ID
+    Group By Movies.Movie_ID Having count(Rating) >= ?
+    Order By avg(Rating) Desc, Movies.Movie_ID Limit ?"""
+    return datatier.select_n_rows(dbConn, sql, [MIN_REVIEWS, N])
+
+
+def main(num_movies, num_ratings):
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "MovieLens.db")
+    synthdb.generate(path, num_movies, num_ratings)
+
+    dbConn = datatier.connect(path)
+    dbConn.execute("Create Index Ratings_Movie_Rating On Ratings(Movie_ID, Rating)")
+    dbConn.commit()
+
+    print(f"{num_movies:,}", "movies,", f"{num_ratings:,}", "ratings,",
+          os.cpu_count(), "CPUs")
+    print()
+
+    try:
+        expected, top_ms = best_of(lambda: single_query_top(dbConn))
+        count, count_ms = best_of(
+            lambda: datatier.select_one_row(dbConn, "Select count(*) From Ratings")[0])
+        print("{:<14} {:>10} {:>8} {:>10} {:>8}".format(
+            "engine", "top N ms", "speedup", "count ms", "speedup"))
+        print("{:<14} {:>10.1f} {:>8} {:>10.1f} {:>8}".format(
+            "single query", top_ms, "", count_ms, ""))
+
+        base = None
+        for workers in WORKERS:
+            with shardagg.ShardedAggregator(path, workers) as engine:
+                # Start the worker processes before timing
+                engine.num_reviews()
+
+                movies, top_ms = best_of(lambda: engine.top_N(N, MIN_REVIEWS))
+                total, count_ms = best_of(engine.num_reviews)
+
+            found = [(m.Movie_ID, m.Num_Reviews, m.Avg_Rating) for m in movies]
+            if found != expected or total != count:
+                print("**Results of", workers, "workers differ from the single query")
+
+            if base is None:
+                base = (top_ms, count_ms)
+            print("{:<14} {:>10.1f} {:>7.2f}x {:>10.1f} {:>7.2f}x".format(
+                str(workers) + " workers", top_ms, base[0] / top_ms,
+                count_ms, base[1] / count_ms))
+    finally:
+        dbConn.close()
+        os.remove(path)
+        os.rmdir(folder)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5000000)
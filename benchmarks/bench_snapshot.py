@@ -0,0 +1,116 @@
+#
+# File: bench_snapshot.py
+#
+# Compares lookup latency on ordinary and read-only snapshot connections.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# Writes a synthetic MovieLens database to a temporary file and times
+# objecttier.get_movie_details and get_movies for the same random movie ids
+# and title patterns on an ordinary connection and on snapshot connections
+# in each mode (see snapshot.py), reporting the p50 and p99 latency of each.
+# The detail cache and the in-memory genre and company tables are left off,
+# so every lookup reads the database. Run from the top-level directory of
+# the application:
+#
+#   python3 -m benchmarks.bench_snapshot [num_movies] [num_lookups]
+#
+import os
+import sys
+import time
+import random
+import tempfile
+
+import datatier
+import objecttier
+import aggregates
+import snapshot
+from benchmarks import synthdb
+from benchmarks.timing import percentile
+
+
+# The connections compared: (name, function opening one on a path)
+CONFIGS = [
+    ("read-write", lambda path: datatier.connect(path)),
+    ("ro", lambda path: snapshot.connect(path, "ro", mmap_size=None, cache_size=None)),
+    ("immutable", lambda path: snapshot.connect(path, "immutable", mmap_size=None, cache_size=None)),
+    ("ro+mmap", lambda path: snapshot.connect(path, "ro")),
+    ("immutable+mmap", lambda path: snapshot.connect(path, "immutable")),
+    ("memory", lambda path: snapshot.connect(path, "memory")),
+]
+
+
+# time_calls:
+#
+# Returns: the sorted latencies, in microseconds, of call(arg) for
+#          each of the given arguments.
+def time_calls(call, args):
+    times = []
+    for arg in args:
+        start = time.perf_counter()
+        call(arg)
+        times.append((time.perf_counter() - start) * 1e6)
+    times.sort()
+    return times
+
+
+# prepare:
+#
+# Writes the synthetic database to path, with the rating summary
+# and the indexes the lookups need.
+def prepare(path, num_movies):
+    synthdb.generate(path, num_movies, num_movies * 20)
+
+    dbConn = datatier.connect(path)
+    aggregates.install_summary(dbConn)
+    dbConn.execute("Create Index Movie_Genres_Movie On Movie_Genres(Movie_ID)")
+    dbConn.execute("""Create Index Movie_Production_Companies_Movie On
+    Movie_Production_Companies(Movie_ID)""")
+    dbConn.commit()
+    dbConn.close()
+
+
+def main(num_movies, num_lookups):
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "MovieLens.db")
+    prepare(path, num_movies)
+
+    rng = random.Random(11)
+    ids = [rng.randint(1, num_movies) for _ in range(num_lookups)]
+    words = rng.sample(synthdb.make_vocabulary(synthdb.DEFAULT_SEED)[:2000], 200)
+    patterns = [w[:3] + "%" for w in words]
+
+    print(f"{num_movies:,}", "movies,", f"{num_lookups:,}", "detail lookups,",
+          len(patterns), "title searches")
+    print()
+    print("{:<16} {:>12} {:>12} {:>12} {:>12} {:>10}".format(
+        "connection", "details p50", "details p99", "movies p50", "movies p99", "open ms"))
+
+    try:
+        for name, open_connection in CONFIGS:
+            start = time.perf_counter()
+            dbConn = open_connection(path)
+            opened = (time.perf_counter() - start) * 1000
+
+            details = lambda movie_id: objecttier.get_movie_details(dbConn, movie_id)
+            movies = lambda pattern: objecttier.get_movies(dbConn, pattern, limit=100)
+
+            # Warm up the page and statement caches before timing
+            time_calls(details, ids[:1000])
+            time_calls(movies, patterns[:20])
+
+            detail_times = time_calls(details, ids)
+            movie_times = time_calls(movies, patterns)
+            print("{:<16} {:>12.1f} {:>12.1f} {:>12.1f} {:>12.1f} {:>10.1f}".format(
+                name, percentile(detail_times, 50), percentile(detail_times, 99),
+                percentile(movie_times, 50), percentile(movie_times, 99), opened))
+            dbConn.close()
+    finally:
+        os.remove(path)
+        os.rmdir(folder)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
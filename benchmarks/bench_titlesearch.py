@@ -0,0 +1,69 @@
+#
+# File: bench_titlesearch.py
+#
+# Compares title searches through the full-text index with "like" scans.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# Builds a synthetic catalog in memory, installs the title index and times
+# objecttier.get_movies for the same search words in "like" mode (as
+# "%word%", which has to scan Movies) and in each of the index modes. Note
+# the modes do not return identical results: "like" matches inside words,
+# the index only matches whole words (or word prefixes). Run from the
+# top-level directory of the application:
+#
+#   python3 -m benchmarks.bench_titlesearch [num_movies]
+#
+import sys
+import time
+import random
+import sqlite3
+import statistics
+
+import objecttier
+import titlesearch
+from benchmarks import synthdb
+
+
+# time_searches:
+#
+# Returns: the median time in milliseconds, and the average # of
+#          movies found, over one get_movies call per word.
+def time_searches(dbConn, words, mode):
+    times = []
+    found = 0
+    for word in words:
+        pattern = "%" + word + "%" if mode == "like" else word
+        start = time.perf_counter()
+        movies = objecttier.get_movies(dbConn, pattern, mode)
+        times.append((time.perf_counter() - start) * 1000)
+        found += len(movies)
+    return statistics.median(times), found / len(words)
+
+
+def main(num_movies):
+    dbConn = sqlite3.connect(":memory:")
+    synthdb.create_schema(dbConn)
+    synthdb.add_movies(dbConn, num_movies)
+
+    start = time.perf_counter()
+    titlesearch.install_index(dbConn)
+    print("catalog:", f"{num_movies:,}", "movies, index built in",
+          "{:.1f} ms".format((time.perf_counter() - start) * 1000))
+
+    # Search for words picked evenly from the vocabulary, so mostly rare ones
+    rng = random.Random(7)
+    words = rng.sample(synthdb.make_vocabulary(synthdb.DEFAULT_SEED), 200)
+    prefixes = [w[:4] for w in words]
+
+    print()
+    print("{:<8} {:>12} {:>12}".format("mode", "median ms", "avg found"))
+    for mode, searched in [("like", words), ("token", words),
+                           ("prefix", prefixes), ("ranked", words)]:
+        median, found = time_searches(dbConn, searched, mode)
+        print("{:<8} {:>12.3f} {:>12.1f}".format(mode, median, found))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,178 @@
+#
+# File: run.py
+#
+# Benchmark harness for the object tier.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# Runs every objecttier function under a repeatable workload against a
+# MovieLens database and writes the throughput and latency percentiles of
+# each as JSON, so runs can be compared across commits. The database is
+# either an existing file or a synthetic one generated at a named scale (see
+# synthdb.py); either way the benchmark runs on a temporary copy, so the
+# writes it makes never touch the original. The same seed always produces
+# the same sequence of calls. Run from the top-level directory of the
+# application:
+#
+#   python3 -m benchmarks.run [--db FILE | --scale NAME] [--calls N]
+#                             [--seed N] [--indexes] [--output FILE]
+#
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import datatier
+import objecttier
+import aggregates
+import indexadvisor
+from benchmarks import synthdb
+from benchmarks import timing
+
+
+# _workloads:
+#
+# Returns: a list of (name, call) pairs, where call(rng) makes one
+#          call of the objecttier function being benchmarked with
+#          arguments picked using rng, among the given movie ids.
+def _workloads(dbConn, ids):
+    vocabulary = synthdb.make_vocabulary(synthdb.DEFAULT_SEED)
+    word_weights = synthdb.zipf_weights(len(vocabulary))
+    id_weights = synthdb.zipf_weights(len(ids))
+
+    # Popular movies are looked up far more often than others
+    def movie_id(rng):
+        return rng.choices(ids, cum_weights=id_weights)[0]
+
+    # Mostly existing movies, with the odd id that does not exist
+    def any_movie_id(rng):
+        if rng.random() < 0.05:
+            return ids[-1] + rng.randint(1, 1000)
+        return movie_id(rng)
+
+    def pattern(rng):
+        word = rng.choices(vocabulary, cum_weights=word_weights)[0]
+        if rng.random() < 0.5:
+            return "%" + word + "%"
+        return word.capitalize() + "%"
+
+    return [
+        ("num_movies", lambda rng: objecttier.num_movies(dbConn)),
+        ("num_reviews", lambda rng: objecttier.num_reviews(dbConn)),
+        ("get_movies", lambda rng: objecttier.get_movies(dbConn, pattern(rng))),
+        ("get_movie_details", lambda rng: objecttier.get_movie_details(dbConn, any_movie_id(rng))),
+        ("get_top_N_movies", lambda rng: objecttier.get_top_N_movies(
+            dbConn, rng.choice([10, 100]), rng.choice([1, 10, 100]))),
+        ("add_review", lambda rng: objecttier.add_review(
+            dbConn, any_movie_id(rng), rng.randint(0, 10))),
+        ("set_tagline", lambda rng: objecttier.set_tagline(
+            dbConn, any_movie_id(rng), "Tagline " + str(rng.randint(1, 10**6)))),
+    ]
+
+
+# run_workload:
+#
+# Makes calls calls, after a few untimed warm-up calls, with a
+# random generator seeded from seed and the workload's name.
+#
+# Returns: the summary of the timed calls (see timing.summarize).
+def run_workload(name, call, calls, seed):
+    rng = random.Random("{}:{}".format(seed, name))
+    for _ in range(min(10, calls)):
+        call(rng)
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        before = time.perf_counter()
+        call(rng)
+        latencies.append(time.perf_counter() - before)
+    elapsed = time.perf_counter() - start
+
+    return timing.summarize(latencies, elapsed)
+
+
+# _commit:
+#
+# Returns: the id of the git commit checked out, or None if it
+#          cannot be found out.
+def _commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MovieLens object tier.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--db", help="database file to benchmark a copy of")
+    source.add_argument("--scale", default="small", choices=sorted(synthdb.SCALES),
+                        help="size of the synthetic database to generate (default: small)")
+    parser.add_argument("--calls", type=int, default=500,
+                        help="timed calls per function (default: 500)")
+    parser.add_argument("--seed", type=int, default=1, help="workload seed (default: 1)")
+    parser.add_argument("--indexes", action="store_true",
+                        help="provision the indexes recommended by indexadvisor first")
+    parser.add_argument("--output", help="file to write the JSON results to (default: stdout)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="movielens-bench-")
+    try:
+        path = os.path.join(workdir, "MovieLens.db")
+        if args.db is not None:
+            shutil.copyfile(args.db, path)
+        else:
+            num_movies, num_ratings = synthdb.SCALES[args.scale]
+            synthdb.generate(path, num_movies, num_ratings)
+
+        dbConn = datatier.connect(path)
+        if aggregates.install_summary(dbConn) == 0:
+            sys.exit(1)
+        if args.indexes and indexadvisor.provision(dbConn) is None:
+            sys.exit(1)
+
+        ids = [row[0] for row in dbConn.execute("Select Movie_ID From Movies Order By Movie_ID")]
+        report = {
+            "commit": _commit(),
+            "database": args.db if args.db is not None else "synthetic:" + args.scale,
+            "movies": len(ids),
+            "reviews": objecttier.num_reviews(dbConn),
+            "indexes": args.indexes,
+            "calls": args.calls,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "results": {},
+        }
+
+        for name, call in _workloads(dbConn, ids):
+            report["results"][name] = run_workload(name, call, args.calls, args.seed)
+            print(name, "done", file=sys.stderr)
+
+        dbConn.close()
+    finally:
+        shutil.rmtree(workdir)
+
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#
+# File: synthdb.py
+#
+# Generates synthetic MovieLens databases for the benchmarks.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# The benchmarks need catalogs far larger than the MovieLens subset the
+# application ships with. The functions in this file create the MovieLens
+# tables in an empty database and fill them with made-up but repeatable
+# data: the same seed always produces the same database. Title words are
+# drawn from a fixed vocabulary with a skewed (Zipf-like) distribution, so
+# some words appear in many titles and most appear in only a few.
+#
+# To write a synthetic database to a file, run from the top-level directory
+# of the application:
+#
+#   python3 -m benchmarks.synthdb database [scale | num_movies num_ratings]
+#
+# where scale is one of the names in SCALES.
+#
+import os
+import sys
+import random
+import sqlite3
+
+
+DEFAULT_SEED = 341
+
+# Named database sizes: (# of movies, # of ratings)
+SCALES = {
+    "tiny": (1000, 20000),
+    "small": (10000, 500000),
+    "medium": (50000, 5000000),
+    "large": (200000, 50000000),
+}
+
+
+# create_schema:
+#
+# Creates the MovieLens tables, as used by the object tier, in the
+# given (empty) database.
+def create_schema(dbConn):
+    dbConn.executescript("""
+    Create Table Movies(Movie_ID Integer Primary Key, Title Text,
+    Release_Date Text, Runtime Integer, Original_Language Text,
+    Budget Integer, Revenue Integer);
+    Create Table Ratings(Movie_ID Integer Not Null, Rating Integer Not Null);
+    Create Table Movie_Taglines(Movie_ID Integer Primary Key, Tagline Text);
+    Create Table Genres(Genre_ID Integer Primary Key, Genre_Name Text);
+    Create Table Companies(Company_ID Integer Primary Key, Company_Name Text);
+    Create Table Movie_Genres(Movie_ID Integer Not Null, Genre_ID Integer Not Null);
+    Create Table Movie_Production_Companies(Movie_ID Integer Not Null,
+    Company_ID Integer Not Null);
+    """)
+
+
+# make_vocabulary:
+#
+# Returns: a list of n distinct made-up words built from syllables,
+#          in a random order that depends only on the seed.
+def make_vocabulary(seed, n=20000):
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ren", "sta", "tor", "vel", "an", "dor",
+                 "is", "qu", "bel", "ru", "nox", "ter", "gal", "ph", "ony"]
+    words = set()
+    while len(words) < n:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+# zipf_weights:
+#
+# Returns: cumulative weights for picking among n items so the
+#          k-th item is picked with probability proportional to 1/k.
+def zipf_weights(n):
+    weights = []
+    total = 0.0
+    for k in range(1, n + 1):
+        total += 1.0 / k
+        weights.append(total)
+    return weights
+
+
+# make_title:
+#
+# Returns: a title of 1 to 5 words drawn from the vocabulary,
+#          favoring the words at the front of the list.
+def make_title(rng, vocabulary, weights):
+    words = rng.choices(vocabulary, cum_weights=weights, k=rng.randint(1, 5))
+    return " ".join(w.capitalize() for w in words)
+
+
+# add_movies:
+#
+# Inserts num_movies movies with ids 1..num_movies into the
+# Movies table, generated from the given seed.
+def add_movies(dbConn, num_movies, seed=DEFAULT_SEED):
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(seed)
+    weights = zipf_weights(len(vocabulary))
+
+    rows = []
+    for movie_id in range(1, num_movies + 1):
+        rows.append((movie_id, make_title(rng, vocabulary, weights),
+                     "{}-{:02}-{:02}".format(rng.randint(1920, 2023),
+                                             rng.randint(1, 12), rng.randint(1, 28)),
+                     rng.randint(70, 200), rng.choice(["en", "en", "en", "fr", "es", "ja"]),
+                     rng.randint(0, 200) * 1000000, rng.randint(0, 900) * 1000000))
+
+    dbConn.executemany("Insert Into Movies Values (?, ?, ?, ?, ?, ?, ?)", rows)
+    dbConn.commit()
+
+
+GENRES = ["Action", "Adventure", "Animation", "Comedy", "Crime", "Documentary",
+          "Drama", "Family", "Fantasy", "History", "Horror", "Music", "Mystery",
+          "Romance", "Science Fiction", "TV Movie", "Thriller", "War", "Western"]
+
+
+# add_details:
+#
+# Fills in the genres, production companies and taglines of the
+# movies with ids 1..num_movies: each movie gets 0-3 genres and
+# 0-4 companies, a few companies producing most of the movies,
+# and roughly 3 in 4 movies get a tagline.
+def add_details(dbConn, num_movies, num_companies=5000, seed=DEFAULT_SEED):
+    rng = random.Random(seed + 1)
+    vocabulary = make_vocabulary(seed)
+    word_weights = zipf_weights(len(vocabulary))
+    weights = zipf_weights(num_companies)
+
+    dbConn.executemany("Insert Into Genres Values (?, ?)",
+                       [(i + 1, name) for i, name in enumerate(GENRES)])
+    dbConn.executemany("Insert Into Companies Values (?, ?)",
+                       [(i, make_title(rng, vocabulary, word_weights) + " Pictures")
+                        for i in range(1, num_companies + 1)])
+
+    genres = []
+    companies = []
+    taglines = []
+    company_ids = range(1, num_companies + 1)
+    for movie_id in range(1, num_movies + 1):
+        for genre_id in rng.sample(range(1, len(GENRES) + 1), rng.randint(0, 3)):
+            genres.append((movie_id, genre_id))
+        for company_id in set(rng.choices(company_ids, cum_weights=weights,
+                                          k=rng.randint(0, 4))):
+            companies.append((movie_id, company_id))
+        if rng.random() < 0.75:
+            taglines.append((movie_id, "The " + rng.choice(vocabulary) + " is coming."))
+
+    dbConn.executemany("Insert Into Movie_Genres Values (?, ?)", genres)
+    dbConn.executemany("Insert Into Movie_Production_Companies Values (?, ?)", companies)
+    dbConn.executemany("Insert Into Movie_Taglines Values (?, ?)", taglines)
+    dbConn.commit()
+
+
+# add_ratings:
+#
+# Inserts about num_ratings ratings 0..10 for the movies with ids
+# 1..num_movies. How many ratings a movie gets follows a Zipf-like
+# distribution over a random ordering of the movies, so a few
+# blockbusters have most of the ratings, and each movie has its
+# own typical rating.
+def add_ratings(dbConn, num_movies, num_ratings, seed=DEFAULT_SEED):
+    rng = random.Random(seed + 2)
+    movie_ids = list(range(1, num_movies + 1))
+    rng.shuffle(movie_ids)
+    weights = zipf_weights(num_movies)
+    quality = {}
+
+    batch = []
+    for movie_id in rng.choices(movie_ids, cum_weights=weights, k=num_ratings):
+        mean = quality.get(movie_id)
+        if mean is None:
+            mean = quality[movie_id] = rng.uniform(3.0, 8.5)
+        batch.append((movie_id, min(10, max(0, round(rng.gauss(mean, 1.8))))))
+
+        if len(batch) == 100000:
+            dbConn.executemany("Insert Into Ratings Values (?, ?)", batch)
+            batch = []
+
+    dbConn.executemany("Insert Into Ratings Values (?, ?)", batch)
+    dbConn.commit()
+
+
+# generate:
+#
+# Creates a synthetic MovieLens database at the given path, which
+# must not exist yet, with num_movies movies and about num_ratings
+# ratings.
+def generate(path, num_movies, num_ratings, seed=DEFAULT_SEED):
+    if os.path.exists(path):
+        raise FileExistsError(path)
+
+    dbConn = sqlite3.connect(path)
+    try:
+        create_schema(dbConn)
+        add_movies(dbConn, num_movies, seed)
+        add_details(dbConn, num_movies, seed=seed)
+        add_ratings(dbConn, num_movies, num_ratings, seed)
+    finally:
+        dbConn.close()
+
+
+##################################################################
+#
+# main:
+#
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[2] in SCALES:
+        num_movies, num_ratings = SCALES[sys.argv[2]]
+    elif len(sys.argv) == 4:
+        num_movies, num_ratings = int(sys.argv[2]), int(sys.argv[3])
+    else:
+        print("usage: python3 -m benchmarks.synthdb database [scale | num_movies num_ratings]")
+        print("scales:", ", ".join(SCALES))
+        sys.exit(2)
+
+    generate(sys.argv[1], num_movies, num_ratings)
+    print("Created", sys.argv[1], "with", f"{num_movies:,}", "movies and",
+          f"{num_ratings:,}", "ratings")
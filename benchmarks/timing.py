@@ -0,0 +1,39 @@
+#
+# File: timing.py
+#
+# Latency statistics shared by the benchmarks.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+
+
+# percentile:
+#
+# Returns: the p-th percentile (0..100) of the given sorted values.
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+# summarize:
+#
+# Given the latencies of a run of calls, in seconds, and the
+# total time the run took, in seconds.
+#
+# Returns: a dictionary with the # of calls, the throughput in
+#          calls/sec and the mean, p50, p90, p99 and max latency
+#          in microseconds.
+def summarize(latencies, elapsed):
+    values = sorted(latencies)
+    if len(values) == 0:
+        return {"calls": 0}
+
+    return {
+        "calls": len(values),
+        "throughput": len(values) / elapsed if elapsed > 0 else 0.0,
+        "mean_us": sum(values) / len(values) * 1e6,
+        "p50_us": percentile(values, 50) * 1e6,
+        "p90_us": percentile(values, 90) * 1e6,
+        "p99_us": percentile(values, 99) * 1e6,
+        "max_us": values[-1] * 1e6,
+    }
@@ -0,0 +1,202 @@
+#
+# File: connpool.py
+#
+# Thread-safe connection pool for the data tier.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# A single sqlite3 connection cannot be shared between threads, so code that
+# serves lookups from several threads uses a ConnectionPool instead. The pool
+# hands out read connections, up to a configurable number of them, and owns a
+# single write connection which only one thread at a time may use, so all
+# actions against the database are serialized. Pass wal=True to switch the
+# database to WAL mode, which lets the readers keep reading while a write is
+# in progress; the mode is stored in the database file, so it is left alone
+# by default.
+#
+# A ConnectionPool can be passed to every datatier (and so objecttier)
+# function in place of a connection: reads are run on a read connection and
+# actions on the write connection. If no connection becomes available within
+# the pool's timeout the call fails like any other database error.
+#
+import time
+import queue
+import threading
+import contextlib
+import stmtcache
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, path, size=4, timeout=5.0, wal=False):
+        self._Path = path
+        self._Size = size
+        self._Timeout = timeout
+        self._Wal = wal
+        self._Idle = queue.LifoQueue()
+        self._Open = []
+        self._Local = threading.local()
+        self._Lock = threading.Lock()
+        self._Write_Lock = threading.RLock()
+
+        self._Checkouts = 0
+        self._Waits = 0
+        self._Timeouts = 0
+        self._Wait_Time = 0.0
+        self._Writes = 0
+        self._Write_Waits = 0
+        self._Write_Wait_Time = 0.0
+
+        self._Writer = self._open_writer()
+
+    @property
+    def Path(self):
+        return self._Path
+
+    @property
+    def Size(self):
+        return self._Size
+
+    @property
+    def Timeout(self):
+        return self._Timeout
+
+    def _connect(self):
+        return stmtcache.connect(self._Path, timeout=self._Timeout,
+                                 check_same_thread=False)
+
+    def _open_writer(self):
+        dbConn = self._connect()
+        if self._Wal:
+            dbConn.execute("PRAGMA journal_mode = WAL")
+        return dbConn
+
+    # _acquire:
+    #
+    # Takes an idle read connection, opening a new one while the
+    # pool is below its size, or else waits for one to be returned.
+    def _acquire(self):
+        try:
+            return self._Idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._Lock:
+            if len(self._Open) < self._Size:
+                dbConn = self._connect()
+                dbConn.execute("PRAGMA query_only = 1")
+                self._Open.append(dbConn)
+                return dbConn
+
+        # Every connection is in use, wait for one to come back
+        start = time.perf_counter()
+        try:
+            dbConn = self._Idle.get(timeout=self._Timeout)
+        except queue.Empty:
+            dbConn = None
+        waited = time.perf_counter() - start
+
+        with self._Lock:
+            self._Waits += 1
+            self._Wait_Time += waited
+            if dbConn is None:
+                self._Timeouts += 1
+
+        if dbConn is None:
+            raise PoolTimeout("no read connection available after {} secs".format(self._Timeout))
+        return dbConn
+
+    # reader:
+    #
+    # Context manager that checks out a read connection for the
+    # calling thread. Nested checkouts by the same thread share
+    # the connection already checked out.
+    @contextlib.contextmanager
+    def reader(self):
+        local = self._Local
+        if getattr(local, "dbConn", None) is not None:
+            local.depth += 1
+            try:
+                yield local.dbConn
+            finally:
+                local.depth -= 1
+            return
+
+        dbConn = self._acquire()
+        with self._Lock:
+            self._Checkouts += 1
+
+        local.dbConn = dbConn
+        local.depth = 1
+        try:
+            yield dbConn
+        finally:
+            local.depth = 0
+            local.dbConn = None
+            self._Idle.put(dbConn)
+
+    # writer:
+    #
+    # Context manager that gives the calling thread exclusive use
+    # of the write connection.
+    @contextlib.contextmanager
+    def writer(self):
+        if not self._Write_Lock.acquire(blocking=False):
+            start = time.perf_counter()
+            acquired = self._Write_Lock.acquire(timeout=self._Timeout)
+            waited = time.perf_counter() - start
+
+            with self._Lock:
+                self._Write_Waits += 1
+                self._Write_Wait_Time += waited
+                if not acquired:
+                    self._Timeouts += 1
+
+            if not acquired:
+                raise PoolTimeout("write connection not available after {} secs".format(self._Timeout))
+
+        try:
+            with self._Lock:
+                self._Writes += 1
+            yield self._Writer
+        finally:
+            self._Write_Lock.release()
+
+    # stats:
+    #
+    # Returns: a dictionary of counters describing how the pool
+    #          has been used: read checkouts, how many of them had
+    #          to wait and for how long in total (in seconds),
+    #          write checkouts and their waits, and timeouts.
+    def stats(self):
+        with self._Lock:
+            return {
+                "size": self._Size,
+                "open": len(self._Open),
+                "checkouts": self._Checkouts,
+                "waits": self._Waits,
+                "wait_time": self._Wait_Time,
+                "writes": self._Writes,
+                "write_waits": self._Write_Waits,
+                "write_wait_time": self._Write_Wait_Time,
+                "timeouts": self._Timeouts,
+            }
+
+    # close:
+    #
+    # Drops what was kept for the pool (see stmtcache.on_close),
+    # then closes the write connection and every read connection.
+    # Connections checked out at the time are closed as well.
+    def close(self):
+        stmtcache.closing(self)
+        with self._Lock:
+            for dbConn in self._Open:
+                dbConn.close()
+            self._Open = []
+            self._Idle = queue.LifoQueue()
+        with self._Write_Lock:
+            self._Writer.close()
@@ -10,7 +10,53 @@
 # to execute sql queries and return one or multiple rows of data. It also
 # has the ability to return how many rows of a database table were modified.
 #
+# Each function accepts either a sqlite3 connection or a ConnectionPool (see
+# connpool.py); with a pool, queries run on a read connection checked out for
+# the duration of the call and actions run on the pool's single writer.
+# Connections opened with connect reuse one cursor across calls and have a
+# larger statement cache (see stmtcache.py). Every query can be timed and
+# counted, see instrument.py.
+#
 import sqlite3
+import functools
+import connpool
+import stmtcache
+import instrument
+
+
+# _pooled:
+#
+# Decorator that lets a data tier function be called with a
+# ConnectionPool: a connection is checked out of the pool (the
+# writer if write is True) and passed on to the function. If
+# none becomes available in time a msg is output and failed is
+# returned, as for any other error.
+def _pooled(write, failed):
+    def decorate(function):
+        @functools.wraps(function)
+        def call(dbConn, *args, **kwargs):
+            if not isinstance(dbConn, connpool.ConnectionPool):
+                return function(dbConn, *args, **kwargs)
+
+            try:
+                checkout = dbConn.writer() if write else dbConn.reader()
+                with checkout as conn:
+                    return function(conn, *args, **kwargs)
+            except connpool.PoolTimeout as err:
+                print(function.__name__, "failed:", err)
+                return failed
+        return call
+    return decorate
+
+
+# connect:
+#
+# Opens a connection to the given database file, with a larger
+# statement cache and cursor reuse (see stmtcache.py).
+#
+# Returns: the new connection.
+def connect(path, **kwargs):
+    return stmtcache.connect(path, **kwargs)
 
 
 # select_one_row:
@@ -25,20 +71,25 @@ import sqlite3
 # Returns: first row retrieved by the given query, or
 #          () if no data was retrieved. If an error
 #          occurs, a msg is output and None is returned.
+@_pooled(write=False, failed=None)
 def select_one_row(dbConn, sql, parameters=[]):
-    dbCursor = dbConn.cursor()
+    dbCursor = stmtcache.cursor(dbConn)
+    started = instrument.start()
 
     try:
+        stmtcache.record(dbConn, sql)
         dbCursor.execute(sql, parameters)
         row = dbCursor.fetchone()
         if row is None:
             row = ()
+        instrument.finish(started, "select_one_row", sql, parameters, 1 if row else 0)
         return row
     except Exception as err:
+        instrument.finish(started, "select_one_row", sql, parameters, 0, err)
         print("select_one_row failed:", err)
         return None
     finally:
-        dbCursor.close()
+        stmtcache.release(dbConn, dbCursor)
 
 
 # select_n_rows:
@@ -54,20 +105,25 @@ def select_one_row(dbConn, sql, parameters=[]):
 # Returns: a list of 0 or more rows retrieved by the 
 #          given query; if an error occurs a msg is 
 #          output and None is returned.
+@_pooled(write=False, failed=None)
 def select_n_rows(dbConn, sql, parameters=[]):
-    dbCursor = dbConn.cursor()
+    dbCursor = stmtcache.cursor(dbConn)
+    started = instrument.start()
 
     try:
+        stmtcache.record(dbConn, sql)
         dbCursor.execute(sql, parameters)
         rows = dbCursor.fetchall()
         if rows is None:
             rows = []
+        instrument.finish(started, "select_n_rows", sql, parameters, len(rows))
         return rows
     except Exception as err:
+        instrument.finish(started, "select_n_rows", sql, parameters, 0, err)
         print("select_n_rows failed:", err)
         return None
     finally:
-        dbCursor.close()
+        stmtcache.release(dbConn, dbCursor)
 
 
 # perform_action: 
@@ -83,15 +139,93 @@ def select_n_rows(dbConn, sql, parameters=[]):
 # Returns: the # of rows modified by the query; if an 
 #          error occurs a msg is output and -1 is 
 #          returned.
+@_pooled(write=True, failed=-1)
 def perform_action(dbConn, sql, parameters=[]):
-    dbCursor = dbConn.cursor()
+    dbCursor = stmtcache.cursor(dbConn)
+    started = instrument.start()
 
     try:
+        stmtcache.record(dbConn, sql)
         dbCursor.execute(sql, parameters)
         dbConn.commit()
+        instrument.finish(started, "perform_action", sql, parameters, dbCursor.rowcount)
         return dbCursor.rowcount
     except Exception as err:
+        instrument.finish(started, "perform_action", sql, parameters, 0, err)
         print("perform_action failed:", err)
         return -1
     finally:
-        dbCursor.close()
+        stmtcache.release(dbConn, dbCursor)
+
+
+# perform_transaction:
+#
+# Given a database connection and a list of SQL action
+# queries, executes them in order as a single transaction.
+# Each entry of actions is a (sql, parameters) pair; pass
+# [] as the parameters when the query takes none. Either
+# every query takes effect or, if one fails, none of them
+# do; this includes Create and Drop statements, which
+# sqlite3 would otherwise run outside of the transaction.
+#
+# Returns: the total # of rows modified by the queries; if
+#          an error occurs the transaction is rolled back,
+#          a msg is output and -1 is returned.
+@_pooled(write=True, failed=-1)
+def perform_transaction(dbConn, actions):
+    dbCursor = stmtcache.cursor(dbConn)
+    started, sql, parameters = None, None, None
+
+    try:
+        # sqlite3 only opens a transaction by itself before Insert/Update/Delete
+        if not dbConn.in_transaction:
+            dbCursor.execute("Begin")
+
+        modified = 0
+        for sql, parameters in actions:
+            started = instrument.start()
+            stmtcache.record(dbConn, sql)
+            dbCursor.execute(sql, parameters)
+            if dbCursor.rowcount > 0:
+                modified += dbCursor.rowcount
+            instrument.finish(started, "perform_transaction", sql, parameters, dbCursor.rowcount)
+            started = None
+        dbConn.commit()
+        return modified
+    except Exception as err:
+        instrument.finish(started, "perform_transaction", sql, parameters, 0, err)
+        dbConn.rollback()
+        print("perform_transaction failed:", err)
+        return -1
+    finally:
+        stmtcache.release(dbConn, dbCursor)
+
+
+# perform_many:
+#
+# Given a database connection, a SQL action query and a list of
+# parameter lists, executes the query once for each parameter
+# list, all in a single transaction. Either every execution takes
+# effect or, if one fails, none of them do.
+#
+# Returns: the total # of rows modified; if an error occurs the
+#          transaction is rolled back, a msg is output and -1 is
+#          returned.
+@_pooled(write=True, failed=-1)
+def perform_many(dbConn, sql, rows):
+    dbCursor = stmtcache.cursor(dbConn)
+    started = instrument.start()
+
+    try:
+        stmtcache.record(dbConn, sql)
+        dbCursor.executemany(sql, rows)
+        dbConn.commit()
+        instrument.finish(started, "perform_many", sql, None, dbCursor.rowcount)
+        return dbCursor.rowcount
+    except Exception as err:
+        instrument.finish(started, "perform_many", sql, None, 0, err)
+        dbConn.rollback()
+        print("perform_many failed:", err)
+        return -1
+    finally:
+        stmtcache.release(dbConn, dbCursor)
@@ -0,0 +1,208 @@
+#
+# File: detailcache.py
+#
+# Read-through cache of MovieDetails objects for the object tier.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# The same popular movies are looked up over and over, and every lookup of
+# a movie's details runs several queries. Once a cache is enabled for a
+# connection, objecttier.get_movie_details serves repeated lookups from
+# memory. The cache holds at most max_size movies, evicting the least
+# recently used one when full, and can also expire entries ttl seconds after
+# they were stored. add_review, add_reviews_bulk and set_tagline invalidate
+# the entry of every movie they change.
+#
+# Every key has a generation, which invalidate (and clear) moves on. Details
+# are read from the database after taking the generation of their key, and
+# only stored if it has not moved since, so details read while a review was
+# being added for the same movie are never cached.
+#
+# Cached MovieDetails objects are shared by every caller that looks up the
+# same movie, so they must not be modified.
+#
+import time
+import threading
+import collections
+import stmtcache
+
+
+class DetailCache:
+    def __init__(self, max_size=1024, ttl=None):
+        self._Max_Size = max_size
+        self._TTL = ttl
+        self._Entries = collections.OrderedDict()
+        self._Lock = threading.Lock()
+
+        # Invalidations per key since the cache was last cleared
+        self._Generations = {}
+        self._Epoch = 0
+
+        self._Hits = 0
+        self._Misses = 0
+        self._Evictions = 0
+        self._Expirations = 0
+        self._Invalidations = 0
+
+    @property
+    def Max_Size(self):
+        return self._Max_Size
+
+    @property
+    def TTL(self):
+        return self._TTL
+
+    # get:
+    #
+    # Returns: the cached value for the given key, or None if it
+    #          is not cached or has expired.
+    def get(self, key):
+        with self._Lock:
+            entry = self._Entries.get(key)
+            if entry is None:
+                self._Misses += 1
+                return None
+
+            if entry[1] is not None and entry[1] <= time.monotonic():
+                del self._Entries[key]
+                self._Expirations += 1
+                self._Misses += 1
+                return None
+
+            self._Entries.move_to_end(key)
+            self._Hits += 1
+            return entry[0]
+
+    def _generation(self, key):
+        return (self._Epoch, self._Generations.get(key, 0))
+
+    # generation:
+    #
+    # Returns: the generation of the given key; pass it to put.
+    def generation(self, key):
+        with self._Lock:
+            return self._generation(key)
+
+    # put:
+    #
+    # Caches the value under the given key, evicting the least
+    # recently used entry if the cache is full. If a generation is
+    # given, the value is only cached if the key was not invalidated
+    # since generation returned it.
+    #
+    # Returns: True if the value was cached, False if not.
+    def put(self, key, value, generation=None):
+        expires = None
+        if self._TTL is not None:
+            expires = time.monotonic() + self._TTL
+
+        with self._Lock:
+            if generation is not None and generation != self._generation(key):
+                return False
+
+            self._Entries[key] = (value, expires)
+            self._Entries.move_to_end(key)
+            while len(self._Entries) > self._Max_Size:
+                self._Entries.popitem(last=False)
+                self._Evictions += 1
+            return True
+
+    # invalidate:
+    #
+    # Drops the entry for the given key, if there is one, and moves
+    # its generation on.
+    def invalidate(self, key):
+        with self._Lock:
+            self._Generations[key] = self._Generations.get(key, 0) + 1
+            if self._Entries.pop(key, None) is not None:
+                self._Invalidations += 1
+
+    def clear(self):
+        with self._Lock:
+            self._Entries.clear()
+            self._Generations.clear()
+            self._Epoch += 1
+
+    # stats:
+    #
+    # Returns: a dictionary with the size of the cache and its
+    #          hit, miss, eviction, expiration and invalidation
+    #          counters, plus the hit rate.
+    def stats(self):
+        with self._Lock:
+            lookups = self._Hits + self._Misses
+            return {
+                "size": len(self._Entries),
+                "max_size": self._Max_Size,
+                "hits": self._Hits,
+                "misses": self._Misses,
+                "hit_rate": self._Hits / lookups if lookups > 0 else 0.0,
+                "evictions": self._Evictions,
+                "expirations": self._Expirations,
+                "invalidations": self._Invalidations,
+            }
+
+
+# Caches enabled so far, one per database connection
+_caches = {}
+
+
+# key:
+#
+# Returns: the cache key for a movie id, so the id 12 and the
+#          inputs "12" and "12.0" share one entry. Details are only
+#          cached under the Movie_ID they were read for, so any other
+#          input is never found.
+def key(movie_id):
+    try:
+        return int(movie_id)
+    except (TypeError, ValueError, OverflowError):
+        pass
+
+    try:
+        value = float(movie_id)
+    except (TypeError, ValueError):
+        return movie_id
+
+    return int(value) if value.is_integer() else movie_id
+
+
+# enable:
+#
+# Puts a cache of the given size and time to live (in seconds,
+# None for no expiry) in front of get_movie_details for the given
+# connection, replacing any cache it had.
+#
+# Returns: the new DetailCache.
+def enable(dbConn, max_size=1024, ttl=None):
+    cache = DetailCache(max_size, ttl)
+    _caches[dbConn] = cache
+    return cache
+
+
+# disable:
+#
+# Removes the cache of the given connection, if it has one.
+def disable(dbConn):
+    _caches.pop(dbConn, None)
+
+
+# get_cache:
+#
+# Returns: the cache of the given connection, or None if caching
+#          is not enabled for it.
+def get_cache(dbConn):
+    return _caches.get(dbConn)
+
+
+# invalidate:
+#
+# Drops the given movie from the cache of the given connection.
+def invalidate(dbConn, movie_id):
+    cache = _caches.get(dbConn)
+    if cache is not None:
+        cache.invalidate(key(movie_id))
+
+
+stmtcache.on_close(disable)
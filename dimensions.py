@@ -0,0 +1,195 @@
+#
+# File: dimensions.py
+#
+# In-memory copy of the genre and production company tables.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# The Genres and Companies tables are small and almost never change, yet
+# every lookup of a movie's details joins them to Movie_Genres and
+# Movie_Production_Companies and sorts the names. Once loaded for a
+# connection, a Dimensions object answers those lookups from memory instead:
+# the names of each table are kept in one list sorted by name, and the names
+# of every movie as a list of positions in it, sorted, so a movie's names
+# come out already in order. The positions of all movies are packed into
+# arrays (the movie ids, where each movie's positions start, and the
+# positions themselves), which take a few bytes per movie rather than a list
+# object each.
+#
+# Load the tables with load when opening the database; objecttier then uses
+# them to assemble movie details. Call refresh after changing any of the
+# four tables, so the copy and the cached details are brought up to date.
+#
+import array
+import bisect
+import threading
+import datatier
+import stmtcache
+import detailcache
+
+
+class Facet:
+    def __init__(self, names, links):
+        # names: (id, name) rows; links: (movie id, id) rows
+        ordered = sorted(names, key=lambda row: (row[1] is not None, row[1] or ""))
+        self._Names = [row[1] for row in ordered]
+        position = {row[0]: pos for pos, row in enumerate(ordered)}
+
+        per_movie = {}
+        for movie_id, id in links:
+            pos = position.get(id)
+            if pos is not None:
+                per_movie.setdefault(movie_id, []).append(pos)
+
+        typecode = "H" if len(self._Names) <= 0xFFFF else "I"
+        self._Movies = array.array("q")
+        self._Starts = array.array("I", [0])
+        self._Positions = array.array(typecode)
+        for movie_id in sorted(per_movie):
+            self._Movies.append(movie_id)
+            self._Positions.extend(sorted(per_movie[movie_id]))
+            self._Starts.append(len(self._Positions))
+
+    @property
+    def Num_Names(self):
+        return len(self._Names)
+
+    @property
+    def Num_Movies(self):
+        return len(self._Movies)
+
+    # names:
+    #
+    # Returns: the names of the given movie in ascending order, as
+    #          the object tier's joins list them: an empty list if
+    #          it has none, or if one of its names is missing.
+    def names(self, movie_id):
+        i = bisect.bisect_left(self._Movies, movie_id)
+        if i == len(self._Movies) or self._Movies[i] != movie_id:
+            return []
+
+        positions = self._Positions[self._Starts[i]:self._Starts[i + 1]]
+        names = self._Names
+        if names[positions[0]] is None:
+            return []
+        return [names[pos] for pos in positions]
+
+    # size:
+    #
+    # Returns: the approximate # of bytes taken by the arrays.
+    def size(self):
+        return sum(a.buffer_info()[1] * a.itemsize
+                   for a in (self._Movies, self._Starts, self._Positions))
+
+
+class Dimensions:
+    def __init__(self, genres, companies):
+        self._Genres = genres
+        self._Companies = companies
+
+    @property
+    def Genres(self):
+        return self._Genres
+
+    @property
+    def Companies(self):
+        return self._Companies
+
+    def genres(self, movie_id):
+        return self._Genres.names(movie_id)
+
+    def companies(self, movie_id):
+        return self._Companies.names(movie_id)
+
+
+# Dimensions loaded so far, one per database connection
+_loaded = {}
+_lock = threading.Lock()
+
+
+# _read:
+#
+# Returns: the Dimensions of the given database, read from its
+#          tables, or None if an internal error occurred (in which
+#          case an error msg is already output).
+def _read(dbConn):
+    facets = []
+    for names_sql, links_sql in (
+            ("Select Genre_ID, Genre_Name From Genres",
+             "Select Movie_ID, Genre_ID From Movie_Genres"),
+            ("Select Company_ID, Company_Name From Companies",
+             "Select Movie_ID, Company_ID From Movie_Production_Companies")):
+        names = datatier.select_n_rows(dbConn, names_sql)
+        if names is None:
+            return None
+        links = datatier.select_n_rows(dbConn, links_sql)
+        if links is None:
+            return None
+        facets.append(Facet(names, links))
+
+    return Dimensions(facets[0], facets[1])
+
+
+# load:
+#
+# Reads the genre and company tables of the given connection into
+# memory, if they are not already, for objecttier to use.
+#
+# Returns: the Dimensions, or None if an internal error occurred
+#          (in which case an error msg is already output).
+def load(dbConn):
+    dims = _loaded.get(dbConn)
+    if dims is not None:
+        return dims
+
+    dims = _read(dbConn)
+    if dims is None:
+        return None
+
+    with _lock:
+        return _loaded.setdefault(dbConn, dims)
+
+
+# refresh:
+#
+# Reads the genre and company tables of the given connection again,
+# replacing the copy in memory, and clears its cached movie details.
+# Call it after changing Genres, Companies, Movie_Genres or
+# Movie_Production_Companies.
+#
+# Returns: the new Dimensions, or None if an internal error occurred
+#          (in which case an error msg is already output, and the
+#          copy is dropped so lookups go back to the tables).
+def refresh(dbConn):
+    dims = _read(dbConn)
+    with _lock:
+        if dims is None:
+            _loaded.pop(dbConn, None)
+        else:
+            _loaded[dbConn] = dims
+
+    cache = detailcache.get_cache(dbConn)
+    if cache is not None:
+        cache.clear()
+    return dims
+
+
+# get:
+#
+# Returns: the Dimensions loaded for the given connection, or None
+#          if they have not been loaded.
+def get(dbConn):
+    return _loaded.get(dbConn)
+
+
+# unload:
+#
+# Drops the copy of the given connection, so lookups go back to
+# the tables.
+def unload(dbConn):
+    with _lock:
+        _loaded.pop(dbConn, None)
+
+
+stmtcache.on_close(unload)
@@ -0,0 +1,214 @@
+#
+# File: indexadvisor.py
+#
+# Checks the query plans of the object tier and provisions supporting indexes.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# Every query of the object tier is registered with the statement cache (see
+# stmtcache.py). This file asks SQLite, through EXPLAIN QUERY PLAN, how it
+# would run each of them against a given database and reports the ones that
+# scan a whole table or need a temporary B-tree to sort or group. It also
+# knows which indexes the object tier relies on and can create those that are
+# missing, then run ANALYZE so the query planner has fresh statistics. Run it
+# from the command line after loading a new database, or as it grows:
+#
+#   python3 indexadvisor.py report [MovieLens.db]
+#   python3 indexadvisor.py provision [MovieLens.db]
+#
+import sys
+import datatier
+import stmtcache
+import objecttier
+import aggregates
+
+
+# The indexes the object tier relies on: (name, table, columns). The
+# index on Ratings also covers the Rating column, so aggregating the
+# ratings of a movie never has to read the table itself.
+INDEXES = [
+    ("Ratings_Movie_Rating", "Ratings", ["Movie_ID", "Rating"]),
+    ("Movie_Genres_Movie", "Movie_Genres", ["Movie_ID", "Genre_ID"]),
+    ("Movie_Production_Companies_Movie", "Movie_Production_Companies",
+     ["Movie_ID", "Company_ID"]),
+    ("Movie_Taglines_Movie", "Movie_Taglines", ["Movie_ID"]),
+    ("Movies_Title", "Movies", ["Title", "Movie_ID"]),
+]
+
+
+# _is_problem:
+#
+# Returns: True if the given line of a query plan is a full scan of
+#          one of the given tables or a temporary B-tree. Scans of
+#          virtual tables (the title index), of lists of values and
+#          of subquery results are not.
+def _is_problem(detail, tables):
+    if detail.startswith("USE TEMP B-TREE"):
+        return True
+    if not detail.startswith("SCAN ") or "VIRTUAL TABLE" in detail:
+        return False
+    return detail.split()[1] in tables
+
+
+# explain:
+#
+# Runs EXPLAIN QUERY PLAN on the given SQL text, with every
+# parameter bound to NULL.
+#
+# Returns: a list of the plan's lines, or None if the query could
+#          not be planned (in which case an error msg is output).
+def explain(dbConn, sql):
+    rows = datatier.select_n_rows(dbConn, "Explain Query Plan " + sql,
+                                  [None] * sql.count("?"))
+    if rows is None:
+        return None
+
+    return [row[3] for row in rows]
+
+
+# report:
+#
+# Plans every registered object tier query against the given
+# database.
+#
+# Returns: a list of (statement name, SQL text, problem lines)
+#          for each query whose plan has a full scan or temporary
+#          B-tree, in order by name. Queries that cannot be planned
+#          are reported with the single problem line "not planned";
+#          queries on the title index are skipped if it is not
+#          installed. None is returned if an internal error occurred.
+def report(dbConn):
+    objecttier.register_all_statements()
+
+    rows = datatier.select_n_rows(dbConn, "Select name From sqlite_master Where type = 'table'")
+    if rows is None:
+        return None
+    tables = {row[0] for row in rows}
+
+    problems = []
+    for name, sql in stmtcache.statements():
+        if "Movies_Title_FTS" in sql and "Movies_Title_FTS" not in tables:
+            continue
+
+        plan = explain(dbConn, sql)
+        if plan is None:
+            problems.append((name, sql, ["not planned"]))
+            continue
+
+        lines = [detail for detail in plan if _is_problem(detail, tables)]
+        if len(lines) > 0:
+            problems.append((name, sql, lines))
+
+    return problems
+
+
+# _indexed_columns:
+#
+# Returns: a list with the column list of every index on the given
+#          table, including the rowid alias if it has one.
+def _indexed_columns(dbConn, table):
+    indexed = []
+
+    rows = datatier.select_n_rows(dbConn, "Pragma table_info(" + table + ")")
+    if rows is None:
+        return None
+
+    # An Integer Primary Key column is the rowid, which is always indexed
+    keys = [row for row in rows if row[5] > 0]
+    if len(keys) == 1 and keys[0][2].upper() == "INTEGER":
+        indexed.append([keys[0][1]])
+
+    indexes = datatier.select_n_rows(dbConn, "Pragma index_list(" + table + ")")
+    if indexes is None:
+        return None
+
+    for index in indexes:
+        rows = datatier.select_n_rows(dbConn, "Pragma index_info(\"" + index[1] + "\")")
+        if rows is None:
+            return None
+        indexed.append([row[2] for row in sorted(rows)])
+
+    return indexed
+
+
+# missing_indexes:
+#
+# Returns: the entries of INDEXES for which the given database has
+#          no index starting with the same columns; None if an
+#          internal error occurred (an error msg is already output).
+def missing_indexes(dbConn):
+    missing = []
+    for name, table, columns in INDEXES:
+        indexed = _indexed_columns(dbConn, table)
+        if indexed is None:
+            return None
+
+        if not any(existing[:len(columns)] == columns for existing in indexed):
+            missing.append((name, table, columns))
+
+    return missing
+
+
+# provision:
+#
+# Creates every missing index of INDEXES and then runs ANALYZE.
+#
+# Returns: the names of the indexes created; None if an internal
+#          error occurred (in which case an error msg is output).
+def provision(dbConn):
+    missing = missing_indexes(dbConn)
+    if missing is None:
+        return None
+
+    actions = []
+    for name, table, columns in missing:
+        sql = "Create Index If Not Exists " + name + " On " + table + "(" + ", ".join(columns) + ")"
+        actions.append((sql, []))
+    actions.append(("Analyze", []))
+
+    if datatier.perform_transaction(dbConn, actions) == -1:
+        return None
+
+    return [name for name, _, _ in missing]
+
+
+##################################################################
+#
+# main:
+#
+# Usage: python3 indexadvisor.py (report | provision) [database]
+#
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("report", "provision"):
+        print("usage: python3 indexadvisor.py (report | provision) [database]")
+        sys.exit(2)
+
+    path = sys.argv[2] if len(sys.argv) > 2 else "MovieLens.db"
+    dbConn = datatier.connect(path)
+
+    if aggregates.install_summary(dbConn) == 0:
+        sys.exit(1)
+
+    if sys.argv[1] == "provision":
+        created = provision(dbConn)
+        if created is None:
+            sys.exit(1)
+        print("Indexes created:", ", ".join(created) if len(created) > 0 else "none")
+        print()
+
+    problems = report(dbConn)
+    missing = missing_indexes(dbConn)
+    if problems is None or missing is None:
+        sys.exit(1)
+
+    for name, _, lines in problems:
+        print(name + ":")
+        for line in lines:
+            print(" ", line)
+
+    print()
+    print("# of queries with full scans or temp B-trees:", len(problems))
+    print("# of missing indexes:", len(missing))
+    for name, table, columns in missing:
+        print(" ", name, "on", table + "(" + ", ".join(columns) + ")")
@@ -0,0 +1,280 @@
+#
+# File: instrument.py
+#
+# Timing, row counts and slow query logging for the data tier.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# Once enabled, every query run through datatier is timed and counted here,
+# per statement: statements registered with stmtcache are reported under
+# their name, any other under their SQL text. For each statement the number
+# of executions, failures and rows returned or modified are kept, with a
+# histogram of execution times in power-of-two buckets of microseconds (so
+# recording a time is a few integer operations, cheap enough to leave on).
+# Queries slower than a threshold are kept in a slow query log, and can also
+# be written to a stream as they happen.
+#
+# Hooks added with add_hook are called after every query with its details,
+# and trace and progress install sqlite3's own trace and progress callbacks
+# on a connection, for digging into a particular problem.
+#
+import time
+import threading
+import collections
+import stmtcache
+
+
+# Slow queries kept for the report, the oldest are dropped first
+SLOW_LOG_SIZE = 100
+
+
+# Checked by datatier before timing a query
+enabled = False
+
+_slow_threshold = None
+_slow_stream = None
+_slow_log = collections.deque(maxlen=SLOW_LOG_SIZE)
+
+_hooks = []
+_stats = {}
+_lock = threading.Lock()
+
+
+class StatementStats:
+    __slots__ = ("_Executions", "_Failures", "_Rows", "_Total_Time",
+                 "_Max_Time", "_Buckets")
+
+    def __init__(self):
+        self._Executions = 0
+        self._Failures = 0
+        self._Rows = 0
+        self._Total_Time = 0.0
+        self._Max_Time = 0.0
+        self._Buckets = []
+
+    @property
+    def Executions(self):
+        return self._Executions
+
+    @property
+    def Failures(self):
+        return self._Failures
+
+    @property
+    def Rows(self):
+        return self._Rows
+
+    @property
+    def Total_Time(self):
+        return self._Total_Time
+
+    @property
+    def Max_Time(self):
+        return self._Max_Time
+
+    # Histogram: entry b counts the executions that took less than
+    # 2**b microseconds (and at least 2**(b-1), for b > 0)
+    @property
+    def Buckets(self):
+        return list(self._Buckets)
+
+    def _add(self, elapsed, rows, failed):
+        self._Executions += 1
+        self._Total_Time += elapsed
+        if elapsed > self._Max_Time:
+            self._Max_Time = elapsed
+        if failed:
+            self._Failures += 1
+        elif rows > 0:
+            self._Rows += rows
+
+        bucket = int(elapsed * 1000000).bit_length()
+        buckets = self._Buckets
+        while len(buckets) <= bucket:
+            buckets.append(0)
+        buckets[bucket] += 1
+
+    # percentile:
+    #
+    # Returns: an upper bound, in seconds, on the time taken by the
+    #          given percentage (0..100) of executions, from the
+    #          histogram; 0.0 if there were none.
+    def percentile(self, percent):
+        wanted = self._Executions * percent / 100
+        seen = 0
+        for bucket, count in enumerate(self._Buckets):
+            seen += count
+            if count > 0 and seen >= wanted:
+                return min(2 ** bucket / 1000000, self._Max_Time)
+        return 0.0
+
+
+# enable:
+#
+# Starts timing every query run through datatier. Queries that
+# take at least slow_threshold seconds are kept in the slow query
+# log and, if stream is given, written to it as well (pass None as
+# slow_threshold for no slow query log).
+def enable(slow_threshold=None, stream=None):
+    global enabled, _slow_threshold, _slow_stream
+    _slow_threshold = slow_threshold
+    _slow_stream = stream
+    enabled = True
+
+
+# disable:
+#
+# Stops timing queries; the statistics gathered so far are kept.
+def disable():
+    global enabled
+    enabled = False
+
+
+# add_hook:
+#
+# Calls hook(function, sql, parameters, elapsed, rows, error)
+# after every query timed: function is the name of the datatier
+# function that ran it, elapsed in seconds, rows the # of rows
+# returned or modified, and error the exception raised, or None.
+# A hook must not run queries itself.
+def add_hook(hook):
+    with _lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook):
+    with _lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+# start:
+#
+# Returns: the time a query is starting at, to be passed to finish,
+#          or None if instrumentation is not enabled.
+def start():
+    if not enabled:
+        return None
+    return time.perf_counter()
+
+
+# finish:
+#
+# Records a query started at the time returned by start (nothing
+# is done if that was None), which returned or modified the given
+# # of rows, or failed with the given error.
+def finish(started, function, sql, parameters, rows, error=None):
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+
+    name = stmtcache.name(sql)
+    if name is None:
+        name = sql
+
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = StatementStats()
+        stats._add(elapsed, rows, error is not None)
+
+        slow = _slow_threshold is not None and elapsed >= _slow_threshold
+        if slow:
+            _slow_log.append((time.time(), name, elapsed, rows))
+        hooks = list(_hooks)
+
+    if slow and _slow_stream is not None:
+        print("slow query: {} took {:.1f} ms ({} rows)".format(name, elapsed * 1000, rows),
+              file=_slow_stream)
+
+    for hook in hooks:
+        hook(function, sql, parameters, elapsed, rows, error)
+
+
+# trace:
+#
+# Has sqlite3 call callback with the text of every SQL statement
+# the given connection runs, including those run by triggers; pass
+# None to stop.
+def trace(dbConn, callback):
+    dbConn.set_trace_callback(callback)
+
+
+# progress:
+#
+# Has sqlite3 call callback every n virtual machine instructions
+# while the given connection runs a query; if callback returns a
+# true value the query is interrupted and fails. Pass None to stop.
+def progress(dbConn, callback, n=10000):
+    dbConn.set_progress_handler(callback, n)
+
+
+# stats:
+#
+# Returns: a dictionary with an entry per statement executed since
+#          instrumentation was enabled (or reset), giving its #
+#          of executions, failures and rows, its total, mean, p50,
+#          p99 and max time in seconds and its histogram.
+def stats():
+    with _lock:
+        report = {}
+        for name, s in _stats.items():
+            report[name] = {
+                "executions": s.Executions,
+                "failures": s.Failures,
+                "rows": s.Rows,
+                "total_time": s.Total_Time,
+                "mean_time": s.Total_Time / s.Executions,
+                "p50_time": s.percentile(50),
+                "p99_time": s.percentile(99),
+                "max_time": s.Max_Time,
+                "buckets": s.Buckets,
+            }
+        return report
+
+
+# slow_queries:
+#
+# Returns: a list of (wall clock time, statement, elapsed secs,
+#          rows) for the most recent slow queries, oldest first.
+def slow_queries():
+    with _lock:
+        return list(_slow_log)
+
+
+# reset:
+#
+# Forgets the statistics and slow queries recorded so far.
+def reset():
+    with _lock:
+        _stats.clear()
+        _slow_log.clear()
+
+
+# report:
+#
+# Returns: the statistics as lines of text, one per statement in
+#          order of total time (the most expensive first), followed
+#          by the slow query log.
+def report():
+    lines = ["{:<32} {:>7} {:>5} {:>9} {:>10} {:>10} {:>10} {:>10}".format(
+        "statement", "execs", "fails", "rows", "total ms", "mean ms", "p99 ms", "max ms")]
+
+    ordered = sorted(stats().items(), key=lambda item: item[1]["total_time"], reverse=True)
+    for name, s in ordered:
+        if len(name) > 32:
+            name = name[:29] + "..."
+        lines.append("{:<32} {:>7} {:>5} {:>9} {:>10.2f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            name, s["executions"], s["failures"], s["rows"], s["total_time"] * 1000,
+            s["mean_time"] * 1000, s["p99_time"] * 1000, s["max_time"] * 1000))
+
+    slow = slow_queries()
+    if len(slow) > 0:
+        lines.append("")
+        lines.append("slow queries:")
+        for when, name, elapsed, rows in slow:
+            lines.append("  {} {} {:.1f} ms ({} rows)".format(
+                time.strftime("%H:%M:%S", time.localtime(when)), name, elapsed * 1000, rows))
+
+    return lines
@@ -0,0 +1,392 @@
+#
+# File: leaderboard.py
+#
+# Precomputed top-N leaderboard used by the object tier.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# A Leaderboard holds every reviewed movie sorted by average rating, so the
+# top N movies with at least K reviews are found by walking a sorted list
+# instead of sorting every qualifying movie on each request. The movies are
+# partitioned into tiers by review count: tier t holds, in rating order, the
+# movies with at least 2^t reviews. A query for K reviews walks the tier with
+# the largest threshold <= K, which is located in O(1), then finds its start
+# with a binary search, and only ever skips movies with fewer than 2K reviews.
+#
+# Ranking by raw average favours movies with a handful of high ratings, which
+# the minimum # of reviews only partly filters out. The leaderboard also keeps
+# every movie sorted by an IMDb-style weighted rating,
+#
+#   (v * R + m * C) / (v + m)
+#
+# where v is the movie's # of reviews, R its average, C the mean of all
+# ratings and m PRIOR_WEIGHT: a movie's average is pulled towards C as if it
+# had m more reviews rated C, so it only ranks high once enough reviews back
+# it. C moves with every review, which would change every score, so the
+# scores use the value of C when they were last computed; they are all
+# recomputed once the actual mean has drifted by more than MAX_DRIFT.
+#
+# The leaderboard is built from the Movie_Rating_Summary table (see
+# aggregates.py) the first time it is needed for a connection and is then
+# patched in place by record_review as reviews are added. Call invalidate
+# if the database is modified behind the object tier's back.
+#
+# Code that adds reviews does so inside writing(dbConn), so a leaderboard
+# (or the analytics, see analytics.py) being built on another thread at the
+# same time is not kept: it could not tell whether the summary it read
+# already had those reviews, so patching it would count them once too few
+# or once too many.
+#
+import bisect
+import threading
+import contextlib
+import datatier
+import stmtcache
+
+
+# How many entries a walk collects each time it takes the lock
+_CHUNK = 64
+
+# How many times a leaderboard is built before giving up on keeping
+# one, when reviews start being added while it is built
+_BUILD_ATTEMPTS = 3
+
+# The rankings top can walk
+RANKINGS = ("raw", "weighted")
+
+# Weight m of the mean of all ratings in a weighted rating, counted
+# as that many reviews
+PRIOR_WEIGHT = 10
+
+# How far the mean of all ratings may move before the weighted
+# ratings are recomputed
+MAX_DRIFT = 0.01
+
+
+class Leaderboard:
+    def __init__(self, prior_weight=PRIOR_WEIGHT):
+        self._Entries = {}
+        self._Tiers = []
+        self._Lock = threading.Lock()
+
+        # Weighted ranking: sorted keys, and the mean C they were scored with
+        self._Prior_Weight = prior_weight
+        self._Weighted = []
+        self._Prior_Mean = 0.0
+        self._Num_Ratings = 0
+        self._Sum_Ratings = 0
+
+    # _key:
+    #
+    # Sort key for a movie within a tier: highest average first,
+    # ties broken by ascending movie id.
+    @staticmethod
+    def _key(movie_id, entry):
+        return (-(entry[1] / entry[0]), movie_id)
+
+    # _weighted_key:
+    #
+    # Sort key for a movie in the weighted ranking: highest weighted
+    # rating first, ties broken by ascending movie id.
+    def _weighted_key(self, movie_id, entry):
+        m = self._Prior_Weight
+        return (-((entry[1] + m * self._Prior_Mean) / (entry[0] + m)), movie_id)
+
+    # _rescore:
+    #
+    # Recomputes every weighted rating with the current mean of all
+    # ratings.
+    def _rescore(self):
+        if self._Num_Ratings > 0:
+            self._Prior_Mean = self._Sum_Ratings / self._Num_Ratings
+        self._Weighted = sorted(self._weighted_key(m, e) for m, e in self._Entries.items())
+
+    def _tier_count(self, num_reviews):
+        return num_reviews.bit_length()
+
+    def _place(self, movie_id, entry):
+        bisect.insort(self._Weighted, self._weighted_key(movie_id, entry))
+
+        key = self._key(movie_id, entry)
+        while len(self._Tiers) < self._tier_count(entry[0]):
+            self._Tiers.append([])
+        for t in range(self._tier_count(entry[0])):
+            bisect.insort(self._Tiers[t], key)
+
+    def _remove(self, movie_id, entry):
+        key = self._weighted_key(movie_id, entry)
+        i = bisect.bisect_left(self._Weighted, key)
+        if i < len(self._Weighted) and self._Weighted[i] == key:
+            del self._Weighted[i]
+
+        key = self._key(movie_id, entry)
+        for t in range(self._tier_count(entry[0])):
+            tier = self._Tiers[t]
+            i = bisect.bisect_left(tier, key)
+            if i < len(tier) and tier[i] == key:
+                del tier[i]
+
+    # load:
+    #
+    # Replaces the contents of the leaderboard with the given rows
+    # of (movie id, title, year, # of reviews, sum of ratings).
+    def load(self, rows):
+        with self._Lock:
+            self._Entries = {}
+            self._Tiers = []
+            for row in rows:
+                if row[3] > 0:
+                    self._Entries[row[0]] = [row[3], row[4], row[1], row[2]]
+
+            # Bulk build each tier with one sort rather than repeated inserts
+            keyed = sorted((self._key(m, e), e[0]) for m, e in self._Entries.items())
+            for key, num in keyed:
+                while len(self._Tiers) < self._tier_count(num):
+                    self._Tiers.append([])
+                for t in range(self._tier_count(num)):
+                    self._Tiers[t].append(key)
+
+            self._Num_Ratings = sum(e[0] for e in self._Entries.values())
+            self._Sum_Ratings = sum(e[1] for e in self._Entries.values())
+            self._rescore()
+
+    # add_rating:
+    #
+    # Patches the leaderboard in place for one new rating of the
+    # given movie. title and year are only used if the movie was
+    # not on the leaderboard yet.
+    def add_rating(self, movie_id, rating, title, year):
+        with self._Lock:
+            # Everything that can fail is computed before the tiers change
+            entry = self._Entries.get(movie_id)
+            if entry is None:
+                updated = [1, rating, title, year]
+            else:
+                updated = [entry[0] + 1, entry[1] + rating, entry[2], entry[3]]
+            sum_ratings = self._Sum_Ratings + rating
+
+            if entry is not None:
+                self._remove(movie_id, entry)
+            self._Entries[movie_id] = updated
+            self._place(movie_id, updated)
+
+            self._Num_Ratings += 1
+            self._Sum_Ratings = sum_ratings
+            if abs(self._Sum_Ratings / self._Num_Ratings - self._Prior_Mean) > MAX_DRIFT:
+                self._rescore()
+
+    def contains(self, movie_id):
+        return movie_id in self._Entries
+
+    # Mean of all ratings the weighted ratings are computed with
+    @property
+    def Prior_Mean(self):
+        return self._Prior_Mean
+
+    # weighted_rating:
+    #
+    # Returns: the weighted rating of the given movie, or None if it
+    #          is not on the leaderboard.
+    def weighted_rating(self, movie_id):
+        with self._Lock:
+            entry = self._Entries.get(movie_id)
+            if entry is None:
+                return None
+            return -self._weighted_key(movie_id, entry)[0]
+
+    # top:
+    #
+    # Generator over the movies with at least min_num_reviews
+    # reviews, highest average rating first, or highest weighted
+    # rating first if ranking is "weighted". Yields tuples of
+    # (movie id, title, year, # of reviews, avg rating); pass
+    # None as N to walk the whole leaderboard.
+    #
+    # The walk takes the lock a chunk at a time. A movie patched
+    # between chunks moves in the tier, so it is listed where it is
+    # when the walk gets there, or not at all if it moved above the
+    # part already walked; it is never listed twice.
+    def top(self, N, min_num_reviews, ranking="raw"):
+        threshold = max(int(min_num_reviews), 1)
+        t = threshold.bit_length() - 1
+        weighted = ranking == "weighted"
+        remaining = N
+
+        seen = set()
+        last = None
+        while remaining is None or remaining > 0:
+            chunk = []
+            with self._Lock:
+                if weighted:
+                    tier = self._Weighted
+                elif t >= len(self._Tiers):
+                    return
+                else:
+                    tier = self._Tiers[t]
+
+                # Resume after the last key seen; a movie that moved below
+                # it since the last chunk was listed already
+                i = 0 if last is None else bisect.bisect_right(tier, last)
+                while i < len(tier) and len(chunk) < _CHUNK:
+                    key = tier[i]
+                    entry = self._Entries[key[1]]
+                    if entry[0] >= threshold and key[1] not in seen:
+                        seen.add(key[1])
+                        chunk.append((key[1], entry[2], entry[3], entry[0], entry[1] / entry[0]))
+                    last = key
+                    i += 1
+                exhausted = i >= len(tier)
+
+            for movie in chunk:
+                if remaining is not None:
+                    if remaining == 0:
+                        return
+                    remaining -= 1
+                yield movie
+
+            if exhausted:
+                return
+
+
+# Leaderboards built so far, one per database connection
+_boards = {}
+_boards_lock = threading.Lock()
+
+# Per database connection: [# of writes in progress, # finished]
+_writes = {}
+_writes_lock = threading.Lock()
+
+
+# writing:
+#
+# Context manager around code that adds reviews to the database
+# of the given connection and patches what was built from it.
+@contextlib.contextmanager
+def writing(dbConn):
+    with _writes_lock:
+        _writes.setdefault(dbConn, [0, 0])[0] += 1
+    try:
+        yield
+    finally:
+        with _writes_lock:
+            counts = _writes[dbConn]
+            counts[0] -= 1
+            counts[1] += 1
+
+
+def _settled(dbConn):
+    counts = _writes.get(dbConn, (0, 0))
+    return counts[1] if counts[0] == 0 else None
+
+
+# settled:
+#
+# Returns: the # of writes finished on the given connection so far,
+#          or None if one is in progress. Pass it to keep_built.
+def settled(dbConn):
+    with _writes_lock:
+        return _settled(dbConn)
+
+
+# keep_built:
+#
+# Stores value, built from the database of the given connection,
+# into registry (a dictionary keyed by connection), unless a write
+# started since settled returned settled_at; the value kept for the
+# connection by another thread wins over this one.
+#
+# Returns: the value kept for the connection, or None if a write
+#          got in the way and value was not kept.
+def keep_built(dbConn, registry, value, settled_at):
+    with _writes_lock:
+        if settled_at is None or _settled(dbConn) != settled_at:
+            return None
+        return registry.setdefault(dbConn, value)
+
+
+# get_leaderboard:
+#
+# Returns the leaderboard for the given connection, building
+# it from Movie_Rating_Summary on first use. If reviews are being
+# added when it is built, it is built once and returned without
+# being kept (nor patched), and the next call tries again; if they
+# only start being added while it is built, it is built again.
+#
+# Returns: a Leaderboard object; if an internal error occurs
+#          None is returned (and an error msg is output).
+def get_leaderboard(dbConn):
+    board = _boards.get(dbConn)
+    if board is not None:
+        return board
+
+    sql = """Select Movies.Movie_ID, Title, strftime('%Y', Release_Date),
+    Num_Reviews, Sum_Ratings From Movies Inner Join Movie_Rating_Summary On
+    Movies.Movie_ID = Movie_Rating_Summary.Movie_ID Where Num_Reviews > 0"""
+
+    for attempt in range(_BUILD_ATTEMPTS):
+        settled_at = settled(dbConn)
+        rows = datatier.select_n_rows(dbConn, sql)
+
+        if rows is None:
+            return None
+
+        board = Leaderboard()
+        board.load(rows)
+
+        # No point building again while the same writes are still going on
+        if settled_at is None:
+            return board
+
+        kept = keep_built(dbConn, _boards, board, settled_at)
+        if kept is not None:
+            return kept
+
+    return board
+
+
+# record_review:
+#
+# Patches the leaderboard of the given connection, if one has
+# been built, after a rating was inserted for the given movie.
+# movie_id must be the id as stored in the Movies table.
+def record_review(dbConn, movie_id, rating):
+    board = _boards.get(dbConn)
+    if board is None:
+        return
+
+    title = None
+    year = None
+    if not board.contains(movie_id):
+        sql = """Select Title, strftime('%Y', Release_Date) From Movies
+        Where Movies.Movie_ID = ?"""
+        row = datatier.select_one_row(dbConn, sql, [movie_id])
+        if row is None or row == ():
+            invalidate(dbConn)
+            return
+        title = row[0]
+        year = row[1]
+
+    board.add_rating(movie_id, rating, title, year)
+
+
+# invalidate:
+#
+# Discards the leaderboard of the given connection; it is
+# rebuilt from the database the next time it is needed.
+def invalidate(dbConn):
+    with _boards_lock:
+        _boards.pop(dbConn, None)
+
+
+# _release:
+#
+# Drops the leaderboard and write counts of the given connection,
+# as it is closed.
+def _release(dbConn):
+    invalidate(dbConn)
+    with _writes_lock:
+        _writes.pop(dbConn, None)
+
+
+stmtcache.on_close(_release)
@@ -11,8 +11,14 @@
 # well as updating movie taglines. 
 #
 
-import sqlite3
+import argparse
+import datatier
+import connpool
 import objecttier
+import aggregates
+import instrument
+import dimensions
+import writebehind
 
 
 # retrieve_movies:
@@ -55,27 +61,28 @@ def command_one(dbConn):
     prompt = "Enter movie name (wildcards _ and % supported): "
     name = input(prompt)
 
-    movies = objecttier.get_movies(dbConn, name)
+    # Count the matches first, so a broad search does not retrieve every movie
+    found = objecttier.count_movies(dbConn, name)
 
     # Error checking if 0 or 100+ movies were found
-    if movies is None:
+    if found == -1:
         return
-    elif len(movies) > 100:
+    elif found > 100:
         print()
-        print("# of movies found:", len(movies))
+        print("# of movies found:", found)
         print()
         print("There are too many movies to display, please narrow your search and try again...")
         return
     else:
         print()
-        print("# of movies found:", len(movies))
+        print("# of movies found:", found)
 
         # Error checking if no movies found
-        if len(movies) == 0:
+        if found == 0:
             return
         print()
 
-        for m in movies:
+        for m in objecttier.iter_movies(dbConn, name):
             print(m.Movie_ID, ":", m.Title, "({})".format(m.Release_Year))
 
 
@@ -88,7 +95,8 @@ def command_two(dbConn):
     prompt = "Enter movie id: "
     id = input(prompt)
 
-    m = objecttier.get_movie_details(dbConn, id)
+    # Every detail is printed, so load them all at once rather than lazily
+    m = objecttier.get_movie_details(dbConn, id, "batch")
 
     # Check if movie id was not found
     if m is None:
@@ -120,9 +128,10 @@ def command_two(dbConn):
 
 # command_three:
 #
-# Prompts the user for a number of movies and a minimum number of reviews. The number of
-# movies/reviews should be positive (i.e greater than 0). If nothing is retrieved, there
-# is nothing printed.
+# Prompts the user for a number of movies, a minimum number of reviews and the ranking:
+# "raw" by average rating, or "weighted" by a rating that discounts movies with few
+# reviews. The number of movies/reviews should be positive (i.e greater than 0). If
+# nothing is retrieved, there is nothing printed.
 def command_three(dbConn):
     print()
     prompt_one = "N? "
@@ -140,7 +149,16 @@ def command_three(dbConn):
         print("Please enter a positive value for min number of reviews...")
         return
 
-    movies = objecttier.get_top_N_movies(dbConn, int(num_movies), int(num_revs))
+    # Rank by raw average unless the weighted rating is asked for
+    prompt_three = "ranking (raw or weighted, default raw)? "
+    ranking = input(prompt_three).strip().lower()
+    if ranking == "":
+        ranking = "raw"
+    elif ranking not in ("raw", "weighted"):
+        print("Please enter raw or weighted for the ranking...")
+        return
+
+    movies = objecttier.get_top_N_movies(dbConn, int(num_movies), int(num_revs), ranking)
 
     # Check if no movies/data was found
     if movies is None or movies == []:
@@ -156,7 +174,8 @@ def command_three(dbConn):
 #
 # Prompts the user for a rating between 0 - 10 and a movie id. If both inputs are valid,
 # then a successful insertion message is printed. If not, the appropriate error message is
-# printed instead.
+# printed instead. The review goes through the write-behind queue if there is one, which
+# waits for it to be committed.
 def command_four(dbConn):
     print()
     prompt_one = "Enter rating (0..10): "
@@ -169,7 +188,11 @@ def command_four(dbConn):
 
     prompt_two = "Enter movie id: "
     id = input(prompt_two)
-    action = objecttier.add_review(dbConn, id, int(rating))
+    reviews = writebehind.get_queue(dbConn)
+    if reviews is not None:
+        action = reviews.add_review(id, int(rating))
+    else:
+        action = objecttier.add_review(dbConn, id, int(rating))
 
     # Check if the movie was not found
     if action == 0:
@@ -205,32 +228,85 @@ def command_five(dbConn):
         print("Tagline successfully set")
 
 
+##################################################################
+#
+# command_stats:
+#
+# Prints the time taken by every query run so far, per statement,
+# followed by the queries that were slow.
+#
+def command_stats(dbConn):
+    print()
+    for line in instrument.report():
+        print(line)
+
+
 ##################################################################
 #
 # main:
 #
+# Runs the interactive program; see batchmode.py to run the same
+# commands from a file or as a server. With write_behind, reviews
+# are written behind the command loop in group commits (see
+# writebehind.py), and with wal the database is switched to WAL
+# mode so lookups need not wait for them.
+#
+def main(write_behind=False, wal=False):
+    print("** Welcome to the MovieLens app **")
+    print()
+
+    # Time every query, logging those slower than a quarter of a second
+    instrument.enable(slow_threshold=0.25)
 
-print("** Welcome to the MovieLens app **")
-print()
-
-dbConn = sqlite3.connect('MovieLens.db')
-retrieve_movies(dbConn)
-retrieve_reviews(dbConn)
-print()
-
-# Prompts user for commands, 'x' ends the program
-command = input("Please enter a command (1-5, x to exit): ")
-while command != "x":
-    if command == "1":
-        command_one(dbConn)
-    elif command == "2":
-        command_two(dbConn)
-    elif command == "3":
-        command_three(dbConn)
-    elif command == "4":
-        command_four(dbConn)
-    elif command == "5":
-        command_five(dbConn)
+    # Write-behind needs a pool rather than a single connection, as
+    # the reviews are written on another thread
+    if write_behind:
+        dbConn = connpool.ConnectionPool('MovieLens.db', size=1, wal=wal)
+    else:
+        dbConn = datatier.connect('MovieLens.db')
+
+    # Without the summary every movie would read 0 reviews, so stop here
+    if aggregates.install_summary(dbConn) == 0 or dimensions.load(dbConn) is None:
+        print("**Unable to prepare the database, exiting...")
+        dbConn.close()
+        return
 
+    if write_behind:
+        writebehind.enable(dbConn)
+    retrieve_movies(dbConn)
+    retrieve_reviews(dbConn)
     print()
-    command = input("Please enter a command (1-5, x to exit): ")
+
+    # Prompts user for commands, 'x' ends the program
+    try:
+        command = input("Please enter a command (1-5, s for stats, x to exit): ")
+        while command != "x":
+            if command == "1":
+                command_one(dbConn)
+            elif command == "2":
+                command_two(dbConn)
+            elif command == "3":
+                command_three(dbConn)
+            elif command == "4":
+                command_four(dbConn)
+            elif command == "5":
+                command_five(dbConn)
+            elif command == "s":
+                command_stats(dbConn)
+
+            print()
+            command = input("Please enter a command (1-5, s for stats, x to exit): ")
+    finally:
+        # Write any review still queued before closing the database
+        writebehind.disable(dbConn)
+        dbConn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MovieLens app")
+    parser.add_argument("--write-behind", action="store_true",
+                        help="write reviews in group commits on a background thread")
+    parser.add_argument("--wal", action="store_true",
+                        help="with --write-behind, switch the database to WAL mode")
+    args = parser.parse_args()
+    main(args.write_behind, args.wal)
@@ -6,16 +6,31 @@
 # number of movies and reviews, list of movies matching user input, all info
 # about a movie, and a list of N movies with a certain average rating. There
 # is also functionality for modifying the database with insertion and update
-# actions.
+# actions. Rating counts and averages are read from the Movie_Rating_Summary
+# table, which must first be installed with aggregates.install_summary.
 #
 # Daniel Valencia
 # MovieLens Application
 #
 
+import csv
+import array
+import json
+import functools
 import datatier
+import stmtcache
+import analytics
+import leaderboard
+import detailcache
+import dimensions
+import titlesearch
 
 
+# The result classes use __slots__, so their objects do not carry a
+# __dict__: large result sets take a fraction of the memory.
 class Movie:
+    __slots__ = ("_Movie_ID", "_Title", "_Release_Year")
+
     def __init__(self, id, title, year):
         self._Movie_ID = id
         self._Title = title
@@ -35,6 +50,9 @@ class Movie:
 
 
 class MovieRating:
+    __slots__ = ("_Movie_ID", "_Title", "_Release_Year", "_Num_Reviews",
+                 "_Avg_Rating")
+
     def __init__(self, id, title, year, num_reviews, avg_rating):
         self._Movie_ID = id
         self._Title = title
@@ -64,6 +82,11 @@ class MovieRating:
 
 
 class MovieDetails:
+    __slots__ = ("_Movie_ID", "_Title", "_Num_Reviews", "_Avg_Rating",
+                 "_Release_Date", "_Runtime", "_Original_Language", "_Budget",
+                 "_Revenue", "_Tagline", "_Genres", "_Production_Companies",
+                 "_DbConn", "_Pending")
+
     def __init__(self, id, title, num_reviews, avg_rating,
                  release_date, runtime, language, budget,
                  revenue, tagline):
@@ -77,8 +100,14 @@ class MovieDetails:
         self._Budget = budget
         self._Revenue = revenue
         self._Tagline = tagline
-        self._Genres = []
-        self._Production_Companies = []
+
+        # The lists are only allocated for movies that have genres/companies
+        self._Genres = None
+        self._Production_Companies = None
+
+        # Facets still to be loaded from dbConn, if created lazily
+        self._DbConn = None
+        self._Pending = None
 
     @property
     def Movie_ID(self):
@@ -90,10 +119,14 @@ class MovieDetails:
 
     @property
     def Num_Reviews(self):
+        if self._Pending is not None:
+            self._load("ratings")
         return self._Num_Reviews
 
     @property
     def Avg_Rating(self):
+        if self._Pending is not None:
+            self._load("ratings")
         return self._Avg_Rating
 
     @property
@@ -118,45 +151,370 @@ class MovieDetails:
 
     @property
     def Tagline(self):
+        if self._Pending is not None:
+            self._load("taglines")
         return self._Tagline
 
     @property
     def Genres(self):
+        if self._Pending is not None:
+            self._load("genres")
+        if self._Genres is None:
+            return []
         return self._Genres
 
     @property
     def Production_Companies(self):
+        if self._Pending is not None:
+            self._load("companies")
+        if self._Production_Companies is None:
+            return []
         return self._Production_Companies
 
+    # _load:
+    #
+    # Loads the given facet, if it is still pending, from the
+    # connection the details were created with. A facet that fails
+    # to load keeps its default value and is tried again on the
+    # next access.
+    def _load(self, facet):
+        # Another thread may clear both once the last facet is loaded,
+        # so use local copies; no connection means nothing is pending
+        pending, dbConn = self._Pending, self._DbConn
+        if pending is None or dbConn is None or facet not in pending:
+            return
+        if _load_facet(dbConn, self, facet) == 0:
+            return
+
+        pending.discard(facet)
+        if len(pending) == 0:
+            self._Pending = None
+            self._DbConn = None
+
+    # _load_all:
+    #
+    # Loads every facet still pending.
+    def _load_all(self):
+        for facet in LAZY_FACETS:
+            self._load(facet)
+
+    def _add_genre(self, name):
+        if self._Genres is None:
+            self._Genres = []
+        self._Genres.append(name)
+
+    def _add_company(self, name):
+        if self._Production_Companies is None:
+            self._Production_Companies = []
+        self._Production_Companies.append(name)
+
+
+# RatingStats:
+#
+# The distribution of a movie's ratings: the # of reviews of each
+# rating 0..10 and statistics of them. The mean, standard deviation,
+# quartiles and median are None for a movie with no reviews.
+class RatingStats:
+    __slots__ = ("_Movie_ID", "_Num_Reviews", "_Avg_Rating", "_Std_Dev",
+                 "_P25", "_Median", "_P75", "_Bayesian_Avg", "_Histogram")
+
+    def __init__(self, id, num_reviews, avg_rating, std_dev, p25, median,
+                 p75, bayesian_avg, histogram):
+        self._Movie_ID = id
+        self._Num_Reviews = num_reviews
+        self._Avg_Rating = avg_rating
+        self._Std_Dev = std_dev
+        self._P25 = p25
+        self._Median = median
+        self._P75 = p75
+        self._Bayesian_Avg = bayesian_avg
+        self._Histogram = histogram
 
-# num_movies:
+    @property
+    def Movie_ID(self):
+        return self._Movie_ID
+
+    @property
+    def Num_Reviews(self):
+        return self._Num_Reviews
+
+    @property
+    def Avg_Rating(self):
+        return self._Avg_Rating
+
+    @property
+    def Std_Dev(self):
+        return self._Std_Dev
+
+    @property
+    def P25(self):
+        return self._P25
+
+    @property
+    def Median(self):
+        return self._Median
+
+    @property
+    def P75(self):
+        return self._P75
+
+    # Average pulled towards the mean of all ratings, by as much as
+    # analytics.PRIOR_WEIGHT reviews would
+    @property
+    def Bayesian_Avg(self):
+        return self._Bayesian_Avg
+
+    # The # of reviews of each rating 0..10
+    @property
+    def Histogram(self):
+        return self._Histogram
+
+
+# MovieColumns:
 #
-# Returns: # of movies in the database; if an error returns -1
-def num_movies(dbConn):
-    sql = "Select count(*) From Movies;"
-    row = datatier.select_one_row(dbConn, sql)
+# Columnar container for a large list of movies: the ids, titles
+# and release years are kept in parallel arrays instead of one
+# object per movie. Indexing or iterating creates Movie objects
+# on the fly; the columns can also be used directly.
+class MovieColumns:
+    __slots__ = ("_Movie_ID", "_Title", "_Release_Year")
+
+    def __init__(self):
+        self._Movie_ID = array.array("q")
+        self._Title = []
+        self._Release_Year = []
+
+    @property
+    def Movie_ID(self):
+        return self._Movie_ID
+
+    @property
+    def Title(self):
+        return self._Title
+
+    @property
+    def Release_Year(self):
+        return self._Release_Year
+
+    def __len__(self):
+        return len(self._Movie_ID)
+
+    def __getitem__(self, i):
+        return Movie(self._Movie_ID[i], self._Title[i], self._Release_Year[i])
+
+    def __iter__(self):
+        for i in range(len(self._Movie_ID)):
+            yield self[i]
+
+    def _append(self, row, years):
+        self._Movie_ID.append(row[0])
+        self._Title.append(row[1])
+        # Share one string per distinct year
+        self._Release_Year.append(years.setdefault(row[2], row[2]))
+
+
+# MovieRatingColumns:
+#
+# Columnar container for a large list of rated movies, like
+# MovieColumns; the # of reviews and average ratings are kept
+# in arrays as well.
+class MovieRatingColumns:
+    __slots__ = ("_Movie_ID", "_Title", "_Release_Year", "_Num_Reviews",
+                 "_Avg_Rating")
+
+    def __init__(self):
+        self._Movie_ID = array.array("q")
+        self._Title = []
+        self._Release_Year = []
+        self._Num_Reviews = array.array("q")
+        self._Avg_Rating = array.array("d")
+
+    @property
+    def Movie_ID(self):
+        return self._Movie_ID
+
+    @property
+    def Title(self):
+        return self._Title
+
+    @property
+    def Release_Year(self):
+        return self._Release_Year
+
+    @property
+    def Num_Reviews(self):
+        return self._Num_Reviews
+
+    @property
+    def Avg_Rating(self):
+        return self._Avg_Rating
+
+    def __len__(self):
+        return len(self._Movie_ID)
+
+    def __getitem__(self, i):
+        return MovieRating(self._Movie_ID[i], self._Title[i], self._Release_Year[i],
+                           self._Num_Reviews[i], self._Avg_Rating[i])
+
+    def __iter__(self):
+        for i in range(len(self._Movie_ID)):
+            yield self[i]
+
+    def _append(self, row, years):
+        self._Movie_ID.append(row[0])
+        self._Title.append(row[1])
+        self._Release_Year.append(years.setdefault(row[2], row[2]))
+        self._Num_Reviews.append(row[3])
+        self._Avg_Rating.append(row[4])
+
+
+# Every query is registered with the statement cache under a name (see
+# stmtcache.py); queries whose text varies are built once per variant.
+_COUNTS_KEPT = stmtcache.register("counts_kept", """Select count(*) From sqlite_master
+    Where type = 'table' And name = 'Table_Counts'""")
+_NUM_ROWS = stmtcache.register(
+    "num_rows", "Select Num_Rows From Table_Counts Where Table_Name = ?")
+_NUM_MOVIES = stmtcache.register("num_movies", "Select count(*) From Movies")
+_NUM_REVIEWS = stmtcache.register("num_reviews", "Select count(*) From Ratings")
+
+
+# _num_rows:
+#
+# Returns: # of rows of the given table, as kept current in the
+#          Table_Counts table (see aggregates.py), or counted with
+#          the given query if it is not kept (the table has no row
+#          there, or there is no Table_Counts, as in a database the
+#          summary was never installed on); -1 if an error occurred.
+def _num_rows(dbConn, table, count_sql):
+    kept = datatier.select_one_row(dbConn, _COUNTS_KEPT)
+
+    row = None
+    if kept is not None and kept != () and kept[0] > 0:
+        row = datatier.select_one_row(dbConn, _NUM_ROWS, [table])
+
+    # Count the table itself if its # of rows is not kept
+    if row is None or row == ():
+        row = datatier.select_one_row(dbConn, count_sql)
 
     # Perform error checking for data retrieval
     if row is None:
         return -1
 
-    movies = row[0]
-    return movies
+    return row[0]
+
+
+# num_movies:
+#
+# Returns: # of movies in the database; if an error returns -1
+def num_movies(dbConn):
+    return _num_rows(dbConn, "Movies", _NUM_MOVIES)
 
 
 # num_reviews:
 #
 # Returns: # of reviews in the database; if an error returns -1
 def num_reviews(dbConn):
-    sql = "Select count(*) From Ratings;"
-    row = datatier.select_one_row(dbConn, sql)
+    return _num_rows(dbConn, "Ratings", _NUM_REVIEWS)
+
+
+# _movies_sql:
+#
+# Builds (once per variant) the query behind count_movies and
+# get_movies: searching with like or the title index, in ranked
+# or name order, continuing after a given movie, with a limit.
+# Without the index, the title is matched against the given # of
+# like patterns, all of them or, with any_word, any of them.
+#
+# Returns: the registered SQL text.
+@functools.lru_cache(maxsize=None)
+def _movies_sql(count, indexed, ranked, paged, limited, patterns=1, any_word=False):
+    if indexed:
+        source = """From Movies_Title_FTS Inner Join Movies On Movies.Movie_ID =
+        Movies_Title_FTS.rowid Where Movies_Title_FTS Match ?"""
+    elif patterns == 1:
+        source = "From Movies Where Title like ?"
+    else:
+        joiner = " Or " if any_word else " And "
+        source = "From Movies Where (" + joiner.join(["Title like ?"] * patterns) + ")"
+
+    if count:
+        return stmtcache.register("count_movies", "Select count(*) " + source)
+
+    if paged:
+        source += " And (Movies.Title, Movies.Movie_ID) > (?, ?)"
+
+    if ranked:
+        order = "Movies_Title_FTS.rank"
+    else:
+        order = "Movies.Title asc, Movies.Movie_ID asc"
+
+    sql = """Select Movies.Movie_ID, Movies.Title, strftime('%Y', Release_Date)
+    """ + source + " Order By " + order
+
+    if limited:
+        sql += " Limit ?"
+
+    return stmtcache.register("get_movies", sql)
+
+
+# register_all_statements:
+#
+# Builds and registers every variant of the queries the object
+# tier runs (the batched queries for a single id), so tools such
+# as indexadvisor.py can inspect them without running them first.
+def register_all_statements():
+    for indexed in [False, True]:
+        _movies_sql(True, indexed, False, False, False)
+        for ranked in ([False, True] if indexed else [False]):
+            for paged in ([False] if ranked else [False, True]):
+                for limited in [False, True]:
+                    _movies_sql(False, indexed, ranked, paged, limited)
+
+    for facet in ["movies", "ratings", "taglines", "companies", "genres"]:
+        _details_sql(facet, 1)
+    _existing_movies_sql(1)
+
+
+# _movies_query:
+#
+# Turns the pattern into the parameters to search for, given the
+# mode (see get_movies). Without the title index, each word of an
+# index mode is searched for with "like" anywhere in the title:
+# every word for "token" and "prefix", any of them for "ranked".
+#
+# Returns: the list of parameters, whether the title index is
+#          searched, and whether any of the like patterns matches.
+def _movies_query(dbConn, pattern, mode):
+    query = None
+    if mode in titlesearch.MODES and not titlesearch.has_wildcards(pattern):
+        query = titlesearch.build_query(pattern, mode)
+
+    if query is None:
+        return [pattern], False, False
+
+    if not titlesearch.is_installed(dbConn):
+        words = titlesearch.words(pattern)
+        return ["%" + w + "%" for w in words], False, mode == "ranked"
+
+    return [query], True, False
+
+
+# count_movies:
+#
+# counts the movies whose name are "like" the pattern, with the
+# same pattern and mode as get_movies, without retrieving them.
+#
+# Returns: # of matching movies; if an error returns -1
+def count_movies(dbConn, pattern, mode="like"):
+    terms, indexed, any_word = _movies_query(dbConn, pattern, mode)
+    sql = _movies_sql(True, indexed, False, False, False, len(terms), any_word)
+    row = datatier.select_one_row(dbConn, sql, terms)
 
     # Perform error checking for data retrieval
     if row is None:
         return -1
 
-    reviews = row[0]
-    return reviews
+    return row[0]
 
 
 # get_movies:
@@ -165,14 +523,44 @@ def num_reviews(dbConn):
 # the pattern. Patterns are based on SQL, which allow
 # the _ and % wildcards. Pass "%" to get all stations.
 #
+# The mode selects how the pattern is matched: "like" (the
+# default) uses the SQL like operator as described above, while
+# "token", "prefix" and "ranked" search the full-text title index
+# instead (see titlesearch.py, the index is installed with
+# titlesearch.install_index). A pattern that uses the _ or %
+# wildcards is always matched with "like". If the index is not
+# installed, the index modes match each word of the text anywhere
+# in the title with "like" (see _movies_query). Results are in
+# order by name (then id), except for "ranked" on the index where
+# the best matches come first.
+#
+# Pass limit to retrieve at most that many movies, and pass the
+# last Movie of the previous page as after to continue from it;
+# paging this way costs the same for every page. after cannot be
+# used in "ranked" mode.
+#
 # Returns: list of movies in ascending order by name; 
 #          an empty list means the query did not retrieve
-#          any data (or an internal error occurred, in
-#          which case an error msg is already output).
-def get_movies(dbConn, pattern):
-    sql = """Select Movie_ID, Title, strftime('%Y', Release_Date)
-    From Movies Where Title like ? Order By Title asc;"""
-    rows = datatier.select_n_rows(dbConn, sql, [pattern])
+#          any data. None is returned if an internal error
+#          occurred (in which case an error msg is already
+#          output).
+def get_movies(dbConn, pattern, mode="like", limit=None, after=None):
+    terms, indexed, any_word = _movies_query(dbConn, pattern, mode)
+    ranked = indexed and mode == "ranked"
+    parameters = list(terms)
+
+    if after is not None:
+        if ranked:
+            print("get_movies failed: cannot page after a movie in ranked mode")
+            return None
+        parameters += [after.Title, after.Movie_ID]
+
+    if limit is not None:
+        parameters.append(int(limit))
+
+    sql = _movies_sql(False, indexed, ranked, after is not None, limit is not None,
+                      len(terms), any_word)
+    rows = datatier.select_n_rows(dbConn, sql, parameters)
 
     # Perform error checking for data retrieval
     if rows is None:
@@ -186,6 +574,65 @@ def get_movies(dbConn, pattern):
     return movies
 
 
+# iter_movies:
+#
+# Generator version of get_movies: yields the matching movies
+# one at a time, retrieving them from the database a page of
+# page_size movies at a time, so only one page is ever held in
+# memory.
+#
+# Yields: Movie objects in the same order as get_movies; stops
+#         early if an internal error occurs (in which case an
+#         error msg is already output).
+def iter_movies(dbConn, pattern, mode="like", page_size=100):
+    # Ranked results cannot be paged by name, so they come in one page
+    if mode == "ranked":
+        movies = get_movies(dbConn, pattern, mode)
+        if movies is not None:
+            yield from movies
+        return
+
+    after = None
+    while True:
+        movies = get_movies(dbConn, pattern, mode, page_size, after)
+        if movies is None:
+            return
+
+        yield from movies
+
+        if len(movies) < page_size:
+            return
+        after = movies[-1]
+
+
+# get_movies_columnar:
+#
+# Same as get_movies, but returns the movies in a MovieColumns
+# container instead of a list of Movie objects, which takes far
+# less memory for large results such as get_movies_columnar(dbConn,
+# "%").
+#
+# Returns: a MovieColumns container in the same order as get_movies,
+#          or None if an internal error occurred (in which case an
+#          error msg is already output).
+def get_movies_columnar(dbConn, pattern, mode="like"):
+    terms, indexed, any_word = _movies_query(dbConn, pattern, mode)
+    ranked = indexed and mode == "ranked"
+
+    sql = _movies_sql(False, indexed, ranked, False, False, len(terms), any_word)
+    rows = datatier.select_n_rows(dbConn, sql, terms)
+
+    if rows is None:
+        return None
+
+    movies = MovieColumns()
+    years = {}
+    for row in rows:
+        movies._append(row, years)
+
+    return movies
+
+
 # get_movie_details:
 #
 # gets and returns details about the given movie; you pass
@@ -197,88 +644,374 @@ def get_movies(dbConn, pattern):
 #          movie, None is returned; note that None is also 
 #          returned if an internal error occurred (in which
 #          case an error msg is already output).
-def get_movie_details(dbConn, movie_id):
-    sql = """Select Movies.Movie_ID, Title, date(Release_Date),
-    Runtime, Original_Language, Budget, Revenue From Movies
-    Where Movies.Movie_ID = ?"""
-    row = datatier.select_one_row(dbConn, sql, [movie_id])
-
-    # Perform error checking in case the movie id was not found
-    if row == ():
-        return None
+#
+# If a cache is enabled for the connection (see detailcache.py)
+# the details are served from it whenever possible. The engine
+# selects how they are retrieved otherwise: "batch" (the default)
+# runs one query per facet as get_movie_details_many does, "json"
+# retrieves every facet with a single query, and "lazy" only reads
+# the movie's row: each facet of LAZY_FACETS is then read the first
+# time one of its properties is used, and kept. Lazy details read
+# their facets through dbConn, so it must still be open (and, for a
+# plain connection, used from the same thread) when they are; the
+# other engines return details with every facet already loaded.
+def get_movie_details(dbConn, movie_id, engine="batch"):
+    cache = detailcache.get_cache(dbConn)
+    if cache is not None:
+        cache_key = detailcache.key(movie_id)
+        movie = cache.get(cache_key)
+        if movie is not None:
+            # Cached details may have been created lazily
+            if engine != "lazy":
+                movie._load_all()
+            return movie
+
+        # Taken before the details are read, so they are not cached if
+        # a review for the movie is added meanwhile
+        generation = cache.generation(cache_key)
+
+    if engine == "json":
+        movie = _get_movie_details_json(dbConn, movie_id)
+    elif engine == "lazy":
+        movie = _get_movie_details_lazy(dbConn, movie_id)
+    else:
+        movies = get_movie_details_many(dbConn, [movie_id])
+        movie = None if movies is None else movies[0]
 
-    # Store data values retrieved
-    id = row[0]
-    title = row[1]
-    rel_date = row[2]
-    runtime = row[3]
-    lang = row[4]
-    budget = row[5]
-    revenue = row[6]
+    if cache is not None and movie is not None and movie.Movie_ID == cache_key:
+        cache.put(movie.Movie_ID, movie, generation)
+
+    return movie
 
-    # Query to retrieve rating info
-    sql = """Select count(Rating), avg(Rating) From Ratings
-    Where Ratings.Movie_ID = ? Group By Ratings.Movie_ID"""
-    rating = datatier.select_one_row(dbConn, sql, [movie_id])
 
-    # Store rating values or provide default values if rating info does not exist
-    if rating == ():
+# Every facet of a movie's details in one row, with the companies
+# and genres aggregated into JSON arrays by correlated subqueries
+_DETAILS_JSON = stmtcache.register("movie_details.json", """
+    Select Movies.Movie_ID, Title, date(Release_Date), Runtime,
+    Original_Language, Budget, Revenue, Num_Reviews,
+    Sum_Ratings * 1.0 / Num_Reviews,
+    (Select Tagline From Movie_Taglines
+     Where Movie_Taglines.Movie_ID = Movies.Movie_ID),
+    (Select json_group_array(Company_Name) From Movie_Production_Companies
+     Inner Join Companies On Movie_Production_Companies.Company_ID =
+     Companies.Company_ID
+     Where Movie_Production_Companies.Movie_ID = Movies.Movie_ID),
+    (Select json_group_array(Genre_Name) From Movie_Genres
+     Inner Join Genres On Movie_Genres.Genre_ID = Genres.Genre_ID
+     Where Movie_Genres.Movie_ID = Movies.Movie_ID)
+    From Movies Left Join Movie_Rating_Summary On
+    Movie_Rating_Summary.Movie_ID = Movies.Movie_ID And Num_Reviews > 0
+    Where Movies.Movie_ID = ?""")
+
+
+# _decode_names:
+#
+# Returns: the names in the given JSON array in ascending order,
+#          or an empty list if a name is missing (as the names are
+#          listed up to the first missing one, which sorts first).
+def _decode_names(names):
+    names = json.loads(names)
+    if None in names:
+        return []
+    return sorted(names)
+
+
+# _get_movie_details_json:
+#
+# Single-query version of get_movie_details (engine "json").
+#
+# Returns: a MovieDetails obj, or None if no movie was found with
+#          this id or an internal error occurred (in which case an
+#          error msg is already output).
+def _get_movie_details_json(dbConn, movie_id):
+    row = datatier.select_one_row(dbConn, _DETAILS_JSON, [movie_id])
+
+    if row is None or row == ():
+        return None
+
+    num_rev = row[7]
+    avg_rat = row[8]
+    if num_rev is None:
         num_rev = 0
         avg_rat = 0.00
+
+    tagline = row[9]
+    if tagline is None:
+        tagline = ""
+
+    movie = MovieDetails(row[0], row[1], num_rev, avg_rat, row[2], row[3],
+                         row[4], row[5], row[6], tagline)
+
+    companies = _decode_names(row[10])
+    if len(companies) > 0:
+        movie._Production_Companies = companies
+
+    genres = _decode_names(row[11])
+    if len(genres) > 0:
+        movie._Genres = genres
+
+    return movie
+
+
+# The facets of MovieDetails the "lazy" engine loads on first use:
+# ratings (Num_Reviews and Avg_Rating), taglines, companies, genres
+LAZY_FACETS = ["ratings", "taglines", "companies", "genres"]
+
+
+# _get_movie_details_lazy:
+#
+# Lazy version of get_movie_details (engine "lazy"): only the
+# movie's row is read.
+#
+# Returns: a MovieDetails obj with every facet pending, or None if
+#          no movie was found with this id or an internal error
+#          occurred (in which case an error msg is already output).
+def _get_movie_details_lazy(dbConn, movie_id):
+    rows = datatier.select_n_rows(dbConn, _details_sql("movies", 1), [0, movie_id])
+
+    if rows is None or len(rows) == 0:
+        return None
+
+    row = rows[0]
+    movie = MovieDetails(row[1], row[2], 0, 0.00, row[3], row[4],
+                         row[5], row[6], row[7], "")
+    movie._DbConn = dbConn
+    movie._Pending = set(LAZY_FACETS)
+    return movie
+
+
+# _load_facet:
+#
+# Reads one facet of LAZY_FACETS of the given movie into it, as
+# _fill_movie_details does for a whole chunk of movies.
+#
+# Returns: 1 if successful, 0 if an internal error occurred (in
+#          which case an error msg is already output).
+def _load_facet(dbConn, movie, facet):
+    movie_id = movie._Movie_ID
+
+    dims = dimensions.get(dbConn)
+    if dims is not None and facet in ("companies", "genres"):
+        names = dims.companies(movie_id) if facet == "companies" else dims.genres(movie_id)
     else:
-        num_rev = rating[0]
-        avg_rat = rating[1]
+        rows = datatier.select_n_rows(dbConn, _details_sql(facet, 1), [movie_id])
+        if rows is None:
+            return 0
 
-    # Query to retrieve tagline info
-    sql = """Select Tagline From Movie_Taglines Where
-    Movie_Taglines.Movie_ID = ?"""
-    tag = datatier.select_one_row(dbConn, sql, [movie_id])
+        if facet == "ratings":
+            if len(rows) > 0:
+                movie._Num_Reviews = rows[0][1]
+                movie._Avg_Rating = rows[0][2]
+            return 1
+        if facet == "taglines":
+            if len(rows) > 0:
+                movie._Tagline = rows[0][1]
+            return 1
+
+        # The names, stopping at a missing one
+        names = []
+        for row in rows:
+            if row[1] is None:
+                break
+            names.append(row[1])
+
+    # Assign whole lists, so a facet loaded twice at once is not doubled
+    if len(names) > 0:
+        if facet == "companies":
+            movie._Production_Companies = names
+        else:
+            movie._Genres = names
 
-    # Store tagline or provide default value if tagline info does not exist
-    if tag == ():
-        tagline = ""
+    return 1
+
+
+# Most ids bound into one query. The movies facet binds two parameters
+# per id, so a chunk stays within the limit of 999 variables of SQLite
+# before 3.32
+_MAX_IDS = 256
+
+
+# get_movie_details_many:
+#
+# gets and returns details about each of the given movies; you
+# pass a list of movie ids, function returns a list of MovieDetails
+# objects in the same order. Each facet of the details (movie row,
+# rating summary, tagline, companies and genres) is fetched for a
+# whole batch of ids with one query, so the number of queries does
+# not grow with the number of ids. The genres and companies are
+# taken from memory instead if they are loaded for the connection
+# (see dimensions.py).
+#
+# Returns: a list with one entry per given id: the MovieDetails
+#          obj, or None if no movie was found with that id. None
+#          is returned instead of a list if an internal error
+#          occurred (in which case an error msg is already output).
+def get_movie_details_many(dbConn, ids):
+    ids = list(ids)
+    result = [None] * len(ids)
+
+    for first in range(0, len(ids), _MAX_IDS):
+        chunk = ids[first:first + _MAX_IDS]
+        if _fill_movie_details(dbConn, chunk, first, result) == 0:
+            return None
+
+    return result
+
+
+# _details_sql:
+#
+# Builds (once per facet and size) the query for one facet of the
+# movie details of size ids. Batches of ids are padded up to a
+# power of two, so only a few variants of each query are needed.
+#
+# Returns: the registered SQL text.
+@functools.lru_cache(maxsize=None)
+def _details_sql(facet, size):
+    marks = ", ".join(["?"] * size)
+
+    if facet == "movies":
+        # Match the ids through a values list so each one keeps its position
+        wanted = ", ".join(["(?, ?)"] * size)
+        sql = """With Wanted(Pos, Movie_ID) As (Values """ + wanted + """)
+        Select Wanted.Pos, Movies.Movie_ID, Title, date(Release_Date),
+        Runtime, Original_Language, Budget, Revenue From Wanted Inner Join
+        Movies On Movies.Movie_ID = Wanted.Movie_ID"""
+    elif facet == "ratings":
+        # Query to retrieve rating info from the materialized summary
+        sql = """Select Movie_ID, Num_Reviews, Sum_Ratings * 1.0 / Num_Reviews
+        From Movie_Rating_Summary Where Movie_ID In (""" + marks + """)
+        And Num_Reviews > 0"""
+    elif facet == "taglines":
+        sql = """Select Movie_ID, Tagline From Movie_Taglines Where
+        Movie_ID In (""" + marks + ")"
+    elif facet == "companies":
+        sql = """Select Movie_Production_Companies.Movie_ID,
+        Company_Name From Movie_Production_Companies Inner Join
+        Companies On Movie_Production_Companies.Company_ID =
+        Companies.Company_ID Where
+        Movie_Production_Companies.Movie_ID In (""" + marks + """) Order By
+        Movie_Production_Companies.Movie_ID, Company_Name Asc"""
     else:
-        tagline = tag[0]
-
-    # Create a new MovieDetails object using stored values
-    movie = MovieDetails(id, title, num_rev, avg_rat,
-                         rel_date, runtime, lang, budget, revenue, tagline)
-
-    # Query to retrieve list of production companies for movie
-    sql = """Select Movie_Production_Companies.Movie_ID,
-    Company_Name From Movie_Production_Companies Inner Join
-    Companies On Movie_Production_Companies.Company_ID =
-    Companies.Company_ID Where
-    Movie_Production_Companies.Movie_ID = ? Order By
-    Company_Name Asc"""
-    rows = datatier.select_n_rows(dbConn, sql, [movie_id])
-
-    # Add list of companies to MovieDetails, default value provided if no companies
+        sql = """Select Movie_Genres.Movie_ID, Genre_Name From
+        Movie_Genres Inner Join Genres on Movie_Genres.Genre_ID
+        = Genres.Genre_ID Where Movie_Genres.Movie_ID In (""" + marks + """)
+        Order By Movie_Genres.Movie_ID, Genre_Name Asc"""
+
+    return stmtcache.register("movie_details." + facet, sql)
+
+
+# _padded_size:
+#
+# Returns: the smallest power of two that is at least n.
+def _padded_size(n):
+    size = 1
+    while size < n:
+        size *= 2
+    return size
+
+
+# _fill_movie_details:
+#
+# Looks up the details of one chunk of ids and stores them into
+# result, starting at position first. Returns 1 on success and
+# 0 if an internal error occurred.
+def _fill_movie_details(dbConn, chunk, first, result):
+    size = _padded_size(len(chunk))
+    parameters = []
+    for pos, movie_id in enumerate(chunk):
+        parameters += [first + pos, movie_id]
+
+    # Padding rows match no movie
+    parameters += [-1, None] * (size - len(chunk))
+
+    rows = datatier.select_n_rows(dbConn, _details_sql("movies", size), parameters)
+
+    if rows is None:
+        return 0
+
+    # Create one MovieDetails per movie found, with default rating and tagline
+    movies = {}
     for row in rows:
-        name = row[1]
-        if name is None:
-            name = ""
-            break
+        movie = movies.get(row[1])
+        if movie is None:
+            movie = MovieDetails(row[1], row[2], 0, 0.00, row[3], row[4],
+                                 row[5], row[6], row[7], "")
+            movies[row[1]] = movie
+        result[row[0]] = movie
 
-        movie._Production_Companies.append(name)
+    if len(movies) == 0:
+        return 1
 
-    # Query to retrieve list of genres for movie
-    sql = """Select Movie_Genres.Movie_ID, Genre_Name From
-    Movie_Genres Inner Join Genres on Movie_Genres.Genre_ID
-    = Genres.Genre_ID Where Movie_Genres.Movie_ID = ?
-    Order By Genre_Name Asc"""
+    size = _padded_size(len(movies))
+    found = list(movies) + [None] * (size - len(movies))
 
-    # Add list of genres to MovieDetails, default value provided if no genres
-    g_rows = datatier.select_n_rows(dbConn, sql, [movie_id])
-    for g in g_rows:
-        genre = g[1]
-        if genre is None:
-            genre = ""
-            break
+    # Query to retrieve rating info
+    rows = datatier.select_n_rows(dbConn, _details_sql("ratings", size), found)
 
-        movie._Genres.append(genre)
+    if rows is None:
+        return 0
 
-    return movie
+    for row in rows:
+        movie = movies[row[0]]
+        movie._Num_Reviews = row[1]
+        movie._Avg_Rating = row[2]
+
+    # Query to retrieve tagline info
+    rows = datatier.select_n_rows(dbConn, _details_sql("taglines", size), found)
+
+    if rows is None:
+        return 0
+
+    for row in rows:
+        movies[row[0]]._Tagline = row[1]
+
+    # With the genre and company tables in memory, no joins are needed
+    dims = dimensions.get(dbConn)
+    if dims is not None:
+        for movie_id, movie in movies.items():
+            companies = dims.companies(movie_id)
+            if len(companies) > 0:
+                movie._Production_Companies = companies
+            genres = dims.genres(movie_id)
+            if len(genres) > 0:
+                movie._Genres = genres
+        return 1
+
+    # Query to retrieve list of production companies for each movie
+    rows = datatier.select_n_rows(dbConn, _details_sql("companies", size), found)
+
+    if rows is None:
+        return 0
+
+    # Add list of companies to MovieDetails, stopping at a missing name
+    stopped = set()
+    for row in rows:
+        if row[0] in stopped:
+            continue
+        if row[1] is None:
+            stopped.add(row[0])
+            continue
+
+        movies[row[0]]._add_company(row[1])
+
+    # Query to retrieve list of genres for each movie
+    rows = datatier.select_n_rows(dbConn, _details_sql("genres", size), found)
+
+    if rows is None:
+        return 0
+
+    # Add list of genres to MovieDetails, stopping at a missing name
+    stopped = set()
+    for row in rows:
+        if row[0] in stopped:
+            continue
+        if row[1] is None:
+            stopped.add(row[0])
+            continue
+
+        movies[row[0]]._add_genre(row[1])
+
+    return 1
 
 
 # get_top_N_movies:
@@ -286,65 +1019,409 @@ def get_movie_details(dbConn, movie_id):
 # gets and returns the top N movies based on their average 
 # rating, where each movie has at least the specified # of
 # reviews. Example: pass (10, 100) to get the top 10 movies
-# with at least 100 reviews.
+# with at least 100 reviews. The movies are read from the
+# precomputed leaderboard (see leaderboard.py), so no sort
+# over all movies is needed. Pass "weighted" as the ranking to
+# order the movies by their weighted rating instead, which pulls
+# the average of movies with few reviews towards the mean of all
+# ratings (the minimum # of reviews still applies).
 #
 # Returns: returns a list of 0 or more MovieRating objects;
 #          the list could be empty if the min # of reviews
-#          is too high. An empty list is also returned if
-#          an internal error occurs (in which case an error 
-#          msg is already output).
-def get_top_N_movies(dbConn, N, min_num_reviews):
-    sql = """Select Movies.Movie_ID, Title, strftime('%Y', Release_Date),
-    avg(Rating), count(Rating) From Movies Inner Join Ratings On
-    Movies.Movie_ID = Ratings.Movie_ID Group By Ratings.Movie_ID Having
-    count(Rating) >= ? Order By avg(Rating) desc Limit ?"""
-    rows = datatier.select_n_rows(dbConn, sql, [int(min_num_reviews), int(N)])
+#          is too high. None is returned if an internal error
+#          occurs (in which case an error msg is already
+#          output).
+def get_top_N_movies(dbConn, N, min_num_reviews, ranking="raw"):
+    board = leaderboard.get_leaderboard(dbConn)
 
     # Error checking if no data is retrieved
-    if rows is None:
+    if board is None:
         return None
 
-    # Check for excessive amount of reviews
-    movies = []
-    if int(N) >= 1000:
-        return movies
+    return list(_iter_top(board, N, min_num_reviews, ranking))
+
+
+# iter_top_N_movies:
+#
+# Generator version of get_top_N_movies: yields the top N movies
+# one at a time, so any N can be streamed back without building
+# a list. Pass None as N to stream every movie with at least the
+# specified # of reviews, highest average rating first.
+#
+# Yields: MovieRating objects; nothing is yielded if an internal
+#         error occurs (in which case an error msg is already
+#         output).
+def iter_top_N_movies(dbConn, N, min_num_reviews, ranking="raw"):
+    board = leaderboard.get_leaderboard(dbConn)
+    if board is None:
+        return
+
+    yield from _iter_top(board, N, min_num_reviews, ranking)
 
-    # Create new MovieRating object and add it to list of movies
-    for row in rows:
-        movies.append(MovieRating(row[0], row[1], row[2], row[4], row[3]))
+
+# _iter_top:
+#
+# Generator over the top N movies of the given leaderboard, as
+# iter_top_N_movies.
+def _iter_top(board, N, min_num_reviews, ranking):
+    if N is not None:
+        N = int(N)
+
+    for row in board.top(N, int(min_num_reviews), ranking):
+        yield MovieRating(row[0], row[1], row[2], row[3], row[4])
+
+
+# get_top_N_movies_columnar:
+#
+# Same as get_top_N_movies, but returns the movies in a
+# MovieRatingColumns container instead of a list of MovieRating
+# objects, which takes far less memory for a large N.
+#
+# Returns: a MovieRatingColumns container in the same order as
+#          get_top_N_movies, or None if an internal error occurred
+#          (in which case an error msg is already output).
+def get_top_N_movies_columnar(dbConn, N, min_num_reviews, ranking="raw"):
+    board = leaderboard.get_leaderboard(dbConn)
+    if board is None:
+        return None
+
+    if N is not None:
+        N = int(N)
+
+    movies = MovieRatingColumns()
+    years = {}
+    for row in board.top(N, int(min_num_reviews), ranking):
+        movies._append(row, years)
 
     return movies
 
 
+# get_rating_stats:
+#
+# gets and returns the distribution and statistics of the ratings
+# of the given movie (see analytics.py). They are computed for all
+# movies at once the first time and kept current as reviews are
+# added, so no ratings are read per call.
+#
+# Returns: a RatingStats obj, or None if no movie was found with
+#          this id. None is also returned if an internal error
+#          occurred or NumPy is not installed (in which case an
+#          error msg is already output).
+def get_rating_stats(dbConn, movie_id):
+    stats = analytics.get_analytics(dbConn)
+    if stats is None:
+        return None
+
+    row = datatier.select_one_row(dbConn, _MOVIE_EXISTS, [movie_id])
+    if row is None or row == ():
+        return None
+
+    movie = stats.stats(row[0])
+    if movie is None:
+        return RatingStats(row[0], 0, None, None, None, None, None,
+                           stats.Global_Mean, [0] * stats.Histograms.shape[1])
+
+    return RatingStats(row[0], movie["Num_Reviews"], movie["Avg_Rating"],
+                       movie["Std_Dev"], movie["P25"], movie["Median"],
+                       movie["P75"], movie["Bayesian_Avg"], stats.histogram(row[0]))
+
+
+# get_all_rating_stats:
+#
+# gets and returns the distribution and statistics of the ratings
+# of every movie with at least the given # of reviews, as
+# get_rating_stats does.
+#
+# Returns: a list of RatingStats objs in order by movie id; None
+#          is returned if an internal error occurred or NumPy is
+#          not installed (in which case an error msg is already
+#          output).
+def get_all_rating_stats(dbConn, min_num_reviews=1):
+    stats = analytics.get_analytics(dbConn)
+    if stats is None:
+        return None
+
+    bayesian = stats.bayesian_averages().tolist()
+    movies = []
+    for i, (movie_id, row, histogram) in enumerate(zip(
+            stats.Movie_IDs.tolist(), stats.Stats.tolist(), stats.Histograms.tolist())):
+        if row[0] < min_num_reviews:
+            continue
+        movies.append(RatingStats(movie_id, int(row[0]), row[1], row[2], row[3],
+                                  row[4], row[5], bayesian[i], histogram))
+
+    return movies
+
+
+_MOVIE_EXISTS = stmtcache.register(
+    "movie_exists", "Select Movies.Movie_ID From Movies Where Movies.Movie_ID = ?")
+_INSERT_RATING = stmtcache.register(
+    "insert_rating", "Insert Into Ratings(Movie_ID, Rating) Values (?, ?)")
+
+# Inserts or replaces a tagline, only if its movie exists (the Where
+# clause also keeps On Conflict from being read as a join constraint)
+_UPSERT_TAGLINE = stmtcache.register("upsert_tagline", """
+    Insert Into Movie_Taglines(Movie_ID, Tagline)
+    Select Movies.Movie_ID, ? From Movies Where Movies.Movie_ID = ?
+    On Conflict(Movie_ID) Do Update Set Tagline = excluded.Tagline""")
+
+
 # add_review:
 #
 # Inserts the given review --- a rating value 0..10 --- into
 # the database for the given movie. It is considered an error
-# if the movie does not exist (see below), and the review is
-# not inserted.
+# if the movie does not exist or the rating is not a whole
+# number 0..10 (see below), and the review is not inserted.
 #
 # Returns: 1 if the review was successfully added, returns
 #          0 if not (e.g. if the movie does not exist, or if
 #          an internal error occurred).
 def add_review(dbConn, movie_id, rating):
-    sql = "Select Movies.Movie_ID from Movies Where Movies.Movie_ID = ?"
-    row = datatier.select_one_row(dbConn, sql, [movie_id])
+    rating = _parse_rating(rating)
+    if rating is None:
+        return 0
+
+    row = datatier.select_one_row(dbConn, _MOVIE_EXISTS, [movie_id])
 
     # Check if the movie id does not exist
-    if row == ():
+    if row == () or row is None:
         return 0
 
-    # Query to modify database and insert a new rating for the movie
-    sql = "Insert Into Ratings(Movie_ID, Rating) Values (?, ?)"
-    action = datatier.perform_action(dbConn, sql, [movie_id, rating])
+    with leaderboard.writing(dbConn):
+        # Query to modify database and insert a new rating for the movie
+        action = datatier.perform_action(dbConn, _INSERT_RATING, [movie_id, rating])
 
-    # Check if the insertion was not successful
-    if action == -1:
-        return 0
+        # Check if the insertion was not successful
+        if action == -1:
+            return 0
+
+        # The summary table is kept current by triggers, the leaderboard is patched here
+        leaderboard.record_review(dbConn, row[0], rating)
+        analytics.record_review(dbConn, row[0], rating)
+        detailcache.invalidate(dbConn, row[0])
 
     return 1
 
 
+# add_reviews_many:
+#
+# Inserts a group of reviews, each as add_review would, in a single
+# transaction, so they share one commit; meant for small groups of
+# reviews arriving together (see writebehind.py). reviews is a list
+# of (movie id, rating) pairs. Unlike add_reviews_bulk, the
+# leaderboard and analytics are patched review by review rather
+# than rebuilt.
+#
+# Returns: a list with one entry per review, in order: 1 if it was
+#          inserted, 0 if not (its rating is not a whole number
+#          0..10, its movie does not exist, or an internal error
+#          occurred, in which case an error msg is already output).
+def add_reviews_many(dbConn, reviews):
+    outcomes = [0] * len(reviews)
+    parsed = [_parse_review(movie_id, rating) for movie_id, rating in reviews]
+
+    existing = _existing_movies(dbConn, {review[0] for review in parsed if review is not None})
+    if existing is None:
+        return outcomes
+
+    rows = [review for review in parsed if review is not None and review[0] in existing]
+    if len(rows) == 0:
+        return outcomes
+
+    with leaderboard.writing(dbConn):
+        if datatier.perform_many(dbConn, _INSERT_RATING, rows) == -1:
+            return outcomes
+
+        for pos, review in enumerate(parsed):
+            if review is None or review[0] not in existing:
+                continue
+            outcomes[pos] = 1
+            leaderboard.record_review(dbConn, review[0], review[1])
+            analytics.record_review(dbConn, review[0], review[1])
+            detailcache.invalidate(dbConn, review[0])
+
+    return outcomes
+
+
+# Reviews inserted per transaction by add_reviews_bulk
+_BULK_CHUNK = 1000
+
+
+# _existing_movies_sql:
+#
+# Returns: the registered query finding which of size movie ids
+#          exist, built once per size.
+@functools.lru_cache(maxsize=None)
+def _existing_movies_sql(size):
+    marks = ", ".join(["?"] * size)
+    return stmtcache.register("existing_movies", """Select Movie_ID From Movies
+    Where Movie_ID In (""" + marks + ")")
+
+
+# _existing_movies:
+#
+# Returns: the set of the given movie ids that exist, looked up a
+#          batch of ids per query; None if an internal error
+#          occurred (in which case an error msg is already output).
+def _existing_movies(dbConn, ids):
+    ids = list(ids)
+    existing = set()
+    for first in range(0, len(ids), _MAX_IDS):
+        batch = ids[first:first + _MAX_IDS]
+        size = _padded_size(len(batch))
+        rows = datatier.select_n_rows(dbConn, _existing_movies_sql(size),
+                                      batch + [None] * (size - len(batch)))
+        if rows is None:
+            return None
+        existing.update(row[0] for row in rows)
+
+    return existing
+
+
+# _read_pairs:
+#
+# Generator over the (movie id, value) pairs stored in the given
+# file: a .jsonl file holds one pair per line, either as an object
+# with "movie_id" and the given key or as a [movie_id, value]
+# array; any other file is read as CSV with the movie id and value
+# in the first two columns, optionally under a header.
+def _read_pairs(path, key):
+    with open(path, newline="") as file:
+        if path.endswith(".jsonl"):
+            for line in file:
+                if line.strip() == "":
+                    continue
+                try:
+                    review = json.loads(line)
+                except ValueError:
+                    yield (None, None)
+                    continue
+                if isinstance(review, dict):
+                    yield (review.get("movie_id"), review.get(key))
+                elif isinstance(review, list) and len(review) == 2:
+                    yield (review[0], review[1])
+                else:
+                    yield (None, None)
+        else:
+            for number, row in enumerate(csv.reader(file)):
+                if len(row) == 0:
+                    continue
+                # Skip a header line
+                if number == 0 and not row[0].strip().isdigit():
+                    continue
+                yield (row[0], row[1]) if len(row) >= 2 else (None, None)
+
+
+# _parse_rating:
+#
+# Returns: the rating as an integer, or None if it is not a whole
+#          number 0..10.
+def _parse_rating(rating):
+    try:
+        value = float(rating)
+    except (TypeError, ValueError):
+        return None
+
+    if not value.is_integer() or value < 0 or value > 10:
+        return None
+
+    return int(value)
+
+
+# _parse_review:
+#
+# Returns: the (movie id, rating) pair as integers, or None if the
+#          movie id is not an integer or the rating is not a whole
+#          number 0..10.
+def _parse_review(movie_id, rating):
+    try:
+        movie_id = int(movie_id)
+    except (TypeError, ValueError):
+        return None
+
+    rating = _parse_rating(rating)
+    if rating is None:
+        return None
+
+    return (movie_id, rating)
+
+
+# add_reviews_bulk:
+#
+# Inserts many reviews at once. reviews is either an iterable of
+# (movie id, rating) pairs or the name of a CSV or JSONL file
+# holding them (see _read_pairs, the value is the "rating"). The
+# reviews are processed in
+# chunks: the movies of a whole chunk are looked up with one query
+# and its valid reviews are inserted in one transaction. A review
+# is rejected if its rating is not a whole number 0..10 or its
+# movie does not exist; the rating aggregates are kept current by
+# the same triggers as for add_review.
+#
+# Returns: a tuple (# of reviews inserted, # rejected); reviews in
+#          a chunk that could not be inserted because of an internal
+#          error count as rejected (and an error msg is output).
+def add_reviews_bulk(dbConn, reviews, chunk_size=_BULK_CHUNK):
+    if isinstance(reviews, str):
+        reviews = _read_pairs(reviews, "rating")
+
+    accepted = 0
+    rejected = 0
+    chunk = []
+
+    with leaderboard.writing(dbConn):
+        for movie_id, rating in reviews:
+            review = _parse_review(movie_id, rating)
+            if review is None:
+                rejected += 1
+                continue
+
+            chunk.append(review)
+            if len(chunk) == chunk_size:
+                inserted = _insert_reviews(dbConn, chunk)
+                accepted += inserted
+                rejected += len(chunk) - inserted
+                chunk = []
+
+        inserted = _insert_reviews(dbConn, chunk)
+        accepted += inserted
+        rejected += len(chunk) - inserted
+
+        # The leaderboard is rebuilt from the summary rather than patched review by review
+        if accepted > 0:
+            leaderboard.invalidate(dbConn)
+            analytics.invalidate(dbConn)
+
+    return (accepted, rejected)
+
+
+# _insert_reviews:
+#
+# Inserts the given (movie id, rating) pairs whose movie exists
+# in one transaction.
+#
+# Returns: # of reviews inserted.
+def _insert_reviews(dbConn, chunk):
+    if len(chunk) == 0:
+        return 0
+
+    existing = _existing_movies(dbConn, {movie_id for movie_id, _ in chunk})
+    if existing is None:
+        return 0
+
+    rows = [review for review in chunk if review[0] in existing]
+    if len(rows) == 0:
+        return 0
+
+    if datatier.perform_many(dbConn, _INSERT_RATING, rows) == -1:
+        return 0
+
+    for movie_id in existing:
+        detailcache.invalidate(dbConn, movie_id)
+
+    return len(rows)
+
+
 # set_tagline:
 #
 # Sets the tagline --- summary --- for the given movie. If
@@ -358,33 +1435,94 @@ def add_review(dbConn, movie_id, rating):
 #          0 if not (e.g. if the movie does not exist, or if
 #          an internal error occurred).
 def set_tagline(dbConn, movie_id, tagline):
-    sql = "Select Movies.Movie_ID From Movies Where Movies.Movie_ID = ?"
-    row = datatier.select_one_row(dbConn, sql, [movie_id])
+    # One statement checks the movie exists and inserts or updates
+    action = datatier.perform_action(dbConn, _UPSERT_TAGLINE, [tagline, movie_id])
 
-    # Check if the movie does not exist
-    if row == ():
+    # Check if the movie does not exist or the upsert was not successful
+    if action < 1:
         return 0
 
-    # Query that retrieves tagline
-    sql = "Select Tagline From Movie_Taglines Where Movie_Taglines.Movie_ID = ?"
-    tag = datatier.select_one_row(dbConn, sql, [movie_id])
+    detailcache.invalidate(dbConn, movie_id)
 
-    # Check if the tagline is empty
-    if tag == ():
-        sql = "Insert Into Movie_Taglines(Movie_ID, Tagline) Values(?, ?)"
-        action = datatier.perform_action(dbConn, sql, [movie_id, tagline])
+    return 1
 
-        # Check if insertion was not successful
-        if action == -1:
-            return 0
-    else:
-        # If tagline already exists, update to new tagline
-        sql = """Update Movie_Taglines Set Tagline = ? Where Movie_Taglines.Movie_ID
-        = ?"""
-        action = datatier.perform_action(dbConn, sql, [tagline, movie_id])
 
-        # Check if update was not successful
-        if action == -1:
-            return 0
+# _parse_tagline:
+#
+# Returns: the (movie id, tagline) pair with the movie id as an
+#          integer, or None if the movie id is not an integer or
+#          the tagline is not a string.
+def _parse_tagline(movie_id, tagline):
+    try:
+        movie_id = int(movie_id)
+    except (TypeError, ValueError):
+        return None
 
-    return 1
+    if not isinstance(tagline, str):
+        return None
+
+    return (movie_id, tagline)
+
+
+# set_taglines_bulk:
+#
+# Sets many taglines at once, as set_tagline does for one. taglines
+# is either an iterable of (movie id, tagline) pairs or the name of
+# a CSV or JSONL file holding them (see _read_pairs, the value is
+# the "tagline"). The taglines are processed in chunks: the movies
+# of a whole chunk are looked up with one query and its taglines
+# are set in one transaction. If a movie is given several taglines
+# the last one is kept.
+#
+# Returns: a list with one entry per given tagline, in order: 1 if
+#          it was set, 0 if not (the movie id is not an integer or
+#          the movie does not exist, the tagline is not a string, or
+#          an internal error occurred for its chunk, in which case
+#          an error msg is already output).
+def set_taglines_bulk(dbConn, taglines, chunk_size=_BULK_CHUNK):
+    if isinstance(taglines, str):
+        taglines = _read_pairs(taglines, "tagline")
+
+    outcomes = []
+    chunk = []
+
+    for movie_id, tagline in taglines:
+        pair = _parse_tagline(movie_id, tagline)
+        outcomes.append(0)
+        if pair is None:
+            continue
+
+        chunk.append((len(outcomes) - 1, pair))
+        if len(chunk) == chunk_size:
+            _upsert_taglines(dbConn, chunk, outcomes)
+            chunk = []
+
+    _upsert_taglines(dbConn, chunk, outcomes)
+
+    return outcomes
+
+
+# _upsert_taglines:
+#
+# Sets the taglines of the given (position, (movie id, tagline))
+# entries whose movie exists in one transaction, and records 1 at
+# their position in outcomes once done.
+def _upsert_taglines(dbConn, chunk, outcomes):
+    if len(chunk) == 0:
+        return
+
+    existing = _existing_movies(dbConn, {pair[0] for _, pair in chunk})
+    if existing is None:
+        return
+
+    chunk = [(pos, pair) for pos, pair in chunk if pair[0] in existing]
+    if len(chunk) == 0:
+        return
+
+    rows = [(tagline, movie_id) for _, (movie_id, tagline) in chunk]
+    if datatier.perform_many(dbConn, _UPSERT_TAGLINE, rows) == -1:
+        return
+
+    for pos, (movie_id, _) in chunk:
+        outcomes[pos] = 1
+        detailcache.invalidate(dbConn, movie_id)
@@ -0,0 +1,123 @@
+#
+# File: objecttier_async.py
+#
+# Coroutine versions of the object tier functions, for asyncio programs.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# Every objecttier function blocks while SQLite runs its queries, which would
+# stall an event loop. An AsyncObjectTier runs them on worker threads
+# instead, against a ConnectionPool (see connpool.py) with one read
+# connection per worker, which switches the database to WAL mode so reads
+# are not held up by writes. Lookups awaited together with asyncio.gather
+# really do run at the same time. Writes go to a separate single worker, so
+# they run one at a time, in the order they were awaited, and never tie up
+# the readers while waiting for the write connection.
+#
+# The coroutines take the same arguments and return the same values as the
+# objecttier functions of the same name, minus the connection. Rating counts
+# and averages come from the Movie_Rating_Summary table, which must be
+# installed first (see aggregates.install_summary). Use it as:
+#
+#   async with objecttier_async.AsyncObjectTier("MovieLens.db") as movies:
+#       details = await asyncio.gather(*(movies.get_movie_details(id) for id in ids))
+#
+import asyncio
+import functools
+import concurrent.futures
+import connpool
+import objecttier
+import detailcache
+
+
+class AsyncObjectTier:
+    def __init__(self, path, workers=4, timeout=5.0, cache_size=None):
+        self._Pool = connpool.ConnectionPool(path, size=workers, timeout=timeout, wal=True)
+        self._Readers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="objecttier-read")
+        self._Writers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="objecttier-write")
+
+        if cache_size is not None:
+            detailcache.enable(self._Pool, cache_size)
+
+    @property
+    def Pool(self):
+        return self._Pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    # _read:
+    #
+    # Calls the given objecttier function with the pool, keeping one
+    # read connection checked out for all of its queries.
+    def _read(self, function, *args):
+        with self._Pool.reader():
+            return function(self._Pool, *args)
+
+    # _run:
+    #
+    # Runs the given objecttier function with the pool and the given
+    # arguments on a reader thread, or on the writer thread if it
+    # modifies the database.
+    #
+    # Returns: the function's return value, once it is done.
+    async def _run(self, executor, function, *args):
+        loop = asyncio.get_running_loop()
+        if executor is self._Readers:
+            call = functools.partial(self._read, function, *args)
+        else:
+            call = functools.partial(function, self._Pool, *args)
+        return await loop.run_in_executor(executor, call)
+
+    async def num_movies(self):
+        return await self._run(self._Readers, objecttier.num_movies)
+
+    async def num_reviews(self):
+        return await self._run(self._Readers, objecttier.num_reviews)
+
+    async def count_movies(self, pattern, mode="like"):
+        return await self._run(self._Readers, objecttier.count_movies, pattern, mode)
+
+    async def get_movies(self, pattern, mode="like", limit=None, after=None):
+        return await self._run(self._Readers, objecttier.get_movies, pattern, mode, limit, after)
+
+    # Lazy details would read their facets on the event loop's thread
+    # the first time they are used, so they are read in full instead
+    async def get_movie_details(self, movie_id, engine="batch"):
+        if engine == "lazy":
+            engine = "batch"
+        return await self._run(self._Readers, objecttier.get_movie_details, movie_id, engine)
+
+    async def get_movie_details_many(self, ids):
+        return await self._run(self._Readers, objecttier.get_movie_details_many, ids)
+
+    async def get_top_N_movies(self, N, min_num_reviews, ranking="raw"):
+        return await self._run(self._Readers, objecttier.get_top_N_movies, N, min_num_reviews,
+                               ranking)
+
+    async def add_review(self, movie_id, rating):
+        return await self._run(self._Writers, objecttier.add_review, movie_id, rating)
+
+    async def add_reviews_bulk(self, reviews, chunk_size=1000):
+        return await self._run(self._Writers, objecttier.add_reviews_bulk, reviews, chunk_size)
+
+    async def set_tagline(self, movie_id, tagline):
+        return await self._run(self._Writers, objecttier.set_tagline, movie_id, tagline)
+
+    async def set_taglines_bulk(self, taglines, chunk_size=1000):
+        return await self._run(self._Writers, objecttier.set_taglines_bulk, taglines, chunk_size)
+
+    # close:
+    #
+    # Waits for the calls already started to finish, then closes
+    # every connection of the pool, which drops its caches.
+    def close(self):
+        self._Writers.shutdown(wait=True)
+        self._Readers.shutdown(wait=True)
+        self._Pool.close()
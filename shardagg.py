@@ -0,0 +1,239 @@
+#
+# File: shardagg.py
+#
+# Rating aggregations split across a pool of worker processes.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# Counting and averaging every rating in one query runs on a single core, no
+# matter how many the machine has. A ShardedAggregator splits the Movie_ID
+# range into one shard per worker process, each worker with its own read-only
+# connection (see snapshot.py), and runs the aggregation on every shard at
+# once:
+#
+#   top_N        each worker counts and sums the ratings of every movie in
+#                its shard and keeps its own top N; as no movie is in two
+#                shards, merging the workers' sorted lists with a heap gives
+#                the global top N
+#   num_reviews  each worker counts the ratings in its shard, and the counts
+#                are added up
+#
+# The results are the same as objecttier.get_top_N_movies (with the "raw"
+# ranking) and objecttier.num_reviews, down to the order of movies with the
+# same average, but are computed from the Ratings table itself rather than
+# from the summary tables, for when these are missing or not trusted. Each
+# worker only reads its own range of Ratings if the table has an index on
+# Movie_ID (see indexadvisor.py); without one every worker scans the whole
+# table.
+#
+# The shards hold about the same # of movies each. The first and last shard
+# are open-ended, so movies added after the aggregator was started are still
+# counted. Use it as:
+#
+#   with shardagg.ShardedAggregator("MovieLens.db", workers=4) as engine:
+#       movies = engine.top_N(10, 100)
+#
+import heapq
+import itertools
+import concurrent.futures
+import datatier
+import objecttier
+import snapshot
+
+
+# The read-only connection of a worker process, opened by _open_worker
+_worker_conn = None
+
+
+# _open_worker:
+#
+# Opens the read-only connection of the current worker process.
+def _open_worker(path):
+    global _worker_conn
+    _worker_conn = snapshot.connect(path, "ro")
+
+
+# _range_sql:
+#
+# Returns: a condition selecting the rows of the given column in
+#          [low, high), where None means no bound, and its parameters.
+#          The first shard also takes the rows with no movie id.
+def _range_sql(column, low, high):
+    if low is None and high is None:
+        return "1", []
+    if low is None:
+        return "(" + column + " < ? Or " + column + " Is Null)", [high]
+    if high is None:
+        return column + " >= ?", [low]
+    return column + " >= ? And " + column + " < ?", [low, high]
+
+
+# _shard_top:
+#
+# Runs in a worker. Aggregates the ratings of the movies in the
+# shard [low, high) with at least min_num_reviews reviews.
+#
+# Returns: the shard's top N movies (all of them if N is None) as
+#          (-avg rating, movie id, title, year, # of reviews, avg
+#          rating) tuples in ascending order, so highest average
+#          first and ties by ascending movie id; None if an internal
+#          error occurred (an error msg is already output).
+def _shard_top(low, high, N, min_num_reviews):
+    if _worker_conn is None:
+        return None
+
+    condition, parameters = _range_sql("Movies.Movie_ID", low, high)
+    sql = """Select Movies.Movie_ID, Title, strftime('%Y', Release_Date),
+    count(Rating), sum(Rating) From Movies Inner Join Ratings On
+    Movies.Movie_ID = Ratings.Movie_ID Where """ + condition + """
+    Group By Movies.Movie_ID Having count(Rating) >= ?"""
+    rows = datatier.select_n_rows(_worker_conn, sql, parameters + [min_num_reviews])
+
+    if rows is None:
+        return None
+
+    keyed = ((-(row[4] / row[3]), row[0], row[1], row[2], row[3], row[4] / row[3])
+             for row in rows)
+    if N is None:
+        return sorted(keyed)
+    return heapq.nsmallest(N, keyed)
+
+
+# _shard_count:
+#
+# Runs in a worker.
+#
+# Returns: the # of ratings in the shard [low, high), or -1 if an
+#          internal error occurred (an error msg is already output).
+def _shard_count(low, high):
+    if _worker_conn is None:
+        return -1
+
+    condition, parameters = _range_sql("Movie_ID", low, high)
+    row = datatier.select_one_row(_worker_conn, "Select count(*) From Ratings Where "
+                                  + condition, parameters)
+
+    if row is None or row == ():
+        return -1
+
+    return row[0]
+
+
+class ShardedAggregator:
+    def __init__(self, path, workers=4):
+        self._Path = path
+        self._Workers = workers
+        self._Bounds = self._split(path, workers)
+        self._Pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_open_worker, initargs=(path,))
+
+    @property
+    def Path(self):
+        return self._Path
+
+    @property
+    def Workers(self):
+        return self._Workers
+
+    # (low, high) Movie_ID range of each shard, None meaning no bound
+    @property
+    def Shards(self):
+        return list(self._Bounds)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # _split:
+    #
+    # Returns: the Movie_ID ranges splitting the movies of the given
+    #          database into (at most) the given # of shards of about
+    #          the same size; a single unbounded shard if the movies
+    #          cannot be counted.
+    @staticmethod
+    def _split(path, shards):
+        dbConn = snapshot.connect(path, "ro")
+        if dbConn is None:
+            return [(None, None)]
+
+        try:
+            row = datatier.select_one_row(dbConn, "Select count(*) From Movies")
+            if row is None or row == ():
+                return [(None, None)]
+
+            cuts = []
+            for k in range(1, shards):
+                cut = datatier.select_one_row(
+                    dbConn, "Select Movie_ID From Movies Order By Movie_ID Limit 1 Offset ?",
+                    [row[0] * k // shards])
+                if cut is None:
+                    return [(None, None)]
+                if cut != () and (len(cuts) == 0 or cut[0] > cuts[-1]):
+                    cuts.append(cut[0])
+        finally:
+            dbConn.close()
+
+        bounds = [None] + cuts + [None]
+        return list(zip(bounds, bounds[1:]))
+
+    # _map:
+    #
+    # Runs the given worker function on every shard, with the
+    # shard's bounds followed by the given arguments.
+    #
+    # Returns: the list of results, one per shard, or None if a
+    #          worker died (an error msg is output).
+    def _map(self, function, *args):
+        try:
+            futures = [self._Pool.submit(function, low, high, *args)
+                       for low, high in self._Bounds]
+            return [future.result() for future in futures]
+        except concurrent.futures.process.BrokenProcessPool as err:
+            print(function.__name__, "failed:", err)
+            return None
+
+    # top_N:
+    #
+    # gets and returns the top N movies based on their average
+    # rating, where each movie has at least the specified # of
+    # reviews, as objecttier.get_top_N_movies does. Pass None as
+    # N to get every such movie.
+    #
+    # Returns: a list of 0 or more MovieRating objects; None is
+    #          returned if an internal error occurred (in which
+    #          case an error msg is already output).
+    def top_N(self, N, min_num_reviews):
+        if N is not None:
+            N = max(int(N), 0)
+        partials = self._map(_shard_top, N, max(int(min_num_reviews), 1))
+
+        if partials is None or None in partials:
+            return None
+
+        movies = []
+        for row in itertools.islice(heapq.merge(*partials), N):
+            movies.append(objecttier.MovieRating(row[1], row[2], row[3], row[4], row[5]))
+
+        return movies
+
+    # num_reviews:
+    #
+    # Returns: the # of ratings, as objecttier.num_reviews; -1 if an
+    #          internal error occurred (an error msg is already output).
+    def num_reviews(self):
+        counts = self._map(_shard_count)
+
+        if counts is None or -1 in counts:
+            return -1
+
+        return sum(counts)
+
+    # close:
+    #
+    # Waits for the aggregations already started, then stops the
+    # worker processes.
+    def close(self):
+        self._Pool.shutdown(wait=True)
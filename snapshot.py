@@ -0,0 +1,180 @@
+#
+# File: snapshot.py
+#
+# Read-only snapshot connections for read-heavy serving.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# A server that only answers lookups never changes the database, yet an
+# ordinary connection still pays for being able to: every read takes a shared
+# lock on the file and checks whether another connection changed it since,
+# and every page goes through a read() call into SQLite's page cache. A
+# snapshot connection opens the database read-only instead, in one of these
+# modes:
+#
+#   ro         the file is opened with mode=ro, so nothing can be written,
+#              but changes by other connections are still seen
+#   immutable  the file is also opened with immutable=1: SQLite takes no
+#              locks and never checks for changes, so the file must not
+#              change while it is open
+#   memory     the database is copied into memory with the backup API when
+#              the connection is opened, and read from there
+#
+# On top of any mode, mmap_size lets SQLite read the file through a memory
+# map rather than read() calls, and cache_size sets the size of the page
+# cache (as PRAGMA cache_size: pages if positive, KiB if negative).
+#
+# Snapshot connections are CachedConnection objects (see stmtcache.py) and
+# can be passed to every datatier and objecttier function; the functions
+# that write fail as for any other database error. A SnapshotPool is a
+# ConnectionPool (see connpool.py) of snapshot connections, for serving from
+# several threads; in memory mode its connections share a single copy.
+#
+# The rating summary and row counts (see aggregates.py) cannot be installed
+# on a snapshot, so they must already be in the database.
+#
+import os
+import sqlite3
+import itertools
+import urllib.parse
+import connpool
+import stmtcache
+
+
+MODES = ["ro", "immutable", "memory"]
+
+# Defaults for serving: map up to 256 MB of the file, cache 64 MB of pages
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE = -64 * 1024
+
+# Numbers the shared in-memory copies of SnapshotPool objects
+_copies = itertools.count(1)
+
+
+# _file_uri:
+#
+# Returns: the URI of the given database file with the given query
+#          parameters.
+def _file_uri(path, **params):
+    return ("file:" + urllib.parse.quote(os.path.abspath(path))
+            + "?" + urllib.parse.urlencode(params))
+
+
+# _tune:
+#
+# Sets the memory map and page cache size of the given connection
+# (a value of None leaves the setting alone) and forbids writes.
+def _tune(dbConn, mmap_size, cache_size):
+    if mmap_size is not None:
+        dbConn.execute("PRAGMA mmap_size = " + str(int(mmap_size)))
+    if cache_size is not None:
+        dbConn.execute("PRAGMA cache_size = " + str(int(cache_size)))
+    dbConn.execute("PRAGMA query_only = 1")
+
+
+# _copy:
+#
+# Copies the given database file into the given (empty) connection
+# with the backup API.
+def _copy(path, dbConn):
+    source = sqlite3.connect(_file_uri(path, mode="ro"), uri=True)
+    try:
+        source.backup(dbConn)
+    finally:
+        source.close()
+
+
+# connect:
+#
+# Opens a read-only connection to the given database file in the
+# given mode (one of MODES), with the given memory map and page
+# cache sizes; any other keyword arguments are passed on to
+# sqlite3.connect.
+#
+# Returns: the new connection, or None if the mode is unknown or
+#          the database could not be opened (in which case an error
+#          msg is output).
+def connect(path, mode="immutable", mmap_size=MMAP_SIZE, cache_size=CACHE_SIZE, **kwargs):
+    if mode not in MODES:
+        print("snapshot.connect failed: unknown mode", mode)
+        return None
+
+    dbConn = None
+    try:
+        if mode == "memory":
+            dbConn = stmtcache.connect(":memory:", **kwargs)
+            _copy(path, dbConn)
+        else:
+            params = {"mode": "ro"}
+            if mode == "immutable":
+                params["immutable"] = 1
+            dbConn = stmtcache.connect(_file_uri(path, **params), uri=True, **kwargs)
+
+        _tune(dbConn, mmap_size, cache_size)
+        return dbConn
+    except sqlite3.Error as err:
+        print("snapshot.connect failed:", err)
+        if dbConn is not None:
+            dbConn.close()
+        return None
+
+
+# SnapshotPool:
+#
+# A ConnectionPool whose connections are snapshot connections in the
+# given mode. In memory mode the database is copied once, into an
+# in-memory database shared by the pool's connections, and lives as
+# long as the pool. Raises sqlite3.Error if the database cannot be
+# opened.
+class SnapshotPool(connpool.ConnectionPool):
+    def __init__(self, path, mode="immutable", size=4, timeout=5.0,
+                 mmap_size=MMAP_SIZE, cache_size=CACHE_SIZE):
+        if mode not in MODES:
+            raise ValueError("unknown snapshot mode: " + str(mode))
+
+        self._Mode = mode
+        self._Mmap_Size = mmap_size
+        self._Cache_Size = cache_size
+        if mode == "memory":
+            self._Uri = "file:snapshot-{}?mode=memory&cache=shared".format(next(_copies))
+        else:
+            params = {"mode": "ro"}
+            if mode == "immutable":
+                params["immutable"] = 1
+            self._Uri = _file_uri(path, **params)
+
+        super().__init__(path, size, timeout)
+
+    @property
+    def Mode(self):
+        return self._Mode
+
+    def _connect(self):
+        dbConn = stmtcache.connect(self._Uri, uri=True, timeout=self._Timeout,
+                                   check_same_thread=False)
+        _tune(dbConn, self._Mmap_Size, self._Cache_Size)
+        return dbConn
+
+    # The "writer" only keeps the shared in-memory copy alive; every
+    # write through it fails, as the connection is query only
+    def _open_writer(self):
+        dbConn = stmtcache.connect(self._Uri, uri=True, timeout=self._Timeout,
+                                   check_same_thread=False)
+        if self._Mode == "memory":
+            _copy(self._Path, dbConn)
+        _tune(dbConn, self._Mmap_Size, self._Cache_Size)
+        return dbConn
+
+
+# read_only:
+#
+# Returns: True if the given connection or pool cannot write to
+#          its database (a snapshot, or a connection with query_only
+#          set), False if it can.
+def read_only(dbConn):
+    if isinstance(dbConn, SnapshotPool):
+        return True
+    if isinstance(dbConn, connpool.ConnectionPool):
+        return False
+    return dbConn.execute("PRAGMA query_only").fetchone()[0] == 1
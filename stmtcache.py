@@ -0,0 +1,230 @@
+#
+# File: stmtcache.py
+#
+# Statement registry and statement-cache aware connections for the data tier.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# sqlite3 keeps a cache of prepared statements per connection, keyed by the
+# exact SQL text, so a query only avoids being re-prepared if its text is
+# identical every time and the cache is large enough to hold every query in
+# use. The object tier registers each of its queries here under a name; the
+# registered text is canonical (runs of whitespace collapsed), so the same
+# query always hits the same cache entry.
+#
+# Connections opened with connect are CachedConnection objects, which have
+# a larger statement cache and keep one cursor around for the data tier to
+# reuse. They also follow which statements sqlite3 has cached, so stats can
+# report the cache hit rate of every registered statement.
+#
+# Modules that keep something per connection (the leaderboard, the caches)
+# register a hook with on_close to drop it. Closing a CachedConnection, or a
+# ConnectionPool (see connpool.py), calls every hook with it.
+#
+import sqlite3
+import threading
+import collections
+
+
+# Statements cached per connection, sqlite3 only caches 128 by default
+CACHED_STATEMENTS = 512
+
+
+# Registered statements: canonical SQL text -> name
+_names = {}
+
+# Per statement name: [# of executions, # of statement cache hits]
+_counts = {}
+_lock = threading.Lock()
+
+# Functions called with every connection or pool that is closed
+_close_hooks = []
+
+
+# canonical:
+#
+# Returns: the given SQL text with every run of whitespace outside
+#          of quotes collapsed into one space, and without leading
+#          or trailing whitespace and semicolons.
+def canonical(sql):
+    parts = []
+    quote = None
+    space = False
+    for c in sql:
+        if quote is not None:
+            parts.append(c)
+            if c == quote:
+                quote = None
+        elif c.isspace():
+            space = True
+        else:
+            if space and len(parts) > 0:
+                parts.append(" ")
+            space = False
+            parts.append(c)
+            if c in "'\"":
+                quote = c
+    return "".join(parts).rstrip("; ")
+
+
+# register:
+#
+# Registers the given SQL text as the statement with the given
+# name; several texts may share one name, for instance variants
+# of the same query for different numbers of parameters.
+#
+# Returns: the canonical SQL text, to be passed to the data tier.
+def register(name, sql):
+    sql = canonical(sql)
+    with _lock:
+        _names[sql] = name
+        _counts.setdefault(name, [0, 0])
+    return sql
+
+
+class CachedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._Cursor = None
+        self._Capacity = kwargs.get("cached_statements", 128)
+        self._Prepared = collections.OrderedDict()
+
+    def close(self):
+        closing(self)
+        super().close()
+
+
+# on_close:
+#
+# Registers hook, which is called with every CachedConnection or
+# ConnectionPool as it is closed, to drop what is kept for it.
+def on_close(hook):
+    with _lock:
+        _close_hooks.append(hook)
+
+
+# closing:
+#
+# Calls every hook registered with on_close with the given
+# connection or pool, which is about to be closed.
+def closing(dbConn):
+    with _lock:
+        hooks = list(_close_hooks)
+    for hook in hooks:
+        hook(dbConn)
+
+
+# connect:
+#
+# Opens a CachedConnection to the given database; any other
+# keyword arguments are passed on to sqlite3.connect.
+#
+# Returns: the new connection.
+def connect(path, cached_statements=CACHED_STATEMENTS, **kwargs):
+    return sqlite3.connect(path, factory=CachedConnection,
+                           cached_statements=cached_statements, **kwargs)
+
+
+# record:
+#
+# Counts one execution of the given SQL text on the given
+# connection, and whether sqlite3 will find it in the
+# connection's statement cache (which is least recently used,
+# like the copy kept here).
+def record(dbConn, sql):
+    hit = 0
+    if isinstance(dbConn, CachedConnection):
+        prepared = dbConn._Prepared
+        if sql in prepared:
+            prepared.move_to_end(sql)
+            hit = 1
+        else:
+            prepared[sql] = True
+            if len(prepared) > dbConn._Capacity:
+                prepared.popitem(last=False)
+
+    name = _names.get(sql)
+    if name is None:
+        return
+
+    with _lock:
+        counts = _counts[name]
+        counts[0] += 1
+        counts[1] += hit
+
+
+# cursor:
+#
+# Returns: a cursor for the given connection; the cursor kept by
+#          a CachedConnection if it is not in use, otherwise a new
+#          one. Pass it to release once done with it.
+def cursor(dbConn):
+    if isinstance(dbConn, CachedConnection) and dbConn._Cursor is not None:
+        dbCursor = dbConn._Cursor
+        dbConn._Cursor = None
+        return dbCursor
+
+    return dbConn.cursor()
+
+
+# release:
+#
+# Gives back a cursor obtained from cursor. It is kept for reuse
+# only if its statement ran to completion: a statement left with
+# rows to fetch would hold the connection's read snapshot open.
+# Otherwise the cursor is closed.
+def release(dbConn, dbCursor):
+    if isinstance(dbConn, CachedConnection) and dbConn._Cursor is None:
+        try:
+            if dbCursor.fetchone() is None:
+                dbConn._Cursor = dbCursor
+                return
+        except sqlite3.Error:
+            pass
+
+    dbCursor.close()
+
+
+# name:
+#
+# Returns: the name the given SQL text is registered under, or None
+#          if it is not registered.
+def name(sql):
+    return _names.get(sql)
+
+
+# statements:
+#
+# Returns: a list of (name, SQL text) pairs, one per registered
+#          statement text, in order by name.
+def statements():
+    with _lock:
+        return sorted((name, sql) for sql, name in _names.items())
+
+
+# stats:
+#
+# Returns: a dictionary with an entry per registered statement name,
+#          giving its # of executions, statement cache hits and the
+#          hit rate (0.0 if it was never executed).
+def stats():
+    with _lock:
+        report = {}
+        for name, (executions, hits) in _counts.items():
+            report[name] = {
+                "executions": executions,
+                "hits": hits,
+                "hit_rate": hits / executions if executions > 0 else 0.0,
+            }
+        return report
+
+
+# reset_stats:
+#
+# Sets the execution and hit counts of every statement back to 0.
+def reset_stats():
+    with _lock:
+        for counts in _counts.values():
+            counts[0] = 0
+            counts[1] = 0
@@ -0,0 +1,191 @@
+#
+# File: titlesearch.py
+#
+# Full-text index over movie titles for the object tier.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# A "like" pattern with a leading % can never use an index, so searching
+# titles that way scans the whole Movies table. This file maintains an FTS5
+# index over Movies.Title (the Movies_Title_FTS table), kept in sync with
+# Movies by triggers, and turns a user's search text into an FTS5 query for
+# one of three search modes:
+#
+#   token   titles containing every word of the search text
+#   prefix  titles containing a word starting with each word of the text
+#   ranked  titles containing any of the words, best matches first
+#
+# Search text is split into words on anything that is not a letter or a
+# digit, and matching is case-insensitive. On a database without the index
+# the object tier falls back to "like" (see is_installed). The index can be
+# rebuilt from the command line with:
+#
+#   python3 titlesearch.py rebuild [MovieLens.db]
+#
+import re
+import sys
+import sqlite3
+import datatier
+import stmtcache
+
+
+MODES = ("token", "prefix", "ranked")
+
+# Connections the index is known to be installed on
+_installed = {}
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _trigger_sql():
+    delete = """Insert Into Movies_Title_FTS(Movies_Title_FTS, rowid, Title)
+    Values ('delete', old.Movie_ID, old.Title);"""
+    insert = """Insert Into Movies_Title_FTS(rowid, Title)
+    Values (new.Movie_ID, new.Title);"""
+    return [
+        """Create Trigger If Not Exists Movies_Title_FTS_Insert After Insert
+        On Movies Begin """ + insert + " End",
+        """Create Trigger If Not Exists Movies_Title_FTS_Delete After Delete
+        On Movies Begin """ + delete + " End",
+        """Create Trigger If Not Exists Movies_Title_FTS_Update After Update
+        Of Movie_ID, Title On Movies Begin """ + delete + insert + " End",
+    ]
+
+
+# install_index:
+#
+# Creates the Movies_Title_FTS index and the triggers on Movies
+# that keep it current. If the index did not exist yet it is
+# built from the Movies table. Calling this on a database that
+# already has the index installed does nothing.
+#
+# Returns: 1 if the index is installed, 0 if an internal error
+#          occurred (in which case an error msg is already output).
+def install_index(dbConn):
+    sql = """Select count(*) From sqlite_master Where type = 'table'
+    And name = 'Movies_Title_FTS'"""
+    row = datatier.select_one_row(dbConn, sql)
+
+    if row is None:
+        return 0
+
+    # Index the titles in Movies, prefixes of 2 and 3 letters get their own index
+    sql = """Create Virtual Table If Not Exists Movies_Title_FTS Using
+    fts5(Title, content = 'Movies', content_rowid = 'Movie_ID',
+    prefix = '2 3')"""
+    actions = [(sql, [])]
+    actions += [(sql, []) for sql in _trigger_sql()]
+
+    if row[0] == 0:
+        actions.append(("Insert Into Movies_Title_FTS(Movies_Title_FTS) Values ('rebuild')", []))
+
+    if datatier.perform_transaction(dbConn, actions) == -1:
+        return 0
+
+    _installed[dbConn] = True
+    return 1
+
+
+# is_installed:
+#
+# Returns: True if the index is installed in the database of the
+#          given connection, False if not or if an internal error
+#          occurred (in which case an error msg is already output).
+def is_installed(dbConn):
+    if dbConn in _installed:
+        return True
+
+    sql = """Select count(*) From sqlite_master Where type = 'table'
+    And name = 'Movies_Title_FTS'"""
+    row = datatier.select_one_row(dbConn, sql)
+
+    if row is None or row == () or row[0] == 0:
+        return False
+
+    _installed[dbConn] = True
+    return True
+
+
+# rebuild_index:
+#
+# Discards the contents of Movies_Title_FTS and re-indexes every
+# title in the Movies table.
+#
+# Returns: 1 if the index was rebuilt, 0 if an internal error
+#          occurred (in which case an error msg is already output).
+def rebuild_index(dbConn):
+    sql = "Insert Into Movies_Title_FTS(Movies_Title_FTS) Values ('rebuild')"
+    if datatier.perform_transaction(dbConn, [(sql, [])]) == -1:
+        return 0
+
+    return 1
+
+
+# words:
+#
+# Returns: the list of words of the given search text.
+def words(text):
+    return _WORD.findall(text)
+
+
+# build_query:
+#
+# Translates search text into an FTS5 query for the given mode
+# (see MODES). Each word is quoted, so characters that have a
+# meaning in FTS5 queries are taken literally.
+#
+# Returns: the FTS5 query string, or None if the text does not
+#          contain any words.
+def build_query(text, mode):
+    found = words(text)
+    if len(found) == 0:
+        return None
+
+    terms = ['"' + w + '"' for w in found]
+
+    if mode == "prefix":
+        return " AND ".join(t + " *" for t in terms)
+    elif mode == "ranked":
+        return " OR ".join(terms)
+    else:
+        return " AND ".join(terms)
+
+
+# has_wildcards:
+#
+# Returns: True if the given text uses the _ or % wildcards of a
+#          SQL "like" pattern, in which case it cannot be searched
+#          through the index.
+def has_wildcards(text):
+    return "%" in text or "_" in text
+
+
+# _release:
+#
+# Forgets the given connection, as it is closed.
+def _release(dbConn):
+    _installed.pop(dbConn, None)
+
+
+stmtcache.on_close(_release)
+
+
+##################################################################
+#
+# main:
+#
+# Usage: python3 titlesearch.py rebuild [database]
+#
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("usage: python3 titlesearch.py rebuild [database]")
+        sys.exit(2)
+
+    path = sys.argv[2] if len(sys.argv) > 2 else "MovieLens.db"
+    dbConn = sqlite3.connect(path)
+
+    if install_index(dbConn) == 0 or rebuild_index(dbConn) == 0:
+        sys.exit(1)
+
+    print("Title index rebuilt")
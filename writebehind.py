@@ -0,0 +1,281 @@
+#
+# File: writebehind.py
+#
+# Write-behind queue that inserts reviews in group commits.
+#
+# Daniel Valencia
+# MovieLens Application
+#
+# objecttier.add_review commits every review on its own, so when many
+# clients add reviews at once each one waits for its own commit. A
+# ReviewQueue takes reviews into an in-memory queue instead, and a
+# background thread inserts them in groups, one transaction (and so one
+# commit) per group: a group is written as soon as it has batch_size
+# reviews, or max_delay seconds after its first review arrived, whichever
+# comes first.
+#
+# Each review can be added durably, in which case add_review waits until
+# its group is committed and returns what objecttier.add_review would, or
+# fire-and-forget, in which case add_review returns as soon as the review
+# is queued (and a review for a movie that does not exist is only counted
+# as rejected later). The queue holds at most max_pending reviews: once it
+# is full, add_review blocks until the writer catches up, for at most
+# put_timeout seconds (None waits as long as it takes). close writes every
+# review still queued before stopping the writer.
+#
+# The writer runs on its own thread, so the queue needs a ConnectionPool
+# (see connpool.py), which the rest of the program uses as well so the
+# leaderboard and caches patched after each group are the ones it reads.
+# Use enable to give a pool a queue, which the program's commands then add
+# reviews through (see get_queue).
+#
+import time
+import queue
+import threading
+import concurrent.futures
+import objecttier
+import stmtcache
+
+
+class ReviewQueue:
+    def __init__(self, dbConn, batch_size=500, max_delay=0.05,
+                 max_pending=10000, put_timeout=None, durable=True):
+        self._DbConn = dbConn
+        self._Batch_Size = batch_size
+        self._Max_Delay = max_delay
+        self._Put_Timeout = put_timeout
+        self._Durable = durable
+        self._Queue = queue.Queue(maxsize=max_pending)
+        self._Lock = threading.Lock()
+        self._Closed = False
+
+        # Held while queuing, so close never misses a review being queued
+        self._Submit_Lock = threading.Lock()
+
+        self._Queued = 0
+        self._Inserted = 0
+        self._Rejected = 0
+        self._Dropped = 0
+        self._Blocked = 0
+        self._Groups = 0
+        self._Max_Depth = 0
+
+        self._Writer = threading.Thread(target=self._run, name="review-writer", daemon=True)
+        self._Writer.start()
+
+    @property
+    def Batch_Size(self):
+        return self._Batch_Size
+
+    @property
+    def Max_Delay(self):
+        return self._Max_Delay
+
+    @property
+    def Durable(self):
+        return self._Durable
+
+    # submit:
+    #
+    # Queues the given review, blocking while the queue is full (for
+    # at most put_timeout seconds). Reviews are queued one at a time,
+    # so a caller waiting for room holds up the others, and close.
+    #
+    # Returns: a Future whose result is 1 once the review is inserted
+    #          and 0 if it is rejected; None if the queue is closed or
+    #          stayed full for put_timeout seconds.
+    def submit(self, movie_id, rating):
+        future = concurrent.futures.Future()
+        item = (movie_id, rating, future)
+
+        with self._Submit_Lock:
+            if self._Closed:
+                return None
+
+            try:
+                self._Queue.put_nowait(item)
+            except queue.Full:
+                with self._Lock:
+                    self._Blocked += 1
+                try:
+                    self._Queue.put(item, timeout=self._Put_Timeout)
+                except queue.Full:
+                    with self._Lock:
+                        self._Dropped += 1
+                    return None
+
+        with self._Lock:
+            self._Queued += 1
+            self._Max_Depth = max(self._Max_Depth, self._Queue.qsize())
+        return future
+
+    # add_review:
+    #
+    # Queues the given review --- a rating value 0..10 --- for the
+    # given movie. If wait is True (by default, if the queue is
+    # durable) waits until the review has been committed.
+    #
+    # Returns: when waiting, 1 if the review was inserted and 0 if
+    #          not, as objecttier.add_review; otherwise 1 once the
+    #          review is queued. 0 is also returned if the queue is
+    #          closed or stayed full for put_timeout seconds.
+    def add_review(self, movie_id, rating, wait=None):
+        future = self.submit(movie_id, rating)
+        if future is None:
+            return 0
+
+        if wait is None:
+            wait = self._Durable
+        if not wait:
+            return 1
+
+        return future.result()
+
+    # _collect:
+    #
+    # Returns: the next group of queued items: blocks for the first
+    #          one (for at most timeout seconds, returning [] if none
+    #          comes), then takes more until the group is full or
+    #          max_delay seconds have passed.
+    def _collect(self, timeout):
+        try:
+            group = [self._Queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self._Max_Delay
+        while len(group) < self._Batch_Size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    group.append(self._Queue.get(timeout=remaining))
+                else:
+                    group.append(self._Queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return group
+
+    # _write:
+    #
+    # Inserts a group of items in one transaction and resolves their
+    # futures with the outcome of each.
+    def _write(self, group):
+        reviews = [(movie_id, rating) for movie_id, rating, _ in group]
+        try:
+            outcomes = objecttier.add_reviews_many(self._DbConn, reviews)
+        except Exception as err:
+            print("review writer failed:", err)
+            outcomes = [0] * len(group)
+
+        inserted = sum(outcomes)
+        with self._Lock:
+            self._Groups += 1
+            self._Inserted += inserted
+            self._Rejected += len(group) - inserted
+
+        for (_, _, future), outcome in zip(group, outcomes):
+            future.set_result(outcome)
+        for _ in group:
+            self._Queue.task_done()
+
+    def _run(self):
+        while True:
+            with self._Lock:
+                closed = self._Closed
+
+            group = self._collect(timeout=0.1)
+            if len(group) > 0:
+                self._write(group)
+            elif closed:
+                return
+
+    # flush:
+    #
+    # Waits until every review queued so far has been written.
+    def flush(self):
+        self._Queue.join()
+
+    # close:
+    #
+    # Stops taking reviews, writes every review still queued and
+    # stops the writer.
+    def close(self):
+        with self._Submit_Lock:
+            with self._Lock:
+                self._Closed = True
+        self._Writer.join()
+
+        # Reviews queued while the writer was stopping
+        group = []
+        while True:
+            try:
+                group.append(self._Queue.get_nowait())
+            except queue.Empty:
+                break
+        if len(group) > 0:
+            self._write(group)
+
+    # stats:
+    #
+    # Returns: a dictionary of counters: reviews queued, inserted,
+    #          rejected and dropped (the queue stayed full), how often
+    #          a caller had to wait for room in the queue, groups
+    #          committed and their mean size, and the current and
+    #          largest queue depth.
+    def stats(self):
+        with self._Lock:
+            written = self._Inserted + self._Rejected
+            return {
+                "queued": self._Queued,
+                "inserted": self._Inserted,
+                "rejected": self._Rejected,
+                "dropped": self._Dropped,
+                "blocked": self._Blocked,
+                "groups": self._Groups,
+                "mean_group_size": written / self._Groups if self._Groups > 0 else 0.0,
+                "depth": self._Queue.qsize(),
+                "max_depth": self._Max_Depth,
+            }
+
+
+# Queues enabled so far, one per connection pool
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+# enable:
+#
+# Starts a ReviewQueue for the given ConnectionPool, with the given
+# options (see ReviewQueue), closing any queue it had.
+#
+# Returns: the new ReviewQueue.
+def enable(dbConn, **options):
+    disable(dbConn)
+    reviews = ReviewQueue(dbConn, **options)
+    with _queues_lock:
+        _queues[dbConn] = reviews
+    return reviews
+
+
+# disable:
+#
+# Closes the queue of the given pool, if it has one, once every
+# review in it has been written.
+def disable(dbConn):
+    with _queues_lock:
+        reviews = _queues.pop(dbConn, None)
+    if reviews is not None:
+        reviews.close()
+
+
+# get_queue:
+#
+# Returns: the queue of the given pool, or None if write-behind is
+#          not enabled for it.
+def get_queue(dbConn):
+    return _queues.get(dbConn)
+
+
+# A pool closed with its queue still enabled writes the queued reviews first
+stmtcache.on_close(disable)